@@ -0,0 +1,171 @@
+import time
+import asyncio
+from typing import Any, Dict, Optional
+
+import httpx
+
+DEFAULT_AUTH_URL = "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data"
+
+
+class AuthServiceUnavailable(Exception):
+    """Raised when the auth service is failing, saturated or the breaker is open."""
+
+
+class InvalidSessionId(Exception):
+    """Raised when the auth service rejects the session_id."""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+    Opens after `failure_threshold` failures, lets one probe through
+    after `reset_timeout` seconds and closes again on success.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow_request(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def release_probe(self):
+        """Give up a half-open probe slot without recording an outcome."""
+        self._probing = False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+class EmergentAuthClient:
+    """
+    Shared, pooled HTTP client for the Emergent session-data exchange.
+    Call start() on startup and close() on shutdown.
+    """
+
+    def __init__(
+        self,
+        url: str = DEFAULT_AUTH_URL,
+        timeout: float = 10.0,
+        max_concurrency: int = 50,
+        acquire_timeout: float = 2.0,
+        breaker: Optional[CircuitBreaker] = None,
+        http2: bool = True
+    ):
+        self.url = url
+        self.timeout = timeout
+        self.acquire_timeout = acquire_timeout
+        self.max_concurrency = max_concurrency
+        self.breaker = breaker or CircuitBreaker()
+        self.http2 = http2
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client: Optional[httpx.AsyncClient] = None
+        self.requests = 0
+        self.failures = 0
+        self.rejected = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                http2=self.http2,
+                timeout=self.timeout,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency
+                )
+            )
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def get_session_data(self, session_id: str) -> Dict[str, Any]:
+        if not self.breaker.allow_request():
+            self.rejected += 1
+            raise AuthServiceUnavailable("circuit open")
+
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            self.breaker.release_probe()
+            raise AuthServiceUnavailable("too many concurrent requests")
+
+        if self._client is None:
+            await self.start()
+
+        started = time.perf_counter()
+        try:
+            response = await self._client.get(
+                self.url,
+                headers={"X-Session-ID": session_id}
+            )
+        except httpx.RequestError as e:
+            self._record(started, failed=True)
+            raise AuthServiceUnavailable(str(e)) from e
+        except BaseException:
+            # Cancelled (shutdown, client gone) or unexpected: no outcome to
+            # record, but a half-open probe slot must not stay taken
+            self.breaker.release_probe()
+            raise
+        finally:
+            self._semaphore.release()
+
+        if response.status_code >= 500:
+            self._record(started, failed=True)
+            raise AuthServiceUnavailable(f"upstream status {response.status_code}")
+
+        self._record(started, failed=False)
+        if response.status_code != 200:
+            raise InvalidSessionId()
+
+        return response.json()
+
+    def _record(self, started: float, failed: bool):
+        elapsed = time.perf_counter() - started
+        self.requests += 1
+        self.latency_total += elapsed
+        self.latency_max = max(self.latency_max, elapsed)
+        if failed:
+            self.failures += 1
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "breaker_state": self.breaker.state,
+            "requests": self.requests,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "latency_avg_ms": (self.latency_total / self.requests * 1000) if self.requests else 0.0,
+            "latency_max_ms": self.latency_max * 1000,
+        }
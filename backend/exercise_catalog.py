@@ -0,0 +1,167 @@
+import os
+import gzip
+import json
+import hashlib
+import logging
+from pathlib import Path
+from datetime import datetime, timezone
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DEFINITION_PATH = Path(__file__).parent / "exercises.json"
+
+
+class CatalogSnapshot:
+    """
+    Immutable view of one catalog version with its serialized JSON body,
+    a gzip-compressed copy and a strong ETag derived from the body.
+    """
+
+    __slots__ = ("version", "exercises", "by_id", "body", "gzip_body", "etag")
+
+    def __init__(self, exercises: List[Dict[str, Any]], version: int = 0):
+        frozen = tuple(MappingProxyType(dict(e)) for e in exercises)
+        body = json.dumps(exercises, ensure_ascii=False, separators=(",", ":")).encode()
+
+        object.__setattr__(self, "version", version)
+        object.__setattr__(self, "exercises", frozen)
+        object.__setattr__(self, "by_id", MappingProxyType({e["exercise_id"]: e for e in frozen}))
+        object.__setattr__(self, "body", body)
+        object.__setattr__(self, "gzip_body", gzip.compress(body, compresslevel=9, mtime=0))
+        object.__setattr__(self, "etag", '"' + hashlib.sha256(body).hexdigest()[:32] + '"')
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CatalogSnapshot is immutable")
+
+    def get(self, exercise_id: str) -> Optional[Mapping[str, Any]]:
+        return self.by_id.get(exercise_id)
+
+    def encoded_body(self, accept_encoding: str) -> Tuple[bytes, Optional[str]]:
+        """Body and Content-Encoding to send for an Accept-Encoding header."""
+        if "gzip" in (accept_encoding or "").lower():
+            return self.gzip_body, "gzip"
+        return self.body, None
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        """True when an If-None-Match header covers this snapshot's ETag."""
+        if not if_none_match:
+            return False
+        tags = [t.strip() for t in if_none_match.split(",")]
+        return "*" in tags or self.etag in tags
+
+
+class ExerciseCatalog:
+    """
+    Holds the current catalog snapshot and swaps it as a whole when the
+    catalog version changes. Handlers should read `snapshot` once per request.
+
+    The definition file ({"version": N, "exercises": [...]}) is the source
+    of truth. A newer file version is written to the `exercises` collection
+    and recorded in `catalog_meta`, which every worker polls.
+    """
+
+    def __init__(self, definition_path: Path = DEFAULT_DEFINITION_PATH):
+        self.definition_path = Path(definition_path)
+        self.snapshot = CatalogSnapshot([])
+        self._definition_mtime: Optional[float] = None
+        self.reloads = 0
+
+    def read_definition(self) -> Dict[str, Any]:
+        with open(self.definition_path, encoding="utf-8") as f:
+            definition = json.load(f)
+        self._definition_mtime = os.stat(self.definition_path).st_mtime
+        return definition
+
+    async def sync_definition(self, db):
+        """
+        Write the definition file to the database if it is newer than the
+        stored catalog version. Exercises missing from the file are marked
+        retired. Idempotent, so concurrent workers may run it together.
+        """
+        definition = self.read_definition()
+        version = int(definition["version"])
+        exercises = definition["exercises"]
+
+        if version <= await _stored_version(db):
+            return
+
+        await _remove_duplicate_exercises(db)
+        await db.exercises.create_index("exercise_id", unique=True)
+
+        try:
+            await db.exercises.bulk_write([
+                UpdateOne(
+                    {"exercise_id": e["exercise_id"]},
+                    {"$set": {**e, "retired": False, "catalog_version": version, "position": position}},
+                    upsert=True
+                )
+                for position, e in enumerate(exercises)
+            ], ordered=False)
+        except BulkWriteError as e:
+            # Another worker inserted the same exercises first
+            if any(err.get("code") != 11000 for err in e.details.get("writeErrors", [])):
+                raise
+
+        await db.exercises.update_many(
+            {"exercise_id": {"$nin": [e["exercise_id"] for e in exercises]}},
+            {"$set": {"retired": True}}
+        )
+        # Publish the version last, so pollers only see fully written catalogs
+        await db.catalog_meta.update_one(
+            {"_id": "exercises"},
+            {
+                "$max": {"version": version},
+                "$set": {"updated_at": datetime.now(timezone.utc)}
+            },
+            upsert=True
+        )
+        logger.info(f"Exercise catalog definition v{version} written")
+
+    async def load(self, db):
+        version = await _stored_version(db)
+        # Definition-file order, so every worker serves the same body and ETag
+        exercises = await db.exercises.find(
+            {"retired": {"$ne": True}},
+            {"_id": 0, "retired": 0, "catalog_version": 0, "position": 0}
+        ).sort([("position", 1), ("exercise_id", 1)]).to_list(None)
+        self.snapshot = CatalogSnapshot(exercises, version)
+        self.reloads += 1
+        logger.info(f"Exercise catalog v{version} loaded: {len(exercises)} exercises")
+
+    async def poll(self, db):
+        """
+        Cheap change check: a stat() of the definition file and one point
+        read of catalog_meta. Reloads only when the version moved.
+        """
+        try:
+            mtime = os.stat(self.definition_path).st_mtime
+        except FileNotFoundError:
+            mtime = None
+        if mtime is not None and mtime != self._definition_mtime:
+            await self.sync_definition(db)
+
+        if await _stored_version(db) != self.snapshot.version:
+            await self.load(db)
+
+
+async def _stored_version(db) -> int:
+    meta = await db.catalog_meta.find_one({"_id": "exercises"}, {"version": 1})
+    return meta["version"] if meta else 0
+
+
+async def _remove_duplicate_exercises(db):
+    """Drop duplicates left by the old read-path seeding, keeping the oldest."""
+    duplicates = await db.exercises.aggregate([
+        {"$group": {"_id": "$exercise_id", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ]).to_list(None)
+
+    extra_ids = [oid for group in duplicates for oid in sorted(group["ids"])[1:]]
+    if extra_ids:
+        await db.exercises.delete_many({"_id": {"$in": extra_ids}})
+        logger.info(f"Removed {len(extra_ids)} duplicate exercises")
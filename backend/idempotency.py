@@ -0,0 +1,104 @@
+from datetime import datetime, timezone, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+MAX_KEY_LENGTH = 128
+
+
+class IdempotencyStore:
+    """
+    Client-generated idempotency keys for result saves, on the
+    `idempotency_keys` collection. A unique index on (user, key) makes the
+    first request win; retries get the original result_id back. Keys
+    expire through a TTL index after `ttl` seconds.
+    """
+
+    def __init__(self, db, ttl: int = 86400):
+        self.db = db
+        self.ttl = ttl
+        self.claimed = 0
+        self.replayed = 0
+
+    def _doc(self, user_id: str, key: str, result_id: str) -> Dict[str, object]:
+        now = datetime.now(timezone.utc)
+        return {
+            "key": f"{user_id}:{key}",
+            "result_id": result_id,
+            "created_at": now,
+            "expires_at": now + timedelta(seconds=self.ttl)
+        }
+
+    async def claim(self, user_id: str, key: str, result_id: str) -> Optional[str]:
+        """
+        Claim `key` for a new result. Returns None when claimed, otherwise
+        the result_id saved by the request that claimed it first.
+        """
+        while True:
+            try:
+                await self.db.idempotency_keys.insert_one(self._doc(user_id, key, result_id))
+            except DuplicateKeyError:
+                original = await self._existing_result_id(f"{user_id}:{key}")
+                if original is None:
+                    # The first claim expired between our insert and the read
+                    continue
+                self.replayed += 1
+                return original
+            self.claimed += 1
+            return None
+
+    async def claim_many(self, user_id: str, claims: List[Tuple[str, str]]) -> Dict[str, str]:
+        """
+        Claim several (key, result_id) pairs with one unordered insert.
+        Returns {key: original result_id} for the keys that were already used.
+        """
+        if not claims:
+            return {}
+        try:
+            await self.db.idempotency_keys.insert_many(
+                [self._doc(user_id, key, result_id) for key, result_id in claims],
+                ordered=False
+            )
+            self.claimed += len(claims)
+            return {}
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(err.get("code") != 11000 for err in errors):
+                raise
+            duplicate_keys = [claims[err["index"]][0] for err in errors]
+
+        self.claimed += len(claims) - len(duplicate_keys)
+        existing = await self.db.idempotency_keys.find(
+            {"key": {"$in": [f"{user_id}:{key}" for key in duplicate_keys]}},
+            {"_id": 0, "key": 1, "result_id": 1}
+        ).to_list(len(duplicate_keys))
+        prefix = len(user_id) + 1
+        replayed = {doc["key"][prefix:]: doc["result_id"] for doc in existing}
+        self.replayed += len(replayed)
+
+        # Keys whose first claim expired since our insert are free again
+        result_ids = dict(claims)
+        for key in duplicate_keys:
+            if key not in replayed:
+                original = await self.claim(user_id, key, result_ids[key])
+                if original:
+                    replayed[key] = original
+        return replayed
+
+    async def release(self, user_id: str, key: str):
+        """Forget a claim whose result could not be saved, so a retry can succeed."""
+        await self.db.idempotency_keys.delete_one({"key": f"{user_id}:{key}"})
+
+    async def _existing_result_id(self, key: str) -> Optional[str]:
+        doc = await self.db.idempotency_keys.find_one({"key": key}, {"_id": 0, "result_id": 1})
+        return doc["result_id"] if doc else None
+
+    async def create_indexes(self):
+        await self.db.idempotency_keys.create_index("key", unique=True)
+        await self.db.idempotency_keys.create_index("expires_at", expireAfterSeconds=0)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "claimed": self.claimed,
+            "replayed": self.replayed,
+        }
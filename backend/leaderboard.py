@@ -0,0 +1,247 @@
+import time
+import json
+import base64
+import logging
+from collections import OrderedDict
+from datetime import datetime, timezone
+from itertools import combinations
+from typing import Any, Dict, Iterable, List, Tuple
+
+from pymongo import UpdateOne
+
+from progress import bulk_upsert
+from scoring import ExerciseScoring, get_scoring, partition_key
+
+logger = logging.getLogger(__name__)
+
+
+class UserDisplayCache:
+    """
+    Short-lived LRU of user display info (user_id, name, picture) for
+    leaderboard rows. Misses are loaded with one $in query per lookup.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.queries = 0
+
+    async def get_many(self, db, user_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        now = time.monotonic()
+        found: Dict[str, Dict[str, Any]] = {}
+        missing = []
+        for user_id in user_ids:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                found[user_id] = entry[1]
+            else:
+                missing.append(user_id)
+
+        self.hits += len(found)
+        self.misses += len(missing)
+        if missing:
+            self.queries += 1
+            users = await db.users.find(
+                {"user_id": {"$in": missing}},
+                {"_id": 0, "user_id": 1, "name": 1, "picture": 1}
+            ).to_list(len(missing))
+            for user_doc in users:
+                found[user_doc["user_id"]] = user_doc
+                self._put(user_doc, now)
+        return found
+
+    def _put(self, user_doc: Dict[str, Any], now: float):
+        if self.max_size <= 0:
+            return
+        self._entries[user_doc["user_id"]] = (now + self.ttl, user_doc)
+        self._entries.move_to_end(user_doc["user_id"])
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: str):
+        self._entries.pop(user_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "queries": self.queries,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+        }
+
+
+def entry_update_pipeline(best: float, games: int, lower_is_better: bool, played_at: Any) -> List[Dict[str, Any]]:
+    """
+    Pipeline update folding games into a leaderboard entry. The best value
+    only moves when a game improves on it.
+    """
+    return [
+        {"$set": {
+            "best": {("$min" if lower_is_better else "$max"): [{"$ifNull": ["$best", best]}, best]},
+            "total_games": {"$add": [{"$ifNull": ["$total_games", 0]}, games]},
+            "last_played": played_at,
+            "updated_at": played_at
+        }},
+        {"$set": {
+            "level": {"$add": [1, {"$toInt": {"$floor": {"$divide": ["$total_games", 10]}}}]}
+        }}
+    ]
+
+
+async def bulk_update_leaderboard(db, result_docs: Iterable[Dict[str, Any]]):
+    """
+    Upsert the leaderboard_entries of new results: one document per
+    (exercise, partition, user), with every partition a result counts
+    towards. Results in the batch are coalesced per entry.
+    """
+    entries: Dict[Tuple[str, str, str], List[Any]] = {}
+    for result_doc in result_docs:
+        scoring = get_scoring(result_doc["exercise_id"])
+        value = result_doc.get(scoring.metric)
+        if value is None:
+            continue
+        for partition in scoring.partition_keys(result_doc):
+            key = (result_doc["exercise_id"], partition, result_doc["user_id"])
+            entry = entries.get(key)
+            if entry is None:
+                entries[key] = [value, 1, scoring.lower_is_better]
+            else:
+                entry[0] = min(entry[0], value) if scoring.lower_is_better else max(entry[0], value)
+                entry[1] += 1
+    if not entries:
+        return
+
+    played_at = datetime.now(timezone.utc)
+    await bulk_upsert(db.leaderboard_entries, [
+        UpdateOne(
+            {"exercise_id": exercise_id, "partition": partition, "user_id": user_id},
+            entry_update_pipeline(best, games, lower_is_better, played_at),
+            upsert=True
+        )
+        for (exercise_id, partition, user_id), (best, games, lower_is_better) in entries.items()
+    ])
+
+
+def keyset_filter(best: Any, user_id: str, direction: int, after: bool = True) -> Dict[str, Any]:
+    """
+    leaderboard_entries ranked after (or before) the entry (best, user_id)
+    in a ranking sorted by (best, user_id) in `direction`. Served as a
+    range on the (exercise_id, partition, best, user_id) index.
+    """
+    op = "$gt" if (direction == 1) == after else "$lt"
+    return {"$or": [
+        {"best": {op: best}},
+        {"best": best, "user_id": {op: user_id}}
+    ]}
+
+
+def encode_cursor(best: Any, user_id: str) -> str:
+    """Opaque pagination cursor for the entry (best, user_id)."""
+    raw = json.dumps([best, user_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, str]:
+    """(best, user_id) of a cursor from encode_cursor. Raises ValueError when malformed."""
+    try:
+        best, user_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    if isinstance(best, bool) or not isinstance(best, (int, float)) or not isinstance(user_id, str):
+        raise ValueError("Invalid cursor")
+    return best, user_id
+
+
+async def create_indexes(db):
+    await db.leaderboard_entries.create_index(
+        [("exercise_id", 1), ("partition", 1), ("user_id", 1)],
+        unique=True
+    )
+    # Top-N of a leaderboard is a range read on this index, in either direction
+    await db.leaderboard_entries.create_index(
+        [("exercise_id", 1), ("partition", 1), ("best", 1), ("user_id", 1)]
+    )
+    # Entries changed since a point in time, for in-memory copies to sync
+    await db.leaderboard_entries.create_index("updated_at")
+
+
+async def rebuild_leaderboard(db, scoring: ExerciseScoring, batch_size: int = 500) -> int:
+    """
+    Recompute the leaderboard_entries of one exercise from user_results,
+    for every partition combination, and drop entries no result backs.
+    Entries that saves write to while the rebuild runs are kept as the
+    saves left them, not recomputed; run it again once saves are quiet to
+    recompute those too.
+    """
+    started = datetime.now(timezone.utc)
+    best = "$min" if scoring.lower_is_better else "$max"
+    written = 0
+
+    # Entries a save touched since the start may count games the
+    # aggregation did not see; they are left as the save wrote them
+    saved_since_start = {"$gte": ["$last_played", started]}
+
+    for size in range(len(scoring.partitions) + 1):
+        for subset in combinations(scoring.partitions, size):
+            rows = db.user_results.aggregate([
+                {"$match": {
+                    "exercise_id": scoring.exercise_id,
+                    scoring.metric: {"$ne": None},
+                    **{name: {"$ne": None} for name in subset}
+                }},
+                {"$group": {
+                    "_id": {"user_id": "$user_id", **{name: f"${name}" for name in subset}},
+                    "best": {best: f"${scoring.metric}"},
+                    "total_games": {"$sum": 1},
+                    "last_played": {"$max": "$created_at"}
+                }}
+            ], allowDiskUse=True)
+
+            operations = []
+            async for row in rows:
+                operations.append(UpdateOne(
+                    {
+                        "exercise_id": scoring.exercise_id,
+                        "partition": partition_key({name: row["_id"][name] for name in subset}),
+                        "user_id": row["_id"]["user_id"]
+                    },
+                    [
+                        {"$replaceWith": {"$cond": [
+                            saved_since_start,
+                            "$$ROOT",
+                            {"$mergeObjects": ["$$ROOT", {"$literal": {
+                                "best": row["best"],
+                                "total_games": row["total_games"],
+                                "level": 1 + row["total_games"] // 10,
+                                "last_played": row["last_played"]
+                            }}]}
+                        ]}},
+                        {"$set": {"rebuilt_at": started, "updated_at": datetime.now(timezone.utc)}}
+                    ],
+                    upsert=True
+                ))
+                if len(operations) >= batch_size:
+                    await bulk_upsert(db.leaderboard_entries, operations)
+                    written += len(operations)
+                    operations = []
+            if operations:
+                await bulk_upsert(db.leaderboard_entries, operations)
+                written += len(operations)
+
+    await db.leaderboard_entries.delete_many({
+        "exercise_id": scoring.exercise_id,
+        "last_played": {"$lt": started},
+        "$or": [
+            {"rebuilt_at": {"$lt": started}},
+            {"rebuilt_at": {"$exists": False}}
+        ]
+    })
+    logger.info(f"Rebuilt {written} leaderboard entries for {scoring.exercise_id}")
+    return written
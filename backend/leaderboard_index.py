@@ -0,0 +1,386 @@
+"""
+In-memory leaderboards: each process keeps an ordered copy of
+leaderboard_entries, warmed at startup, updated as saves are accepted and
+synced from Mongo for saves made by other processes.
+"""
+import time
+import logging
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from scoring import get_scoring
+
+logger = logging.getLogger(__name__)
+
+ENTRY_FIELDS = {"_id": 0, "exercise_id": 1, "partition": 1, "user_id": 1, "best": 1, "total_games": 1, "level": 1}
+
+
+class RankedBoard:
+    """
+    One leaderboard: players ordered by (best, user_id), with their stats.
+
+    Items live in sorted buckets of about LOAD items, and a Fenwick tree
+    over the bucket sizes turns positions into buckets. Updates, rank
+    lookups and reading from a position are O(log n). Ranking order matches
+    the Mongo query: ascending for lower-is-better metrics, otherwise
+    descending on both best and user_id.
+    """
+
+    LOAD = 512
+
+    def __init__(self, lower_is_better: bool):
+        self.lower_is_better = lower_is_better
+        self._buckets: List[List[Tuple[float, str]]] = []
+        self._maxes: List[Tuple[float, str]] = []
+        self._tree: List[int] = []
+        self._entries: Dict[str, Tuple[float, int, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def load(self, rows: List[Tuple[str, float, int, int]]):
+        """Replace the board with (user_id, best, total_games, level) rows."""
+        self._entries = {user_id: (best, total_games, level) for user_id, best, total_games, level in rows}
+        items = sorted((stats[0], user_id) for user_id, stats in self._entries.items())
+        self._buckets = [items[i:i + self.LOAD] for i in range(0, len(items), self.LOAD)]
+        self._maxes = [bucket[-1] for bucket in self._buckets]
+        self._rebuild_tree()
+
+    def put(self, user_id: str, best: float, total_games: int, level: int):
+        """Set a player's entry, as stored in leaderboard_entries."""
+        old = self._entries.get(user_id)
+        if old is None or old[0] != best:
+            if old is not None:
+                self._remove((old[0], user_id))
+            self._insert((best, user_id))
+        self._entries[user_id] = (best, total_games, level)
+
+    def record(self, user_id: str, value: float, games: int = 1):
+        """Fold new games, whose best metric is `value`, into a player's entry."""
+        old = self._entries.get(user_id)
+        if old is None:
+            best, total_games = value, games
+        else:
+            best = min(old[0], value) if self.lower_is_better else max(old[0], value)
+            total_games = old[1] + games
+        self.put(user_id, best, total_games, 1 + total_games // 10)
+
+    def entry(self, user_id: str) -> Optional[Dict[str, Any]]:
+        stats = self._entries.get(user_id)
+        if stats is None:
+            return None
+        return {"user_id": user_id, "best": stats[0], "total_games": stats[1], "level": stats[2]}
+
+    def rank(self, user_id: str) -> Optional[int]:
+        """0-based position of a player in the ranking, None if absent."""
+        stats = self._entries.get(user_id)
+        if stats is None:
+            return None
+        index = self._index((stats[0], user_id))
+        return index if self.lower_is_better else len(self._entries) - 1 - index
+
+    def top(self, limit: int, offset: int = 0) -> List[Dict[str, Any]]:
+        """Entries at ranking positions offset .. offset + limit - 1."""
+        entries = []
+        for _, user_id in self._iter_ranked(offset):
+            if len(entries) >= limit:
+                break
+            entries.append(self.entry(user_id))
+        return entries
+
+    def top_after(self, best: float, user_id: str, limit: int) -> List[Dict[str, Any]]:
+        """Entries ranked after (best, user_id), which need not be on the board."""
+        if self.lower_is_better:
+            start = self._index((best, user_id), right=True)
+        else:
+            start = len(self._entries) - self._index((best, user_id))
+        return self.top(limit, start)
+
+    def _index(self, item: Tuple[float, str], right: bool = False) -> int:
+        """Ascending position where `item` is, or would be inserted."""
+        pos = bisect_left(self._maxes, item)
+        if pos == len(self._buckets):
+            return len(self._entries)
+        return self._prefix(pos) + (bisect_right if right else bisect_left)(self._buckets[pos], item)
+
+    def _iter_ranked(self, start: int) -> Iterator[Tuple[float, str]]:
+        size = len(self._entries)
+        if start >= size:
+            return
+        if self.lower_is_better:
+            pos, offset = self._locate(start)
+            for bucket in self._buckets[pos:]:
+                yield from bucket[offset:]
+                offset = 0
+        else:
+            pos, offset = self._locate(size - 1 - start)
+            for i in range(pos, -1, -1):
+                bucket = self._buckets[i]
+                yield from reversed(bucket[:offset + 1] if i == pos else bucket)
+
+    def _insert(self, item: Tuple[float, str]):
+        if not self._buckets:
+            self._buckets.append([item])
+            self._maxes.append(item)
+            self._rebuild_tree()
+            return
+        pos = bisect_left(self._maxes, item)
+        if pos == len(self._maxes):
+            pos -= 1
+            self._buckets[pos].append(item)
+            self._maxes[pos] = item
+        else:
+            insort(self._buckets[pos], item)
+        self._tree_add(pos, 1)
+
+        bucket = self._buckets[pos]
+        if len(bucket) > 2 * self.LOAD:
+            self._buckets.insert(pos + 1, bucket[self.LOAD:])
+            del bucket[self.LOAD:]
+            self._maxes[pos] = bucket[-1]
+            self._maxes.insert(pos + 1, self._buckets[pos + 1][-1])
+            self._rebuild_tree()
+
+    def _remove(self, item: Tuple[float, str]):
+        pos = bisect_left(self._maxes, item)
+        bucket = self._buckets[pos]
+        del bucket[bisect_left(bucket, item)]
+        if bucket:
+            self._maxes[pos] = bucket[-1]
+            self._tree_add(pos, -1)
+        else:
+            del self._buckets[pos]
+            del self._maxes[pos]
+            self._rebuild_tree()
+
+    # Fenwick tree over bucket sizes
+
+    def _rebuild_tree(self):
+        tree = [len(bucket) for bucket in self._buckets]
+        for i in range(len(tree)):
+            parent = i | (i + 1)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _tree_add(self, pos: int, delta: int):
+        tree = self._tree
+        while pos < len(tree):
+            tree[pos] += delta
+            pos |= pos + 1
+
+    def _prefix(self, pos: int) -> int:
+        """Number of items in buckets before `pos`."""
+        total = 0
+        while pos > 0:
+            total += self._tree[pos - 1]
+            pos &= pos - 1
+        return total
+
+    def _locate(self, index: int) -> Tuple[int, int]:
+        """Bucket and offset of the item at ascending position `index`."""
+        tree = self._tree
+        pos = 0
+        step = 1 << (len(tree).bit_length() - 1) if tree else 0
+        while step:
+            upper = pos + step
+            if upper <= len(tree) and tree[upper - 1] <= index:
+                index -= tree[upper - 1]
+                pos = upper
+            step >>= 1
+        return pos, index
+
+
+class LeaderboardIndex:
+    """
+    RankedBoards for every (exercise_id, partition) of leaderboard_entries.
+    Runs on the event loop thread only, so no locking is needed.
+
+    Saves accepted by this process are recorded immediately; sync() picks
+    up entries changed elsewhere, by updated_at, and overwrites the local
+    copy with them. `sync_overlap` seconds are re-read every time, to cover
+    writes still in flight during the previous sync. Deleted entries (by
+    leaderboard_rebuild or users_dedupe) leave no trace to sync from, so
+    every `reload_interval` seconds sync() reloads all boards instead.
+    """
+
+    def __init__(self, sync_overlap: float = 10.0, reload_interval: float = 300.0):
+        self.sync_overlap = sync_overlap
+        self.reload_interval = reload_interval
+        self._boards: Dict[Tuple[str, str], RankedBoard] = {}
+        self._synced_until: Optional[datetime] = None
+        self._loaded_at = 0.0
+        self.ready = False
+        self.recorded = 0
+        self.synced = 0
+        self.syncs = 0
+        self.reloads = 0
+
+    def board(self, exercise_id: str, partition: str) -> Optional[RankedBoard]:
+        return self._boards.get((exercise_id, partition))
+
+    def _board(self, exercise_id: str, partition: str) -> RankedBoard:
+        board = self._boards.get((exercise_id, partition))
+        if board is None:
+            board = RankedBoard(get_scoring(exercise_id).lower_is_better)
+            self._boards[(exercise_id, partition)] = board
+        return board
+
+    def top(
+        self,
+        exercise_id: str,
+        partition: str,
+        limit: int,
+        after: Optional[Tuple[float, str]] = None
+    ) -> List[Dict[str, Any]]:
+        """A page of a leaderboard: the first `limit` entries, or those ranked after `after`."""
+        board = self._boards.get((exercise_id, partition))
+        if board is None:
+            return []
+        return board.top_after(*after, limit) if after else board.top(limit)
+
+    def record(self, result_docs: List[Dict[str, Any]]):
+        """Apply new results, like leaderboard.bulk_update_leaderboard does in Mongo."""
+        for result_doc in result_docs:
+            scoring = get_scoring(result_doc["exercise_id"])
+            value = result_doc.get(scoring.metric)
+            if value is None:
+                continue
+            for partition in scoring.partition_keys(result_doc):
+                self._board(result_doc["exercise_id"], partition).record(result_doc["user_id"], value)
+            self.recorded += 1
+
+    def _put(self, entry: Dict[str, Any]):
+        self._board(entry["exercise_id"], entry["partition"]).put(
+            entry["user_id"], entry["best"], entry["total_games"], entry["level"]
+        )
+
+    async def warm(self, db):
+        """
+        Load every leaderboard entry, replacing all boards. Saves made
+        meanwhile are caught by sync().
+        """
+        started = datetime.now(timezone.utc)
+        rows: Dict[Tuple[str, str], List[Tuple[str, float, int, int]]] = {}
+        loaded = 0
+        async for entry in db.leaderboard_entries.find({}, ENTRY_FIELDS).batch_size(10000):
+            rows.setdefault((entry["exercise_id"], entry["partition"]), []).append(
+                (entry["user_id"], entry["best"], entry["total_games"], entry["level"])
+            )
+            loaded += 1
+        boards = {}
+        for (exercise_id, partition), board_rows in rows.items():
+            board = RankedBoard(get_scoring(exercise_id).lower_is_better)
+            board.load(board_rows)
+            boards[(exercise_id, partition)] = board
+        self._boards = boards
+        self._synced_until = started - timedelta(seconds=self.sync_overlap)
+        self._loaded_at = time.monotonic()
+        self.ready = True
+        logger.info(f"Loaded {loaded} leaderboard entries into {len(self._boards)} boards")
+
+    async def sync(self, db):
+        if self._synced_until is None:
+            return
+        if time.monotonic() - self._loaded_at >= self.reload_interval:
+            await self.warm(db)
+            self.reloads += 1
+            return
+        started = datetime.now(timezone.utc)
+        async for entry in db.leaderboard_entries.find(
+            {"updated_at": {"$gte": self._synced_until}},
+            ENTRY_FIELDS
+        ):
+            self._put(entry)
+            self.synced += 1
+        self._synced_until = started - timedelta(seconds=self.sync_overlap)
+        self.syncs += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "boards": len(self._boards),
+            "entries": sum(len(board) for board in self._boards.values()),
+            "recorded": self.recorded,
+            "synced": self.synced,
+            "syncs": self.syncs,
+            "reloads": self.reloads,
+        }
+
+
+if __name__ == "__main__":
+    # Compare in-memory top-N with the Mongo aggregation it replaces.
+    # The Mongo half runs only with MONGO_URL set, against a scratch
+    # database that is dropped afterwards.
+    import asyncio
+    import os
+    import random
+
+    def timed(fn, repeat: int) -> float:
+        started = time.perf_counter()
+        for _ in range(repeat):
+            fn()
+        return (time.perf_counter() - started) / repeat * 1e6
+
+    async def aggregation_us(db, repeat: int = 5) -> Tuple[float, float]:
+        pipeline = [
+            {"$match": {"exercise_id": "schulte"}},
+            {"$group": {"_id": "$user_id", "best_time": {"$min": "$time"}, "total_games": {"$sum": 1}}},
+            {"$sort": {"best_time": 1, "_id": 1}},
+            {"$limit": 10}
+        ]
+        started = time.perf_counter()
+        for _ in range(repeat):
+            await db.user_results.aggregate(pipeline, allowDiskUse=True).to_list(10)
+        grouped = (time.perf_counter() - started) / repeat * 1e6
+        started = time.perf_counter()
+        for _ in range(repeat):
+            await db.leaderboard_entries.find(
+                {"exercise_id": "schulte", "partition": ""}
+            ).sort([("best", 1), ("user_id", 1)]).limit(10).to_list(10)
+        materialized = (time.perf_counter() - started) / repeat * 1e6
+        return grouped, materialized
+
+    async def seed(db, times: List[float]):
+        await db.user_results.drop()
+        await db.leaderboard_entries.drop()
+        await db.user_results.create_index([("exercise_id", 1), ("grid_size", 1), ("time", 1)])
+        await db.leaderboard_entries.create_index([("exercise_id", 1), ("partition", 1), ("best", 1), ("user_id", 1)])
+        for start in range(0, len(times), 10000):
+            chunk = range(start, min(start + 10000, len(times)))
+            await db.user_results.insert_many([
+                {"exercise_id": "schulte", "user_id": f"user_{i}", "time": times[i]} for i in chunk
+            ])
+            await db.leaderboard_entries.insert_many([
+                {"exercise_id": "schulte", "partition": "", "user_id": f"user_{i}",
+                 "best": times[i], "total_games": 1, "level": 1} for i in chunk
+            ])
+
+    db = None
+    if os.environ.get("MONGO_URL"):
+        from motor.motor_asyncio import AsyncIOMotorClient
+        db = AsyncIOMotorClient(os.environ["MONGO_URL"])["leaderboard_index_benchmark"]
+
+    random.seed(7)
+    loop = asyncio.new_event_loop()
+    for users in (10_000, 100_000, 1_000_000):
+        times = [random.lognormvariate(3, 0.5) for _ in range(users)]
+        board = RankedBoard(lower_is_better=True)
+        started = time.perf_counter()
+        board.load([(f"user_{i}", value, 1, 1) for i, value in enumerate(times)])
+        load_s = time.perf_counter() - started
+
+        update_us = timed(lambda: board.record(f"user_{random.randrange(users)}", random.lognormvariate(3, 0.5)), 20000)
+        top_us = timed(lambda: board.top(10), 20000)
+        rank_us = timed(lambda: board.rank(f"user_{random.randrange(users)}"), 20000)
+        line = (f"{users:>9} users: load {load_s:.2f}s, update {update_us:.1f}us, "
+                f"top-10 {top_us:.1f}us, rank {rank_us:.1f}us")
+        if db is not None:
+            loop.run_until_complete(seed(db, times))
+            grouped, materialized = loop.run_until_complete(aggregation_us(db))
+            line += f" | aggregation {grouped / 1000:.1f}ms, leaderboard_entries {materialized / 1000:.2f}ms"
+        print(line)
+
+    if db is not None:
+        loop.run_until_complete(db.client.drop_database("leaderboard_index_benchmark"))
@@ -0,0 +1,378 @@
+"""
+One-off data migrations.
+
+Usage:
+    python migrations.py <name> [<name> ...]
+
+Before deploying the unique users indexes (user_id, email, telegram_id),
+run users_dedupe; the API fails to start while duplicates exist.
+"""
+import asyncio
+import os
+import uuid
+import sys
+import logging
+from pathlib import Path
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+from session_cache import build_user_snapshot
+from progress import merge_progress
+from leaderboard import rebuild_leaderboard
+from quantile_sketch import bucket_counts
+from scoring import get_scoring, SCORING
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("migrations")
+
+BATCH_SIZE = int(os.environ.get('MIGRATION_BATCH_SIZE', '500'))
+# Pause between batches so migrations on a live database stay gentle
+THROTTLE = float(os.environ.get('MIGRATION_THROTTLE', '0.1'))
+
+async def migrate_session_snapshots(db):
+    """
+    Add the denormalized user snapshot to sessions created before it existed.
+    """
+    updated = 0
+    cursor = db.user_sessions.find(
+        {"user": {"$exists": False}},
+        {"_id": 1, "user_id": 1}
+    ).batch_size(BATCH_SIZE)
+
+    batch = []
+    async for session_doc in cursor:
+        batch.append(session_doc)
+        if len(batch) >= BATCH_SIZE:
+            updated += await _apply_session_snapshots(db, batch)
+            batch = []
+    if batch:
+        updated += await _apply_session_snapshots(db, batch)
+
+    logger.info(f"session_snapshots: updated {updated} sessions")
+
+async def _apply_session_snapshots(db, sessions) -> int:
+    user_ids = list({s["user_id"] for s in sessions})
+    users = await db.users.find(
+        {"user_id": {"$in": user_ids}},
+        {"_id": 0}
+    ).to_list(len(user_ids))
+    users_by_id = {u["user_id"]: u for u in users}
+
+    operations = []
+    for session_doc in sessions:
+        user_doc = users_by_id.get(session_doc["user_id"])
+        if not user_doc:
+            continue
+        operations.append(UpdateOne(
+            {"_id": session_doc["_id"], "user": {"$exists": False}},
+            {"$set": {
+                "user": build_user_snapshot(user_doc),
+                "user_version": user_doc.get("version", 0)
+            }}
+        ))
+
+    if not operations:
+        return 0
+    result = await db.user_sessions.bulk_write(operations, ordered=False)
+    return result.modified_count
+
+async def migrate_session_dates(db):
+    """
+    Convert ISO string expires_at/created_at on sessions to native dates,
+    so the TTL index on expires_at can purge them. Walks sessions in _id
+    order in throttled batches; unparseable values are skipped and logged.
+    """
+    updated = 0
+    skipped = 0
+    last_id = None
+    while True:
+        query = {"$or": [
+            {"expires_at": {"$type": "string"}},
+            {"created_at": {"$type": "string"}}
+        ]}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        sessions = await db.user_sessions.find(
+            query,
+            {"_id": 1, "expires_at": 1, "created_at": 1}
+        ).sort("_id", 1).limit(BATCH_SIZE).to_list(BATCH_SIZE)
+
+        if not sessions:
+            break
+
+        operations = []
+        for session_doc in sessions:
+            update = {}
+            for field in ("expires_at", "created_at"):
+                value = session_doc.get(field)
+                if not isinstance(value, str):
+                    continue
+                try:
+                    update[field] = parse_iso_datetime(value)
+                except ValueError:
+                    skipped += 1
+            if update:
+                operations.append(UpdateOne({"_id": session_doc["_id"]}, {"$set": update}))
+
+        if operations:
+            result = await db.user_sessions.bulk_write(operations, ordered=False)
+            updated += result.modified_count
+
+        last_id = sessions[-1]["_id"]
+        await asyncio.sleep(THROTTLE)
+
+    logger.info(f"session_dates: updated {updated} sessions, skipped {skipped} unparseable values")
+
+# ISO-string timestamps written before dates were stored natively
+DATE_FIELDS = {
+    "users": ("created_at",),
+    "user_results": ("created_at",),
+    "user_progress": ("last_played",),
+    "spot_difference_templates": ("created_at",),
+    "spot_difference_games": ("start_time", "end_time"),
+    "user_solved_templates": ("completed_at",),
+}
+
+async def migrate_dates(db):
+    """
+    Convert ISO string timestamps to native dates in all collections.
+    Walks each collection in _id order in throttled batches and records
+    the last _id in migration_state, so an interrupted run resumes there.
+    """
+    for collection_name, fields in DATE_FIELDS.items():
+        collection = db[collection_name]
+        state_id = f"dates:{collection_name}"
+        state = await db.migration_state.find_one({"_id": state_id})
+        last_id = state["last_id"] if state else None
+        updated = 0
+        skipped = 0
+
+        while True:
+            query = {"$or": [{field: {"$type": "string"}} for field in fields]}
+            if last_id is not None:
+                query["_id"] = {"$gt": last_id}
+            docs = await collection.find(
+                query,
+                {"_id": 1, **{field: 1 for field in fields}}
+            ).sort("_id", 1).limit(BATCH_SIZE).to_list(BATCH_SIZE)
+
+            if not docs:
+                break
+
+            operations = []
+            for doc in docs:
+                update = {}
+                for field in fields:
+                    value = doc.get(field)
+                    if not isinstance(value, str):
+                        continue
+                    try:
+                        update[field] = parse_iso_datetime(value)
+                    except ValueError:
+                        skipped += 1
+                if update:
+                    # Only convert values still holding the string we read
+                    operations.append(UpdateOne(
+                        {"_id": doc["_id"], **{f: doc[f] for f in update}},
+                        {"$set": update}
+                    ))
+
+            if operations:
+                result = await collection.bulk_write(operations, ordered=False)
+                updated += result.modified_count
+
+            last_id = docs[-1]["_id"]
+            await db.migration_state.update_one(
+                {"_id": state_id},
+                {"$set": {"last_id": last_id, "updated_at": datetime.now(timezone.utc)}},
+                upsert=True
+            )
+            await asyncio.sleep(THROTTLE)
+
+        # Done: a later run starts over and picks up strings written since
+        await db.migration_state.delete_one({"_id": state_id})
+        logger.info(f"dates: {collection_name}: updated {updated} documents, skipped {skipped} unparseable values")
+
+def parse_iso_datetime(value: str) -> datetime:
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+async def migrate_progress_dedupe(db):
+    """
+    Merge duplicate user_progress documents left by the old read-then-insert
+    progress update, so the unique (user_id, exercise_id) index can be built.
+    """
+    duplicates = db.user_progress.aggregate([
+        {"$group": {
+            "_id": {"user_id": "$user_id", "exercise_id": "$exercise_id"},
+            "docs": {"$push": "$$ROOT"},
+            "count": {"$sum": 1}
+        }},
+        {"$match": {"count": {"$gt": 1}}}
+    ], allowDiskUse=True)
+
+    merged = 0
+    async for group in duplicates:
+        docs = sorted(group["docs"], key=lambda d: d["_id"])
+        keep, extra = docs[0], docs[1:]
+        lower_is_better = get_scoring(group["_id"]["exercise_id"]).lower_is_better
+        await db.user_progress.update_one(
+            {"_id": keep["_id"]},
+            {"$set": merge_progress(docs, lower_is_better)}
+        )
+        await db.user_progress.delete_many({"_id": {"$in": [d["_id"] for d in extra]}})
+        merged += 1
+
+    logger.info(f"progress_dedupe: merged {merged} duplicate progress groups")
+
+# Collections whose documents belong to a user, by user_id
+USER_OWNED_COLLECTIONS = ("user_results", "user_progress")
+
+async def migrate_users_dedupe(db):
+    """
+    Merge duplicate users left by the old read-then-insert login (two
+    devices logging in at once), so the unique users indexes can be built.
+    The oldest user of each telegram_id, email or user_id is kept; sessions,
+    results and progress of the others are moved to it.
+    """
+    merged = 0
+    for field in ("telegram_id", "email", "user_id"):
+        duplicates = db.users.aggregate([
+            # Users without the field are not duplicates of each other
+            {"$match": {field: {"$type": "string"}}},
+            {"$group": {"_id": f"${field}", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}}
+        ], allowDiskUse=True)
+
+        async for group in duplicates:
+            # ObjectIds grow with insertion time: the first is the oldest
+            ids = sorted(group["ids"])
+            keep = await db.users.find_one({"_id": ids[0]})
+            extra_user_ids = [
+                doc["user_id"]
+                async for doc in db.users.find({"_id": {"$in": ids[1:]}}, {"user_id": 1})
+                if doc.get("user_id") and doc["user_id"] != keep["user_id"]
+            ]
+            if extra_user_ids:
+                await _move_user_data(db, extra_user_ids, keep)
+            await db.users.delete_many({"_id": {"$in": ids[1:]}})
+            merged += len(ids) - 1
+            await asyncio.sleep(THROTTLE)
+
+    logger.info(f"users_dedupe: merged {merged} duplicate users")
+    if merged:
+        # Moved progress may now be duplicated per (user, exercise)
+        await migrate_progress_dedupe(db)
+        logger.info("users_dedupe: run leaderboard_rebuild to recompute merged users' leaderboard entries")
+
+async def _move_user_data(db, user_ids, keep):
+    for collection_name in USER_OWNED_COLLECTIONS:
+        await db[collection_name].update_many(
+            {"user_id": {"$in": user_ids}},
+            {"$set": {"user_id": keep["user_id"]}}
+        )
+    await db.user_sessions.update_many(
+        {"user_id": {"$in": user_ids}},
+        {"$set": {
+            "user_id": keep["user_id"],
+            "user": build_user_snapshot(keep),
+            "user_version": keep.get("version", 0)
+        }}
+    )
+    # Entries are unique per user; leaderboard_rebuild recreates them
+    await db.leaderboard_entries.delete_many({"user_id": {"$in": user_ids}})
+
+async def migrate_progress_rebuild(db):
+    """
+    Recompute user_progress from user_results with the scoring metric of
+    each exercise, e.g. after an exercise's metric changed in scoring.py.
+    """
+    updated = 0
+    for exercise_id, scoring in SCORING.items():
+        rows = db.user_results.aggregate([
+            {"$match": {"exercise_id": exercise_id}},
+            {"$group": {
+                "_id": "$user_id",
+                "total_games": {"$sum": 1},
+                "best_score": {"$min" if scoring.lower_is_better else "$max": f"${scoring.metric}"},
+                "average_score": {"$avg": f"${scoring.metric}"},
+                "score_stddev": {"$stdDevPop": f"${scoring.metric}"},
+                "scores": {"$push": f"${scoring.metric}"},
+                "last_played": {"$max": "$created_at"}
+            }}
+        ], allowDiskUse=True)
+
+        operations = []
+        async for row in rows:
+            operations.append(UpdateOne(
+                {"user_id": row["_id"], "exercise_id": exercise_id},
+                {"$set": {
+                    "total_games": row["total_games"],
+                    "best_score": row["best_score"],
+                    "average_score": row["average_score"],
+                    "score_m2": (row["score_stddev"] or 0) ** 2 * row["total_games"],
+                    "score_sketch": bucket_counts(s for s in row["scores"] if s is not None),
+                    "level": 1 + row["total_games"] // 10,
+                    "last_played": row["last_played"]
+                }, "$setOnInsert": {
+                    "progress_id": f"progress_{uuid.uuid4().hex[:12]}"
+                }},
+                upsert=True
+            ))
+            if len(operations) >= BATCH_SIZE:
+                updated += (await db.user_progress.bulk_write(operations, ordered=False)).modified_count
+                operations = []
+        if operations:
+            updated += (await db.user_progress.bulk_write(operations, ordered=False)).modified_count
+
+    logger.info(f"progress_rebuild: updated {updated} progress documents")
+
+async def migrate_leaderboard_rebuild(db):
+    """
+    Recompute the materialized leaderboard_entries from user_results.
+    Can run while the API is serving saves: entries saved to meanwhile are
+    skipped rather than overwritten, so their games are not lost, but keep
+    the values the saves left. Pause saves, or run it again, to recompute
+    those entries as well.
+    """
+    for scoring in SCORING.values():
+        await rebuild_leaderboard(db, scoring, BATCH_SIZE)
+
+MIGRATIONS = {
+    "session_snapshots": migrate_session_snapshots,
+    "session_dates": migrate_session_dates,
+    "progress_dedupe": migrate_progress_dedupe,
+    "users_dedupe": migrate_users_dedupe,
+    "progress_rebuild": migrate_progress_rebuild,
+    "dates": migrate_dates,
+    "leaderboard_rebuild": migrate_leaderboard_rebuild,
+}
+
+async def main(names):
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    db = client[os.environ['DB_NAME']]
+    try:
+        for name in names:
+            logger.info(f"Running migration: {name}")
+            await MIGRATIONS[name](db)
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    names = sys.argv[1:]
+    unknown = [n for n in names if n not in MIGRATIONS]
+    if not names or unknown:
+        print(f"Available migrations: {', '.join(MIGRATIONS)}")
+        sys.exit(1)
+    asyncio.run(main(names))
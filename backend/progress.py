@@ -0,0 +1,152 @@
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Tuple
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from quantile_sketch import bucket_counts, merge, quantile
+
+
+def progress_update_pipeline(scores: List[float], lower_is_better: bool, played_at: Any) -> List[Dict[str, Any]]:
+    """
+    Aggregation-pipeline update that folds one or more games into a
+    user_progress document server-side. Used with update_one(..., upsert=True)
+    so concurrent saves for the same user and exercise never lose games.
+
+    Besides count, best and mean it keeps score_m2, the sum of squared
+    deviations (Welford; batches are combined with Chan's formula), and
+    score_sketch, bucket counters of a quantile sketch.
+    """
+    games = len(scores)
+    batch_mean = sum(scores) / games
+    batch_m2 = sum((score - batch_mean) ** 2 for score in scores)
+    best_score = min(scores) if lower_is_better else max(scores)
+    best = "$min" if lower_is_better else "$max"
+
+    sketch_increments = {
+        f"score_sketch.{key}": {"$add": [{"$ifNull": [f"$score_sketch.{key}", 0]}, count]}
+        for key, count in bucket_counts(scores).items()
+    }
+    return [
+        {"$set": {
+            "progress_id": {"$ifNull": ["$progress_id", f"progress_{uuid.uuid4().hex[:12]}"]},
+            "total_games": {"$add": [{"$ifNull": ["$total_games", 0]}, games]},
+            "best_score": {best: [{"$ifNull": ["$best_score", best_score]}, best_score]},
+            "last_played": played_at,
+            **sketch_increments
+        }},
+        # total_games below is the incremented count from the stage above;
+        # average_score is still the previous mean
+        {"$set": {
+            "average_score": {"$let": {
+                "vars": {"mean": {"$ifNull": ["$average_score", batch_mean]}},
+                "in": {"$add": [
+                    "$$mean",
+                    {"$divide": [
+                        {"$multiply": [{"$subtract": [batch_mean, "$$mean"]}, games]},
+                        "$total_games"
+                    ]}
+                ]}
+            }},
+            "score_m2": {"$let": {
+                "vars": {"delta": {"$subtract": [batch_mean, {"$ifNull": ["$average_score", batch_mean]}]}},
+                "in": {"$add": [
+                    {"$ifNull": ["$score_m2", 0]},
+                    batch_m2,
+                    {"$divide": [
+                        {"$multiply": ["$$delta", "$$delta", {"$subtract": ["$total_games", games]}, games]},
+                        "$total_games"
+                    ]}
+                ]}
+            }},
+            "level": {"$add": [1, {"$toInt": {"$floor": {"$divide": ["$total_games", 10]}}}]}
+        }}
+    ]
+
+
+def summarize_progress(progress: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Replace the raw statistics of a progress document with the values
+    clients show: standard deviation, median and p90 of the score.
+    """
+    summary = {k: v for k, v in progress.items() if k not in ("score_m2", "score_sketch")}
+    total_games = progress.get("total_games") or 0
+    m2 = progress.get("score_m2")
+    summary["score_stddev"] = (m2 / total_games) ** 0.5 if m2 is not None and total_games else None
+    summary["median_score"] = quantile(progress.get("score_sketch"), 0.5)
+    summary["p90_score"] = quantile(progress.get("score_sketch"), 0.9)
+    return summary
+
+
+async def bulk_update_progress(db, games: Iterable[Tuple[str, str, float, bool]]):
+    """
+    Fold many (user_id, exercise_id, score, lower_is_better) games into
+    user_progress with one unordered bulk_write, one upsert per user and
+    exercise.
+    """
+    scores: Dict[Tuple[str, str, bool], List[float]] = defaultdict(list)
+    for user_id, exercise_id, score, lower_is_better in games:
+        scores[(user_id, exercise_id, lower_is_better)].append(score)
+    if not scores:
+        return
+
+    played_at = datetime.now(timezone.utc)
+    operations = [
+        UpdateOne(
+            {"user_id": user_id, "exercise_id": exercise_id},
+            progress_update_pipeline(group, lower_is_better, played_at),
+            upsert=True
+        )
+        for (user_id, exercise_id, lower_is_better), group in scores.items()
+    ]
+
+    await bulk_upsert(db.user_progress, operations)
+
+
+async def bulk_upsert(collection, operations: List[UpdateOne]):
+    """
+    Unordered bulk_write of upserts against a unique index. Upserts that
+    raced with a concurrent insert of the same key are retried once and
+    then match the winner's document.
+    """
+    try:
+        await collection.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(err.get("code") != 11000 for err in errors):
+            raise
+        await collection.bulk_write(
+            [operations[err["index"]] for err in errors],
+            ordered=False
+        )
+
+
+def merge_progress(docs: List[Dict[str, Any]], lower_is_better: bool) -> Dict[str, Any]:
+    """Combine duplicate progress documents for one user and exercise."""
+    total_games = 0
+    mean = 0.0
+    m2 = 0.0
+    for d in docs:
+        # Chan's parallel combination of count, mean and M2
+        n = d.get("total_games", 0)
+        if not n:
+            continue
+        delta = d.get("average_score", 0) - mean
+        combined = total_games + n
+        mean += delta * n / combined
+        m2 += d.get("score_m2", 0) + delta * delta * total_games * n / combined
+        total_games = combined
+
+    scored = [d for d in docs if d.get("best_score") is not None]
+    pick = min if lower_is_better else max
+    return {
+        "total_games": total_games,
+        "best_score": pick(d["best_score"] for d in scored) if scored else None,
+        "average_score": mean if total_games else None,
+        "score_m2": m2,
+        "score_sketch": merge(*(d.get("score_sketch") or {} for d in docs)),
+        "level": 1 + total_games // 10,
+        "last_played": max((d["last_played"] for d in docs if d.get("last_played")), default=None)
+    }
@@ -0,0 +1,113 @@
+import math
+import time
+import zlib
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, List
+
+from pymongo import ReturnDocument
+
+
+class TokenBucketLimiter:
+    """
+    In-process token buckets, sharded by key hash so each shard stays small
+    and can be pruned independently. Runs on the event loop thread only,
+    so no locking is needed.
+    """
+
+    def __init__(self, rate: float, burst: int, shards: int = 16, max_keys_per_shard: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys_per_shard = max_keys_per_shard
+        self._shards: List[Dict[str, List[float]]] = [{} for _ in range(shards)]
+        self.allowed = 0
+        self.limited = 0
+
+    async def hit(self, key: str) -> float:
+        """Take one token for `key`. Returns 0 if allowed, else seconds to wait."""
+        shard = self._shards[zlib.crc32(key.encode()) % len(self._shards)]
+        now = time.monotonic()
+
+        bucket = shard.get(key)
+        if bucket is None:
+            if len(shard) >= self.max_keys_per_shard:
+                self._prune(shard, now)
+            bucket = shard[key] = [float(self.burst), now]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            self.allowed += 1
+            return 0.0
+
+        self.limited += 1
+        return (1 - bucket[0]) / self.rate
+
+    def _prune(self, shard: Dict[str, List[float]], now: float):
+        """Drop buckets that have refilled completely; they carry no state."""
+        full_after = self.burst / self.rate
+        for key in [k for k, (_, last) in shard.items() if now - last >= full_after]:
+            del shard[key]
+        # Still full: drop the least recently used half
+        if len(shard) >= self.max_keys_per_shard:
+            for key, _ in sorted(shard.items(), key=lambda kv: kv[1][1])[:len(shard) // 2]:
+                del shard[key]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "memory",
+            "keys": sum(len(shard) for shard in self._shards),
+            "allowed": self.allowed,
+            "limited": self.limited,
+        }
+
+
+class MongoRateLimiter:
+    """
+    Shared fixed-window limiter on the `rate_limits` collection, for
+    deployments with several API workers. Allows `burst` hits per
+    burst / rate seconds window.
+    """
+
+    def __init__(self, db, rate: float, burst: int):
+        self.db = db
+        self.burst = burst
+        self.window = max(1, math.ceil(burst / rate))
+        self.allowed = 0
+        self.limited = 0
+
+    async def hit(self, key: str) -> float:
+        now = time.time()
+        window_start = int(now // self.window) * self.window
+        doc = await self.db.rate_limits.find_one_and_update(
+            {"key": key, "window": window_start},
+            {
+                "$inc": {"count": 1},
+                "$setOnInsert": {
+                    "expires_at": datetime.fromtimestamp(window_start, timezone.utc)
+                    + timedelta(seconds=self.window)
+                }
+            },
+            projection={"_id": 0, "count": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+
+        if doc["count"] <= self.burst:
+            self.allowed += 1
+            return 0.0
+
+        self.limited += 1
+        return window_start + self.window - now
+
+    async def create_indexes(self):
+        await self.db.rate_limits.create_index([("key", 1), ("window", 1)], unique=True)
+        await self.db.rate_limits.create_index("expires_at", expireAfterSeconds=0)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "mongo",
+            "allowed": self.allowed,
+            "limited": self.limited,
+        }
@@ -0,0 +1,278 @@
+"""
+Minimal in-process server speaking the Redis protocol (RESP2).
+
+Implements only the commands used by RedisSessionStore (including
+WATCH/MULTI/EXEC for its read-modify-write updates), so the Redis
+session backend can be exercised locally without an external service:
+
+    python resp_server.py [--port 6380]
+"""
+import time
+import asyncio
+import argparse
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+
+class RespServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self._data: Dict[bytes, Tuple[Any, Optional[float]]] = {}
+        # Bumped on every change of a key, for WATCH
+        self._versions: Dict[bytes, int] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._handlers: Set[asyncio.Task] = set()
+        self._connections: Set[asyncio.StreamWriter] = set()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._connections):
+                writer.close()
+            await asyncio.gather(*self._handlers, return_exceptions=True)
+            await self._server.wait_closed()
+
+    @property
+    def url(self) -> str:
+        return f"redis://{self.host}:{self.port}/0"
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._handlers.add(asyncio.current_task())
+        self._connections.add(writer)
+        transaction = _Transaction()
+        try:
+            while True:
+                command = await self._read_command(reader)
+                if command is None:
+                    break
+                writer.write(self._dispatch(command, transaction))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._connections.discard(writer)
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
+
+    async def _read_command(self, reader: asyncio.StreamReader) -> Optional[List[bytes]]:
+        line = await reader.readline()
+        if not line:
+            return None
+        count = int(line[1:-2])
+        args = []
+        for _ in range(count):
+            length = int((await reader.readline())[1:-2])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    # Storage helpers ---------------------------------------------------
+
+    def _get(self, key: bytes) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires is not None and expires <= time.monotonic():
+            del self._data[key]
+            self._changed(key)
+            return None
+        return value
+
+    def _set(self, key: bytes, value: Any, expires: Optional[float]):
+        self._data[key] = (value, expires)
+        self._changed(key)
+
+    def _changed(self, key: bytes):
+        self._versions[key] = self._versions.get(key, 0) + 1
+
+    def _expiry(self, key: bytes) -> Optional[float]:
+        return self._data[key][1] if self._get(key) is not None else None
+
+    # Command dispatch --------------------------------------------------
+
+    def _dispatch(self, args: List[bytes], transaction: "_Transaction") -> bytes:
+        """Run a command, or handle it as part of WATCH/MULTI/EXEC."""
+        name = args[0].upper()
+        if name == b"WATCH":
+            if transaction.queued is not None:
+                return _error("WATCH inside MULTI is not allowed")
+            for key in args[1:]:
+                self._get(key)
+                transaction.watched[key] = self._versions.get(key, 0)
+            return b"+OK\r\n"
+        if name == b"UNWATCH":
+            transaction.watched.clear()
+            return b"+OK\r\n"
+        if name == b"MULTI":
+            if transaction.queued is not None:
+                return _error("MULTI calls can not be nested")
+            transaction.queued = []
+            return b"+OK\r\n"
+        if name == b"DISCARD":
+            if transaction.queued is None:
+                return _error("DISCARD without MULTI")
+            transaction.reset()
+            return b"+OK\r\n"
+        if name == b"EXEC":
+            if transaction.queued is None:
+                return _error("EXEC without MULTI")
+            queued, watched = transaction.queued, dict(transaction.watched)
+            transaction.reset()
+            for key, version in watched.items():
+                self._get(key)
+                if self._versions.get(key, 0) != version:
+                    return b"*-1\r\n"
+            return b"*%d\r\n" % len(queued) + b"".join(self._execute(command) for command in queued)
+        if transaction.queued is not None:
+            transaction.queued.append(args)
+            return b"+QUEUED\r\n"
+        return self._execute(args)
+
+    def _execute(self, args: List[bytes]) -> bytes:
+        name = args[0].upper().decode()
+        handler = getattr(self, f"_cmd_{name.lower()}", None)
+        if handler is None:
+            return _error(f"unknown command '{name}'")
+        try:
+            return handler(*args[1:])
+        except (TypeError, ValueError):
+            return _error(f"wrong arguments for '{name}'")
+
+    def _cmd_ping(self, *args):
+        return b"+PONG\r\n"
+
+    def _cmd_select(self, db):
+        return b"+OK\r\n"
+
+    def _cmd_flushdb(self):
+        self._data.clear()
+        return b"+OK\r\n"
+
+    def _cmd_get(self, key):
+        return _bulk(self._get(key))
+
+    def _cmd_set(self, key, value, *options):
+        expires = None
+        keep_ttl = False
+        i = 0
+        while i < len(options):
+            option = options[i].upper()
+            if option == b"PX":
+                expires = time.monotonic() + int(options[i + 1]) / 1000
+                i += 1
+            elif option == b"EX":
+                expires = time.monotonic() + int(options[i + 1])
+                i += 1
+            elif option == b"KEEPTTL":
+                keep_ttl = True
+            i += 1
+        if keep_ttl:
+            expires = self._expiry(key)
+        self._set(key, value, expires)
+        return b"+OK\r\n"
+
+    def _cmd_del(self, *keys):
+        removed = 0
+        for key in keys:
+            if self._get(key) is not None:
+                del self._data[key]
+                self._changed(key)
+                removed += 1
+        return _int(removed)
+
+    def _cmd_pttl(self, key):
+        if self._get(key) is None:
+            return _int(-2)
+        expires = self._data[key][1]
+        if expires is None:
+            return _int(-1)
+        return _int(int((expires - time.monotonic()) * 1000))
+
+    def _cmd_pexpire(self, key, ms):
+        value = self._get(key)
+        if value is None:
+            return _int(0)
+        self._set(key, value, time.monotonic() + int(ms) / 1000)
+        return _int(1)
+
+    def _cmd_zadd(self, key, *pairs):
+        zset = self._get(key)
+        if zset is None:
+            zset = {}
+            self._set(key, zset, None)
+        self._changed(key)
+        added = 0
+        for i in range(0, len(pairs), 2):
+            member = pairs[i + 1]
+            added += member not in zset
+            zset[member] = float(pairs[i])
+        return _int(added)
+
+    def _cmd_zrem(self, key, *members):
+        zset = self._get(key) or {}
+        self._changed(key)
+        removed = 0
+        for member in members:
+            if zset.pop(member, None) is not None:
+                removed += 1
+        return _int(removed)
+
+    def _cmd_zcard(self, key):
+        return _int(len(self._get(key) or {}))
+
+    def _cmd_zrange(self, key, start, stop):
+        members = [m for m, _ in sorted((self._get(key) or {}).items(), key=lambda kv: (kv[1], kv[0]))]
+        start, stop = int(start), int(stop)
+        size = len(members)
+        if start < 0:
+            start = max(size + start, 0)
+        if stop < 0:
+            stop = size + stop
+        return _array(members[start:stop + 1])
+
+
+class _Transaction:
+    """Per-connection WATCH and MULTI state."""
+
+    def __init__(self):
+        self.watched: Dict[bytes, int] = {}
+        self.queued: Optional[List[List[bytes]]] = None
+
+    def reset(self):
+        self.watched.clear()
+        self.queued = None
+
+
+def _bulk(value: Optional[bytes]) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+def _int(value: int) -> bytes:
+    return b":%d\r\n" % value
+
+
+def _array(values: List[bytes]) -> bytes:
+    return b"*%d\r\n" % len(values) + b"".join(_bulk(v) for v in values)
+
+
+def _error(message: str) -> bytes:
+    return f"-ERR {message}\r\n".encode()
+
+
+async def main(port: int):
+    server = RespServer(port=port)
+    await server.start()
+    print(f"Redis-protocol stand-in listening on {server.url}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=6380)
+    asyncio.run(main(parser.parse_args().port))
@@ -0,0 +1,209 @@
+import time
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError, ConnectionFailure, PyMongoError
+
+from progress import bulk_update_progress
+from leaderboard import bulk_update_leaderboard
+
+logger = logging.getLogger(__name__)
+
+# (result document, progress score, lower_is_better, idempotency key)
+QueuedResult = Tuple[Dict[str, Any], float, bool, Optional[str]]
+
+
+class ResultQueueFull(Exception):
+    pass
+
+
+def is_transient(error: PyMongoError) -> bool:
+    return isinstance(error, ConnectionFailure) or error.has_error_label("RetryableWriteError")
+
+
+class ResultWriteBuffer:
+    """
+    Write-behind ingestion for game results.
+    Save endpoints enqueue the result document and its progress score;
+    a background task writes them in unordered bulk_write batches when
+    `batch_size` results are waiting or `flush_interval` seconds passed.
+    Progress updates in a batch are coalesced per (user, exercise).
+
+    Inserts failing on a transient error are retried up to `max_retries`
+    times. Results that still could not be stored have their idempotency
+    key released, so the client's retry saves them again. Stored results
+    are recorded into `leaderboard_index`, when given, once their
+    leaderboard entries are written.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 0.5,
+        max_retries: int = 3,
+        retry_delay: float = 0.5,
+        idempotency_keys=None,
+        leaderboard_index=None
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.idempotency_keys = idempotency_keys
+        self.leaderboard_index = leaderboard_index
+        self._queue: "asyncio.Queue[QueuedResult]" = asyncio.Queue(max_size)
+        self._closing = False
+        self.enqueued = 0
+        self.rejected = 0
+        self.flushes = 0
+        self.written = 0
+        self.failed = 0
+        self.retries = 0
+        self.progress_failed = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self._total_flush_ms = 0.0
+
+    def submit(
+        self,
+        result_doc: Dict[str, Any],
+        score: float,
+        lower_is_better: bool = False,
+        idempotency_key: Optional[str] = None
+    ):
+        """Queue a result for writing. Raises ResultQueueFull when saturated."""
+        if self._closing:
+            self.rejected += 1
+            raise ResultQueueFull()
+        try:
+            self._queue.put_nowait((result_doc, score, lower_is_better, idempotency_key))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise ResultQueueFull()
+        self.enqueued += 1
+
+    async def run(self, db):
+        """Flush loop. Returns once close() was called and the queue is empty."""
+        while not (self._closing and self._queue.empty()):
+            batch = await self._next_batch()
+            if batch:
+                await self._write(db, batch)
+
+    def close(self):
+        """Stop accepting results; run() writes what is queued and returns."""
+        self._closing = True
+
+    async def _next_batch(self) -> List[QueuedResult]:
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            if self._closing and self._queue.empty():
+                break
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                if batch:
+                    break
+                # Nothing arrived yet; start a new window
+                deadline = time.monotonic() + self.flush_interval
+                continue
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                pass
+        return batch
+
+    async def _write(self, db, batch: List[QueuedResult]):
+        started = time.monotonic()
+        try:
+            failed = await self._insert(db, batch)
+            stored = [item for index, item in enumerate(batch) if index not in failed]
+            self.written += len(stored)
+            if failed:
+                self.failed += len(failed)
+                logger.error(f"Error writing {len(failed)} of {len(batch)} buffered results")
+                await self._release_keys([batch[index] for index in failed])
+            if not stored:
+                return
+
+            # Progress updates are increments, so they are not retried;
+            # progress_rebuild and leaderboard_rebuild recompute them
+            try:
+                await asyncio.gather(
+                    bulk_update_progress(db, [
+                        (result_doc["user_id"], result_doc["exercise_id"], score, lower_is_better)
+                        for result_doc, score, lower_is_better, _ in stored
+                    ]),
+                    bulk_update_leaderboard(db, [result_doc for result_doc, _, _, _ in stored])
+                )
+            except Exception as e:
+                self.progress_failed += len(stored)
+                logger.error(f"Error updating progress of {len(stored)} buffered results: {e}")
+                return
+            if self.leaderboard_index:
+                self.leaderboard_index.record([result_doc for result_doc, _, _, _ in stored])
+        finally:
+            elapsed_ms = (time.monotonic() - started) * 1000
+            self.flushes += 1
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self._total_flush_ms += elapsed_ms
+
+    async def _insert(self, db, batch: List[QueuedResult]) -> Set[int]:
+        """
+        Insert a batch, retrying transient failures. Returns the indexes of
+        the results that were not stored.
+        """
+        pending = list(range(len(batch)))
+        for attempt in range(self.max_retries + 1):
+            try:
+                # InsertOne sets _id on the document, so a retry re-sends
+                # the same _id and cannot store a result twice
+                await db.user_results.bulk_write(
+                    [InsertOne(batch[index][0]) for index in pending],
+                    ordered=False
+                )
+                return set()
+            except BulkWriteError as e:
+                # On a retry, a duplicate _id was stored by an earlier attempt
+                return {
+                    pending[err["index"]]
+                    for err in e.details.get("writeErrors", [])
+                    if not (attempt and err.get("code") == 11000)
+                }
+            except Exception as e:
+                if not isinstance(e, PyMongoError) or not is_transient(e) or attempt == self.max_retries:
+                    logger.error(f"Error inserting {len(pending)} buffered results: {e}")
+                    return set(pending)
+                self.retries += 1
+                await asyncio.sleep(self.retry_delay * 2 ** attempt)
+        return set(pending)
+
+    async def _release_keys(self, dropped: List[QueuedResult]):
+        if self.idempotency_keys is None:
+            return
+        for result_doc, _, _, idempotency_key in dropped:
+            if idempotency_key is None:
+                continue
+            try:
+                await self.idempotency_keys.release(result_doc["user_id"], idempotency_key)
+            except Exception as e:
+                logger.error(f"Error releasing idempotency key of a dropped result: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self._queue.qsize(),
+            "queue_capacity": self._queue.maxsize,
+            "enqueued": self.enqueued,
+            "rejected": self.rejected,
+            "written": self.written,
+            "failed": self.failed,
+            "retries": self.retries,
+            "progress_failed": self.progress_failed,
+            "flushes": self.flushes,
+            "last_flush_ms": round(self.last_flush_ms, 2),
+            "max_flush_ms": round(self.max_flush_ms, 2),
+            "avg_flush_ms": round(self._total_flush_ms / self.flushes, 2) if self.flushes else 0.0,
+        }
@@ -0,0 +1,204 @@
+"""
+How each exercise is scored. One entry per exercise drives result
+ingestion, progress updates, user_results indexes and leaderboard queries,
+so adding a game means adding its entry here.
+"""
+from itertools import combinations
+from typing import Any, Callable, Dict, List, Tuple, Union
+
+# Result fields leaderboards can be split by, with the type of their values
+PARTITION_FIELDS = {"difficulty": str, "grid_size": int}
+
+FieldSource = Union[str, Callable[[Dict[str, Any]], Any]]
+
+
+class ExerciseScoring:
+    """
+    metric: result field players are ranked by; also tracked as the
+        best_score of the user's progress.
+    lower_is_better: sort direction of the metric.
+    fields: result document fields, each copied from a request field
+        (by name) or derived from the whole request (callable).
+    partitions: result fields that split leaderboards (difficulty, grid size).
+    leaderboard_field: name of the best-metric field in leaderboard entries.
+    """
+
+    __slots__ = ("exercise_id", "metric", "lower_is_better", "fields", "partitions", "leaderboard_field")
+
+    def __init__(
+        self,
+        exercise_id: str,
+        metric: str,
+        fields: Dict[str, FieldSource],
+        lower_is_better: bool = False,
+        partitions: Tuple[str, ...] = (),
+        leaderboard_field: str = "best_score"
+    ):
+        unknown = [p for p in partitions if p not in PARTITION_FIELDS]
+        if unknown:
+            raise ValueError(f"{exercise_id}: unknown partition fields {unknown}")
+        if metric not in fields:
+            raise ValueError(f"{exercise_id}: metric {metric!r} is not a result field")
+        self.exercise_id = exercise_id
+        self.metric = metric
+        self.lower_is_better = lower_is_better
+        self.fields = fields
+        self.partitions = partitions
+        self.leaderboard_field = leaderboard_field
+
+    @property
+    def sort_direction(self) -> int:
+        return 1 if self.lower_is_better else -1
+
+    def result_fields(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Result document fields for a validated save request."""
+        return {
+            name: source(request) if callable(source) else request.get(source)
+            for name, source in self.fields.items()
+        }
+
+    def partition_filter(self, values: Dict[str, Any]) -> Dict[str, Any]:
+        """Filter on the given partition values; unknown or missing ones are ignored."""
+        return {
+            name: PARTITION_FIELDS[name](values[name])
+            for name in self.partitions
+            if values.get(name) is not None
+        }
+
+    def partition_keys(self, result_doc: Dict[str, Any]) -> List[str]:
+        """
+        Keys of every leaderboard a result counts towards: the overall one
+        ("") and one per combination of its partition values.
+        """
+        present = [name for name in self.partitions if result_doc.get(name) is not None]
+        return [
+            partition_key({name: result_doc[name] for name in subset})
+            for size in range(len(present) + 1)
+            for subset in combinations(present, size)
+        ]
+
+
+def _percent(part: str, *whole: str) -> Callable[[Dict[str, Any]], float]:
+    def compute(request: Dict[str, Any]) -> float:
+        total = sum(request[field] for field in whole)
+        return request[part] / total * 100 if total > 0 else 0
+    return compute
+
+
+SCORING: Dict[str, ExerciseScoring] = {s.exercise_id: s for s in [
+    ExerciseScoring(
+        "schulte",
+        metric="time",
+        lower_is_better=True,
+        fields={"score": "score", "time": "time", "grid_size": "grid_size"},
+        partitions=("grid_size",),
+        leaderboard_field="best_time"
+    ),
+    ExerciseScoring(
+        "stroop",
+        metric="time",
+        lower_is_better=True,
+        fields={
+            "score": _percent("correct_answers", "total_questions"),
+            "time": "average_time",
+            "difficulty": "difficulty",
+            "correct_answers": "correct_answers",
+            "total_questions": "total_questions",
+        },
+        partitions=("difficulty",),
+        leaderboard_field="best_time"
+    ),
+    ExerciseScoring(
+        "sequence",
+        metric="score",
+        fields={
+            "score": "level_reached",
+            "time": lambda request: 0,  # Not time-based
+            "difficulty": "difficulty",
+            "level_reached": "level_reached",
+            "max_sequence_length": "max_sequence_length",
+            "grid_size": "grid_size",
+        },
+        partitions=("difficulty", "grid_size")
+    ),
+    ExerciseScoring(
+        "spot-difference",
+        metric="time",
+        lower_is_better=True,
+        fields={"score": "total_differences", "time": "time", "difficulty": "difficulty"},
+        partitions=("difficulty",),
+        leaderboard_field="best_time"
+    ),
+    ExerciseScoring(
+        "catch-letter",
+        metric="score",
+        fields={
+            "score": "caught_letters",
+            "time": "total_time",
+            "difficulty": "difficulty",
+            "caught": "caught_letters",
+            "missed": "missed_letters",
+            "accuracy": _percent("caught_letters", "caught_letters", "missed_letters"),
+        },
+        partitions=("difficulty",)
+    ),
+    ExerciseScoring(
+        "whack-mole",
+        metric="score",
+        fields={
+            "score": "hits",
+            "time": "total_time",
+            "difficulty": "difficulty",
+            "hits": "hits",
+            "misses": "misses",
+        },
+        partitions=("difficulty",)
+    ),
+    ExerciseScoring(
+        "math",
+        metric="score",
+        fields={
+            "score": "correct_answers",
+            "time": "total_time",
+            "difficulty": "difficulty",
+            "correct_answers": "correct_answers",
+            "total_problems": "total_problems",
+            "errors": "errors",
+            "accuracy": "accuracy",
+            "max_streak": "max_streak",
+        },
+        partitions=("difficulty",)
+    ),
+    ExerciseScoring(
+        "typing",
+        metric="score",
+        fields={
+            # Score is WPM adjusted by accuracy
+            "score": lambda request: request["wpm"] * (request["accuracy"] / 100),
+            "time": "total_time",
+            "difficulty": "difficulty",
+            "wpm": "wpm",
+            "accuracy": "accuracy",
+        },
+        partitions=("difficulty",),
+        leaderboard_field="best_wpm"
+    ),
+]}
+
+# Results for exercises without an entry (generic /results saves) are timed
+DEFAULT_SCORING = ExerciseScoring(
+    "",
+    metric="time",
+    lower_is_better=True,
+    fields={"score": "score", "time": "time", "grid_size": "grid_size"},
+    leaderboard_field="best_time"
+)
+
+
+def partition_key(values: Dict[str, Any]) -> str:
+    """Canonical key of a partition filter, e.g. "difficulty=hard&grid_size=4"."""
+    return "&".join(f"{name}={values[name]}" for name in sorted(values))
+
+
+def get_scoring(exercise_id: str) -> ExerciseScoring:
+    return SCORING.get(exercise_id, DEFAULT_SCORING)
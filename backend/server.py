@@ -3,26 +3,48 @@ from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, BulkWriteError
 import os
+import math
+import asyncio
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict
+from pydantic import BaseModel, Field, ConfigDict, ValidationError
 from typing import List, Optional, Dict, Any
 import uuid
 from datetime import datetime, timezone, timedelta
-import httpx
-import hmac
-import hashlib
-from urllib.parse import parse_qsl, unquote
-import json
 from emergentintegrations.llm.chat import LlmChat, UserMessage
+from session_cache import SessionCache, NegativeSessionCache, build_user_snapshot
+from signed_tokens import TokenSigner, RevocationList, is_signed_token
+from telegram_init_data import validate_telegram_init_data, InitDataReplayCache
+from session_touch import SessionTouchBuffer
+from session_store import create_session_store
+from exercise_catalog import ExerciseCatalog
+from progress import progress_update_pipeline, bulk_update_progress, summarize_progress
+from result_buffer import ResultWriteBuffer, ResultQueueFull
+from idempotency import IdempotencyStore, MAX_KEY_LENGTH
+from leaderboard import (
+    UserDisplayCache, bulk_update_leaderboard, keyset_filter, encode_cursor, decode_cursor,
+    create_indexes as create_leaderboard_indexes
+)
+from leaderboard_index import LeaderboardIndex
+from scoring import get_scoring, partition_key, DEFAULT_SCORING, ExerciseScoring
+from rate_limit import TokenBucketLimiter, MongoRateLimiter
+from emergent_auth import (
+    EmergentAuthClient,
+    CircuitBreaker,
+    AuthServiceUnavailable,
+    InvalidSessionId,
+    DEFAULT_AUTH_URL
+)
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, tz_aware=True)
 db = client[os.environ['DB_NAME']]
 
 # Create the main app without a prefix
@@ -38,6 +60,130 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Session storage backend: SESSION_STORE=mongo (default), memory or redis
+session_store = create_session_store(
+    os.environ.get('SESSION_STORE', 'mongo'),
+    db=db,
+    redis_url=os.environ.get('REDIS_URL')
+)
+
+# In-process cache of session token -> user, sized via env
+session_cache = SessionCache(
+    max_size=int(os.environ.get('SESSION_CACHE_SIZE', '10000')),
+    ttl=float(os.environ.get('SESSION_CACHE_TTL', '60'))
+)
+
+# Tokens recently found invalid or expired, to spare the database. The
+# cache is per worker: a login only clears its token on the worker that
+# handled it, so tokens that were not found are kept for the short
+# NEGATIVE_SESSION_CACHE_UNKNOWN_TTL only, bounding how long other workers
+# may reject a token that was just issued.
+negative_session_cache = NegativeSessionCache(
+    max_size=int(os.environ.get('NEGATIVE_SESSION_CACHE_SIZE', '50000')),
+    ttl=float(os.environ.get('NEGATIVE_SESSION_CACHE_TTL', '120')),
+    unknown_ttl=float(os.environ.get('NEGATIVE_SESSION_CACHE_UNKNOWN_TTL', '5'))
+)
+
+# Optional stateless auth: AUTH_MODE=signed issues HMAC-signed session tokens
+AUTH_MODE = os.environ.get('AUTH_MODE', 'session')
+token_signer = None
+if AUTH_MODE == 'signed':
+    token_signer = TokenSigner(os.environ['SESSION_SIGNING_KEY'])
+revocations = RevocationList(
+    capacity=int(os.environ.get('REVOCATION_CAPACITY', '100000')),
+    sync_overlap=float(os.environ.get('REVOCATION_SYNC_OVERLAP', '30'))
+)
+REVOCATION_SYNC_INTERVAL = float(os.environ.get('REVOCATION_SYNC_INTERVAL', '5'))
+
+# Telegram initData older than this is rejected; accepted initData is
+# remembered for the same window so repeated logins reuse the session
+TELEGRAM_AUTH_MAX_AGE = int(os.environ.get('TELEGRAM_AUTH_MAX_AGE', '86400'))
+telegram_replay_cache = InitDataReplayCache(
+    max_size=int(os.environ.get('TELEGRAM_REPLAY_CACHE_SIZE', '10000')),
+    max_age=TELEGRAM_AUTH_MAX_AGE
+)
+
+# Shared client for the Emergent session-data exchange
+emergent_auth_client = EmergentAuthClient(
+    url=os.environ.get('EMERGENT_AUTH_URL', DEFAULT_AUTH_URL),
+    timeout=float(os.environ.get('EMERGENT_AUTH_TIMEOUT', '10')),
+    max_concurrency=int(os.environ.get('EMERGENT_AUTH_MAX_CONCURRENCY', '50')),
+    breaker=CircuitBreaker(
+        failure_threshold=int(os.environ.get('EMERGENT_AUTH_BREAKER_THRESHOLD', '5')),
+        reset_timeout=float(os.environ.get('EMERGENT_AUTH_BREAKER_RESET', '30'))
+    )
+)
+
+# Sliding session expiry: activity extends a session at most once per
+# SESSION_TOUCH_INTERVAL, written in batches every SESSION_TOUCH_FLUSH_INTERVAL
+session_touches = SessionTouchBuffer(
+    interval=float(os.environ.get('SESSION_TOUCH_INTERVAL', '300'))
+)
+SESSION_TOUCH_FLUSH_INTERVAL = float(os.environ.get('SESSION_TOUCH_FLUSH_INTERVAL', '10'))
+
+# Rate limiting for login endpoints, keyed by client IP and Telegram id.
+# RATE_LIMIT_BACKEND=mongo shares counters across workers. Behind the nginx
+# proxy, set RATE_LIMIT_TRUST_PROXY=1 to key by its X-Real-IP header; without
+# a proxy clients could set that header themselves.
+AUTH_RATE_LIMIT_RATE = float(os.environ.get('AUTH_RATE_LIMIT_RATE', '0.2'))  # tokens per second
+AUTH_RATE_LIMIT_BURST = int(os.environ.get('AUTH_RATE_LIMIT_BURST', '10'))
+RATE_LIMIT_TRUST_PROXY = os.environ.get('RATE_LIMIT_TRUST_PROXY', '0') == '1'
+if os.environ.get('RATE_LIMIT_BACKEND', 'memory') == 'mongo':
+    auth_rate_limiter = MongoRateLimiter(db, AUTH_RATE_LIMIT_RATE, AUTH_RATE_LIMIT_BURST)
+else:
+    auth_rate_limiter = TokenBucketLimiter(AUTH_RATE_LIMIT_RATE, AUTH_RATE_LIMIT_BURST)
+
+# Exercise catalog, loaded into memory and hot-reloaded when its version
+# changes (definition file edited or another worker published a new one)
+exercise_catalog = ExerciseCatalog(
+    os.environ.get('EXERCISE_CATALOG_PATH', ROOT_DIR / 'exercises.json')
+)
+CATALOG_POLL_INTERVAL = float(os.environ.get('CATALOG_POLL_INTERVAL', '5'))
+
+# Idempotency-Key header on result saves; keys are remembered this long
+idempotency_keys = IdempotencyStore(
+    db,
+    ttl=int(os.environ.get('IDEMPOTENCY_KEY_TTL', '86400'))
+)
+
+# Optional in-memory leaderboards, warmed at startup and kept in sync with
+# leaderboard_entries; until warmed, leaderboards are read from Mongo
+leaderboard_index = None
+if os.environ.get('LEADERBOARD_IN_MEMORY', '0') == '1':
+    leaderboard_index = LeaderboardIndex(
+        sync_overlap=float(os.environ.get('LEADERBOARD_SYNC_OVERLAP', '10')),
+        reload_interval=float(os.environ.get('LEADERBOARD_RELOAD_INTERVAL', '300'))
+    )
+LEADERBOARD_SYNC_INTERVAL = float(os.environ.get('LEADERBOARD_SYNC_INTERVAL', '2'))
+
+# Optional write-behind ingestion: results are queued and written in
+# batches; saves get 503 while the queue is full
+result_buffer = None
+if os.environ.get('RESULT_WRITE_BEHIND', '0') == '1':
+    result_buffer = ResultWriteBuffer(
+        max_size=int(os.environ.get('RESULT_QUEUE_SIZE', '10000')),
+        batch_size=int(os.environ.get('RESULT_BATCH_SIZE', '500')),
+        flush_interval=float(os.environ.get('RESULT_FLUSH_INTERVAL', '0.5')),
+        max_retries=int(os.environ.get('RESULT_WRITE_RETRIES', '3')),
+        idempotency_keys=idempotency_keys,
+        leaderboard_index=leaderboard_index
+    )
+
+# Names and pictures of leaderboard players, refreshed every few seconds
+user_display_cache = UserDisplayCache(
+    max_size=int(os.environ.get('USER_DISPLAY_CACHE_SIZE', '10000')),
+    ttl=float(os.environ.get('USER_DISPLAY_CACHE_TTL', '30'))
+)
+
+# Largest leaderboard page; longer rankings are read with cursors
+MAX_LEADERBOARD_PAGE = int(os.environ.get('MAX_LEADERBOARD_PAGE', '100'))
+
+# Players shown either side of the caller by /leaderboard/{exercise_id}/me
+MAX_LEADERBOARD_AROUND = int(os.environ.get('MAX_LEADERBOARD_AROUND', '25'))
+
+# Oldest sessions beyond this count are deleted on login
+MAX_SESSIONS_PER_USER = int(os.environ.get('MAX_SESSIONS_PER_USER', '10'))
+
 # ============================================================================
 # MODELS
 # ============================================================================
@@ -160,72 +306,58 @@ class TelegramUser(BaseModel):
     photo_url: Optional[str] = None
 
 # ============================================================================
-# TELEGRAM AUTH HELPERS
+# AUTHENTICATION HELPERS
 # ============================================================================
 
-def validate_telegram_init_data(init_data: str, bot_token: str) -> Optional[Dict[str, Any]]:
+async def refresh_session_snapshots(user_doc: Dict[str, Any]):
     """
-    Validate Telegram WebApp initData using HMAC-SHA256.
-    Returns parsed data if valid, None if invalid.
+    Refresh the user snapshot on all sessions of this user.
+    Sessions already carrying a newer version are left untouched.
     """
-    try:
-        # Parse init_data
-        parsed_data = dict(parse_qsl(init_data, keep_blank_values=True))
-        
-        if 'hash' not in parsed_data:
-            logger.error("No hash in init_data")
-            return None
-        
-        received_hash = parsed_data.pop('hash')
-        
-        # Create data-check-string
-        data_check_arr = []
-        for key in sorted(parsed_data.keys()):
-            data_check_arr.append(f"{key}={parsed_data[key]}")
-        data_check_string = '\n'.join(data_check_arr)
-        
-        # Create secret key: HMAC-SHA256(bot_token, "WebAppData")
-        secret_key = hmac.new(
-            b"WebAppData",
-            bot_token.encode(),
-            hashlib.sha256
-        ).digest()
-        
-        # Calculate hash
-        calculated_hash = hmac.new(
-            secret_key,
-            data_check_string.encode(),
-            hashlib.sha256
-        ).hexdigest()
-        
-        if calculated_hash != received_hash:
-            logger.error(f"Hash mismatch: {calculated_hash} != {received_hash}")
-            return None
-        
-        # Check auth_date (optional: reject if too old)
-        auth_date = int(parsed_data.get('auth_date', 0))
-        current_time = int(datetime.now(timezone.utc).timestamp())
-        if current_time - auth_date > 86400:  # 24 hours
-            logger.warning("Telegram auth_date is too old, but allowing for development")
-            # In production, you might want to reject old auth
-        
-        # Parse user data
-        if 'user' in parsed_data:
-            user_data = json.loads(unquote(parsed_data['user']))
-            parsed_data['user'] = user_data
-        
-        return parsed_data
-        
-    except Exception as e:
-        logger.error(f"Error validating Telegram init_data: {e}")
-        return None
+    await session_store.refresh_snapshots(
+        user_doc["user_id"],
+        build_user_snapshot(user_doc),
+        user_doc.get("version", 0)
+    )
+    session_cache.invalidate_user(user_doc["user_id"])
+    user_display_cache.invalidate(user_doc["user_id"])
 
-# ============================================================================
-# AUTHENTICATION HELPERS
-# ============================================================================
+def session_lifetime(user_doc: Dict[str, Any]) -> timedelta:
+    """
+    Sliding window of a session: 30 days for Telegram, 7 days otherwise.
+    """
+    return timedelta(days=30) if user_doc.get("auth_type") == "telegram" else timedelta(days=7)
+
+def touch_session(
+    session_token: str,
+    user_doc: Dict[str, Any],
+    response: Response,
+    from_cookie: bool,
+    stored: bool = True
+):
+    """
+    Extend the session and record last-seen, at most once per touch interval.
+    """
+    lifetime = session_lifetime(user_doc)
+    accepted = session_touches.touch(
+        session_token,
+        user_doc["user_id"],
+        lifetime.total_seconds() if stored else None
+    )
+    if accepted and stored and from_cookie:
+        response.set_cookie(
+            key="session_token",
+            value=session_token,
+            httponly=True,
+            secure=True,
+            samesite="none",
+            max_age=int(lifetime.total_seconds()),
+            path="/"
+        )
 
 async def get_current_user(
     request: Request,
+    response: Response,
     authorization: Optional[str] = Header(None)
 ) -> Dict[str, Any]:
     """
@@ -237,6 +369,8 @@ async def get_current_user(
     # Check cookie first
     session_token = request.cookies.get("session_token")
     
+    from_cookie = session_token is not None
+    
     # Fallback to Authorization header
     if not session_token and authorization:
         if authorization.startswith("Bearer "):
@@ -247,100 +381,267 @@ async def get_current_user(
     if not session_token:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    # Find session in database
-    session_doc = await db.user_sessions.find_one(
-        {"session_token": session_token},
-        {"_id": 0}
-    )
+    # Signed tokens are verified in CPU only, no database read
+    if is_signed_token(session_token):
+        claims = token_signer.verify(session_token) if token_signer else None
+        if not claims or revocations.is_revoked(claims):
+            raise HTTPException(status_code=401, detail="Invalid session")
+        touch_session(session_token, claims["user"], response, from_cookie, stored=False)
+        return dict(claims["user"])
+    
+    # Serve from the in-process cache when possible
+    cached_user = session_cache.get(session_token)
+    if cached_user is not None:
+        touch_session(session_token, cached_user, response, from_cookie)
+        return dict(cached_user)
+    
+    # Known-bad tokens are rejected without a database read
+    negative = negative_session_cache.check(session_token)
+    if negative == "hit":
+        raise HTTPException(status_code=401, detail="Invalid session")
+    
+    # Find session in the store (single point read, snapshot included)
+    session_doc = await session_store.get(session_token)
     
     if not session_doc:
+        negative_session_cache.add(session_token, expired=False)
         raise HTTPException(status_code=401, detail="Invalid session")
     
-    # Check if session is expired
+    # Check if session is expired (string dates only on unmigrated sessions)
     expires_at = session_doc["expires_at"]
     if isinstance(expires_at, str):
         expires_at = datetime.fromisoformat(expires_at)
     if expires_at.tzinfo is None:
         expires_at = expires_at.replace(tzinfo=timezone.utc)
     
-    if expires_at < datetime.now(timezone.utc):
+    now = datetime.now(timezone.utc)
+    if expires_at < now:
+        negative_session_cache.add(session_token)
         raise HTTPException(status_code=401, detail="Session expired")
     
-    # Get user data
-    user_doc = await db.users.find_one(
-        {"user_id": session_doc["user_id"]},
-        {"_id": 0}
-    )
+    if negative == "verify":
+        negative_session_cache.record_false_positive(session_token)
     
+    # Use the denormalized snapshot; fall back to users for legacy sessions
+    user_doc = session_doc.get("user")
     if not user_doc:
-        raise HTTPException(status_code=404, detail="User not found")
+        user_doc = await db.users.find_one(
+            {"user_id": session_doc["user_id"]},
+            {"_id": 0}
+        )
+        
+        if not user_doc:
+            raise HTTPException(status_code=404, detail="User not found")
+        
+        user_doc = build_user_snapshot(user_doc)
+    
+    session_cache.put(session_token, user_doc, max_age=(expires_at - now).total_seconds())
+    touch_session(session_token, user_doc, response, from_cookie)
     
-    return user_doc
+    return dict(user_doc)
+
+async def session_token_alive(session_token: str) -> bool:
+    """
+    Whether a session token issued earlier can still be used; checked
+    before handing back a login from the per-process replay cache.
+    """
+    if is_signed_token(session_token):
+        claims = token_signer.verify(session_token) if token_signer else None
+        return bool(claims) and not revocations.is_revoked(claims)
+    return await session_store.get(session_token) is not None
+
+async def enforce_session_cap(user_id: str, keep: int = MAX_SESSIONS_PER_USER):
+    """
+    Delete the oldest sessions of a user beyond the `keep` most recent.
+    """
+    for stale_token in await session_store.trim(user_id, keep):
+        session_cache.invalidate_token(stale_token)
+
+def client_ip(request: Request) -> str:
+    """
+    Client address; X-Real-IP, set by the nginx proxy, only when
+    RATE_LIMIT_TRUST_PROXY is on.
+    """
+    if RATE_LIMIT_TRUST_PROXY and request.headers.get("x-real-ip"):
+        return request.headers["x-real-ip"]
+    return request.client.host if request.client else "unknown"
+
+async def enforce_rate_limit(key: str):
+    """
+    Raise 429 with Retry-After when `key` is out of tokens.
+    """
+    retry_after = await auth_rate_limiter.hit(key)
+    if retry_after > 0:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests",
+            headers={"Retry-After": str(math.ceil(retry_after))}
+        )
+
+async def rate_limit_by_ip(request: Request):
+    await enforce_rate_limit(f"ip:{client_ip(request)}")
+
+def creation_time() -> datetime:
+    """
+    Current time at BSON date precision (milliseconds). A login upsert
+    stores it as created_at only when it inserts the user, so comparing
+    the returned created_at with it tells a new user from an existing one,
+    including users from before `version` was tracked.
+    """
+    now = datetime.now(timezone.utc)
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+async def upsert_user(query: Dict[str, Any], update: Any) -> Dict[str, Any]:
+    """
+    Create or update a user in a single round trip.
+    Concurrent first logins race on the unique index; the loser retries
+    and then matches the winner's document.
+    """
+    for attempt in range(2):
+        try:
+            return await db.users.find_one_and_update(
+                query,
+                update,
+                projection={"_id": 0},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            if attempt:
+                raise
+
+async def update_progress(user_id: str, exercise_id: str, score: float, lower_is_better: bool = False):
+    """
+    Fold one game into the user's progress for an exercise in a single
+    atomic upsert. Concurrent first games race on the unique index; the
+    loser retries and then updates the winner's document.
+    """
+    query = {"user_id": user_id, "exercise_id": exercise_id}
+    pipeline = progress_update_pipeline([score], lower_is_better, datetime.now(timezone.utc))
+    for attempt in range(2):
+        try:
+            await db.user_progress.update_one(query, pipeline, upsert=True)
+            return
+        except DuplicateKeyError:
+            if attempt:
+                raise
+
+def check_idempotency_key(key: Optional[str]):
+    if key is not None and not 0 < len(key) <= MAX_KEY_LENGTH:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Idempotency key must be 1 to {MAX_KEY_LENGTH} characters"
+        )
+
+async def record_result(result_doc: Dict[str, Any], idempotency_key: Optional[str] = None) -> str:
+    """
+    Store a result and fold its metric into the user's progress, directly
+    or through the write-behind buffer when it is enabled.
+    With an idempotency key, a retried save is a no-op; returns the
+    result_id of the first save.
+    """
+    user_id = result_doc["user_id"]
+    scoring = get_scoring(result_doc["exercise_id"])
+    score = result_doc[scoring.metric]
+    lower_is_better = scoring.lower_is_better
+    if idempotency_key is not None:
+        check_idempotency_key(idempotency_key)
+        original = await idempotency_keys.claim(user_id, idempotency_key, result_doc["result_id"])
+        if original:
+            return original
+
+    # Release the key only while the result is not stored; once it is,
+    # a retry must find the key and must not store the result again
+    try:
+        if result_buffer is None:
+            await db.user_results.insert_one(result_doc)
+        else:
+            try:
+                result_buffer.submit(result_doc, score, lower_is_better, idempotency_key)
+            except ResultQueueFull:
+                raise HTTPException(
+                    status_code=503,
+                    detail="Too many results being saved, please retry",
+                    headers={"Retry-After": "1"}
+                )
+    except Exception:
+        if idempotency_key is not None:
+            await idempotency_keys.release(user_id, idempotency_key)
+        raise
+
+    # A buffered result reaches the in-memory leaderboard once it is written
+    if result_buffer is None:
+        await asyncio.gather(
+            update_progress(user_id, result_doc["exercise_id"], score, lower_is_better),
+            bulk_update_leaderboard(db, [result_doc])
+        )
+        if leaderboard_index:
+            leaderboard_index.record([result_doc])
+
+    return result_doc["result_id"]
 
 # ============================================================================
 # AUTHENTICATION ROUTES
 # ============================================================================
 
-@api_router.post("/auth/session")
+@api_router.post("/auth/session", dependencies=[Depends(rate_limit_by_ip)])
 async def create_session(session_request: SessionRequest, response: Response):
     """
     Exchange session_id for user data and create session_token.
     """
     try:
         # Call Emergent Auth API to get user data
-        async with httpx.AsyncClient() as client:
-            auth_response = await client.get(
-                "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
-                headers={"X-Session-ID": session_request.session_id},
-                timeout=10.0
-            )
-            
-            if auth_response.status_code != 200:
-                raise HTTPException(status_code=401, detail="Invalid session ID")
-            
-            user_data = auth_response.json()
-        
-        # Check if user exists
-        existing_user = await db.users.find_one(
+        try:
+            user_data = await emergent_auth_client.get_session_data(session_request.session_id)
+        except InvalidSessionId:
+            raise HTTPException(status_code=401, detail="Invalid session ID")
+        
+        # Create or update the user by email
+        created_at = creation_time()
+        user_doc = await upsert_user(
             {"email": user_data["email"]},
-            {"_id": 0}
-        )
-        
-        if existing_user:
-            user_id = existing_user["user_id"]
-            # Update user data if needed
-            await db.users.update_one(
-                {"user_id": user_id},
-                {"$set": {
+            {
+                "$set": {
                     "name": user_data["name"],
                     "picture": user_data.get("picture")
-                }}
-            )
-        else:
-            # Create new user
-            user_id = f"user_{uuid.uuid4().hex[:12]}"
-            new_user = {
-                "user_id": user_id,
-                "email": user_data["email"],
-                "name": user_data["name"],
-                "picture": user_data.get("picture"),
-                "created_at": datetime.now(timezone.utc).isoformat()
+                },
+                "$inc": {"version": 1},
+                "$setOnInsert": {
+                    "user_id": f"user_{uuid.uuid4().hex[:12]}",
+                    "created_at": created_at
+                }
             }
-            await db.users.insert_one(new_user)
+        )
+        user_id = user_doc["user_id"]
+        is_new_user = user_doc.get("created_at") == created_at
         
         # Create session
         session_token = user_data["session_token"]
         expires_at = datetime.now(timezone.utc) + timedelta(days=7)
         
-        session_doc = {
-            "session_id": f"session_{uuid.uuid4().hex}",
-            "user_id": user_id,
-            "session_token": session_token,
-            "expires_at": expires_at.isoformat(),
-            "created_at": datetime.now(timezone.utc).isoformat()
-        }
-        
-        await db.user_sessions.insert_one(session_doc)
+        if token_signer:
+            session_token = token_signer.issue(build_user_snapshot(user_doc), 7 * 24 * 60 * 60)
+            if not is_new_user:
+                await refresh_session_snapshots(user_doc)
+        else:
+            session_doc = {
+                "session_id": f"session_{uuid.uuid4().hex}",
+                "user_id": user_id,
+                "session_token": session_token,
+                "user": build_user_snapshot(user_doc),
+                "user_version": user_doc.get("version", 0),
+                "expires_at": expires_at,
+                "created_at": datetime.now(timezone.utc)
+            }
+            
+            negative_session_cache.invalidate(session_token)
+            
+            # Independent writes, run concurrently; the cap leaves room for the new session
+            writes = [session_store.create(session_doc)]
+            if not is_new_user:
+                writes.append(refresh_session_snapshots(user_doc))
+                writes.append(enforce_session_cap(user_id, keep=MAX_SESSIONS_PER_USER - 1))
+            await asyncio.gather(*writes)
         
         # Set cookie
         response.set_cookie(
@@ -353,17 +654,14 @@ async def create_session(session_request: SessionRequest, response: Response):
             path="/"
         )
         
-        # Get full user data
-        user_doc = await db.users.find_one({"user_id": user_id}, {"_id": 0})
-        
         return {
             "user": user_doc,
             "session_token": session_token
         }
         
-    except httpx.RequestError as e:
+    except AuthServiceUnavailable as e:
         logger.error(f"Error calling Emergent Auth API: {e}")
-        raise HTTPException(status_code=500, detail="Authentication service error")
+        raise HTTPException(status_code=503, detail="Authentication service unavailable")
 
 @api_router.get("/auth/me")
 async def get_me(user: Dict[str, Any] = Depends(get_current_user)):
@@ -376,7 +674,7 @@ async def get_me(user: Dict[str, Any] = Depends(get_current_user)):
 # TELEGRAM AUTHENTICATION
 # ============================================================================
 
-@api_router.post("/auth/telegram")
+@api_router.post("/auth/telegram", dependencies=[Depends(rate_limit_by_ip)])
 async def telegram_auth(request: TelegramAuthRequest, response: Response):
     """
     Authenticate user via Telegram WebApp initData.
@@ -389,17 +687,39 @@ async def telegram_auth(request: TelegramAuthRequest, response: Response):
             raise HTTPException(status_code=500, detail="Telegram auth not configured")
         
         # Validate initData
-        validated_data = validate_telegram_init_data(request.init_data, bot_token)
+        validated_data = validate_telegram_init_data(
+            request.init_data, bot_token, max_age=TELEGRAM_AUTH_MAX_AGE
+        )
         
         if not validated_data:
             raise HTTPException(status_code=401, detail="Invalid Telegram authentication")
         
+        # Same initData seen recently: hand back the session it created,
+        # unless a login on another worker has since replaced it
+        replayed = telegram_replay_cache.get(validated_data["hash"])
+        if replayed and not await session_token_alive(replayed["session_token"]):
+            telegram_replay_cache.invalidate_token(replayed["session_token"])
+            replayed = None
+        if replayed:
+            response.set_cookie(
+                key="session_token",
+                value=replayed["session_token"],
+                httponly=True,
+                secure=True,
+                samesite="none",
+                max_age=30 * 24 * 60 * 60,  # 30 days
+                path="/"
+            )
+            return replayed
+        
         # Extract user data
         tg_user = validated_data.get('user')
         if not tg_user:
             raise HTTPException(status_code=401, detail="No user data in Telegram auth")
         
         telegram_id = str(tg_user['id'])
+        await enforce_rate_limit(f"tg:{telegram_id}")
+        
         first_name = tg_user.get('first_name', '')
         last_name = tg_user.get('last_name', '')
         username = tg_user.get('username', '')
@@ -408,57 +728,57 @@ async def telegram_auth(request: TelegramAuthRequest, response: Response):
         # Full name
         full_name = f"{first_name} {last_name}".strip() or username or f"User {telegram_id}"
         
-        # Check if user exists (by telegram_id)
-        existing_user = await db.users.find_one(
+        # Create or update the user by telegram_id. Pipeline update so the
+        # stored picture survives when Telegram sends none; user-supplied
+        # strings are wrapped in $literal so they are never read as paths.
+        created_at = creation_time()
+        user_doc = await upsert_user(
             {"telegram_id": telegram_id},
-            {"_id": 0}
+            [{"$set": {
+                "user_id": {"$ifNull": ["$user_id", f"tg_{telegram_id}"]},
+                "email": {"$ifNull": ["$email", f"{telegram_id}@telegram.user"]},  # Placeholder email
+                "auth_type": {"$ifNull": ["$auth_type", "telegram"]},
+                "created_at": {"$ifNull": ["$created_at", created_at]},
+                "name": {"$literal": full_name},
+                "telegram_username": {"$literal": username},
+                "picture": {"$literal": photo_url} if photo_url else {"$ifNull": ["$picture", ""]},
+                "version": {"$add": [{"$ifNull": ["$version", 0]}, 1]}
+            }}]
         )
-        
-        if existing_user:
-            user_id = existing_user["user_id"]
-            # Update user data
-            await db.users.update_one(
-                {"user_id": user_id},
-                {"$set": {
-                    "name": full_name,
-                    "telegram_username": username,
-                    "picture": photo_url or existing_user.get("picture")
-                }}
-            )
-        else:
-            # Create new user
-            user_id = f"tg_{telegram_id}"
-            new_user = {
-                "user_id": user_id,
-                "telegram_id": telegram_id,
-                "telegram_username": username,
-                "email": f"{telegram_id}@telegram.user",  # Placeholder email
-                "name": full_name,
-                "picture": photo_url,
-                "auth_type": "telegram",
-                "created_at": datetime.now(timezone.utc).isoformat()
-            }
-            await db.users.insert_one(new_user)
+        user_id = user_doc["user_id"]
+        if user_doc.get("created_at") == created_at:
             logger.info(f"Created new Telegram user: {user_id}")
         
         # Create session token
         session_token = f"tg_{uuid.uuid4().hex}"
         expires_at = datetime.now(timezone.utc) + timedelta(days=30)  # Longer for Telegram
         
-        # Delete any existing sessions for this user
-        await db.user_sessions.delete_many({"user_id": user_id})
-        
-        # Create new session
-        session_doc = {
-            "session_id": f"session_{uuid.uuid4().hex}",
-            "user_id": user_id,
-            "session_token": session_token,
-            "auth_type": "telegram",
-            "expires_at": expires_at.isoformat(),
-            "created_at": datetime.now(timezone.utc).isoformat()
-        }
+        # Earlier initData of this user must not resurrect a replaced session
+        telegram_replay_cache.invalidate_user(user_id)
+        user_display_cache.invalidate(user_id)
         
-        await db.user_sessions.insert_one(session_doc)
+        if token_signer:
+            # Revoke tokens issued earlier for this user, then issue a signed one
+            now = int(datetime.now(timezone.utc).timestamp())
+            await revocations.revoke_user(db, user_id, now, expires_at.timestamp())
+            session_token = token_signer.issue(build_user_snapshot(user_doc), 30 * 24 * 60 * 60)
+        else:
+            # Replace any existing session for this user
+            session_doc = {
+                "session_id": f"session_{uuid.uuid4().hex}",
+                "user_id": user_id,
+                "session_token": session_token,
+                "auth_type": "telegram",
+                "user": build_user_snapshot(user_doc),
+                "user_version": user_doc.get("version", 0),
+                "expires_at": expires_at,
+                "created_at": datetime.now(timezone.utc)
+            }
+            
+            await session_store.replace_user_sessions(user_id, session_doc)
+            # Evict the replaced tokens; only done now, so a request that
+            # cached one meanwhile cannot keep it alive
+            session_cache.invalidate_user(user_id)
         
         # Set cookie
         response.set_cookie(
@@ -471,16 +791,20 @@ async def telegram_auth(request: TelegramAuthRequest, response: Response):
             path="/"
         )
         
-        # Get full user data
-        user_doc = await db.users.find_one({"user_id": user_id}, {"_id": 0})
-        
         logger.info(f"Telegram auth successful for user: {user_id}")
         
-        return {
+        login_response = {
             "user": user_doc,
             "session_token": session_token,
             "auth_type": "telegram"
         }
+        telegram_replay_cache.put(
+            validated_data["hash"],
+            int(validated_data.get("auth_date", 0)),
+            login_response
+        )
+        
+        return login_response
         
     except HTTPException:
         raise
@@ -495,9 +819,19 @@ async def logout(request: Request, response: Response):
     """
     session_token = request.cookies.get("session_token")
     
-    if session_token:
+    if session_token and is_signed_token(session_token):
+        # Signed tokens cannot be deleted, so revoke them until expiry
+        claims = token_signer.verify(session_token) if token_signer else None
+        if claims:
+            await revocations.revoke_token(db, claims)
+    elif session_token:
         # Delete session from database
-        await db.user_sessions.delete_one({"session_token": session_token})
+        await session_store.delete(session_token)
+        session_cache.invalidate_token(session_token)
+        session_touches.forget(session_token)
+    
+    if session_token:
+        telegram_replay_cache.invalidate_token(session_token)
     
     # Clear cookie
     response.delete_cookie(key="session_token", path="/")
@@ -509,180 +843,83 @@ async def logout(request: Request, response: Response):
 # ============================================================================
 
 @api_router.get("/exercises")
-async def get_exercises():
+async def get_exercises(request: Request):
     """
     Get all available exercises.
+    Served from the in-memory catalog snapshot with ETag revalidation.
     """
-    exercises = await db.exercises.find({}, {"_id": 0}).to_list(100)
+    snapshot = exercise_catalog.snapshot
+    headers = {
+        "ETag": snapshot.etag,
+        "X-Catalog-Version": str(snapshot.version),
+        "Cache-Control": "public, no-cache",
+        "Vary": "Accept-Encoding"
+    }
     
-    # Full list of all exercises
-    all_exercises = [
-        {
-            "exercise_id": "schulte",
-            "name": "Таблицы Шульте",
-            "description": "Тренировка периферийного зрения и концентрации",
-            "icon": "grid-3x3",
-            "difficulty": "medium",
-            "category": "attention"
-        },
-        {
-            "exercise_id": "sequence",
-            "name": "Запоминание последовательностей",
-            "description": "Запомните порядок загорающихся ячеек",
-            "icon": "brain",
-            "difficulty": "medium",
-            "category": "memory"
-        },
-        {
-            "exercise_id": "spot-difference",
-            "name": "Поиск отличий",
-            "description": "Найдите различия между AI-изображениями",
-            "icon": "scan-search",
-            "difficulty": "easy",
-            "category": "attention"
-        },
-        {
-            "exercise_id": "stroop",
-            "name": "Тест Струпа",
-            "description": "Тренировка когнитивной гибкости и внимания",
-            "icon": "palette",
-            "difficulty": "medium",
-            "category": "attention"
-        },
-        {
-            "exercise_id": "catch-letter",
-            "name": "Поймай букву",
-            "description": "Ловите падающие буквы на скорость",
-            "icon": "type",
-            "difficulty": "easy",
-            "category": "speed"
-        },
-        {
-            "exercise_id": "whack-mole",
-            "name": "Поймай крота",
-            "description": "Классическая игра на скорость реакции",
-            "icon": "target",
-            "difficulty": "easy",
-            "category": "speed"
-        },
-        {
-            "exercise_id": "math",
-            "name": "Математические задачи",
-            "description": "Решайте примеры на скорость",
-            "icon": "calculator",
-            "difficulty": "hard",
-            "category": "logic"
-        },
-        {
-            "exercise_id": "typing",
-            "name": "Скорость печати",
-            "description": "Тренировка скорости и точности набора текста",
-            "icon": "keyboard",
-            "difficulty": "medium",
-            "category": "speed"
-        }
-    ]
+    if snapshot.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
     
-    if not exercises:
-        # Initialize all exercises if none exist
-        await db.exercises.insert_many(all_exercises)
-        exercises = all_exercises
-    else:
-        # Check if all exercises exist, add missing ones
-        existing_ids = {e["exercise_id"] for e in exercises}
-        missing_exercises = [e for e in all_exercises if e["exercise_id"] not in existing_ids]
-        
-        if missing_exercises:
-            await db.exercises.insert_many(missing_exercises)
-            exercises = await db.exercises.find({}, {"_id": 0}).to_list(100)
+    body, encoding = snapshot.encoded_body(request.headers.get("accept-encoding"))
+    if encoding:
+        headers["Content-Encoding"] = encoding
     
-    return exercises
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @api_router.get("/exercises/{exercise_id}")
-async def get_exercise(exercise_id: str):
+async def get_exercise(exercise_id: str, response: Response):
     """
     Get specific exercise details.
     """
-    exercise = await db.exercises.find_one(
-        {"exercise_id": exercise_id},
-        {"_id": 0}
-    )
+    snapshot = exercise_catalog.snapshot
+    exercise = snapshot.get(exercise_id)
     
     if not exercise:
         raise HTTPException(status_code=404, detail="Exercise not found")
     
-    return exercise
+    response.headers["X-Catalog-Version"] = str(snapshot.version)
+    return dict(exercise)
 
 # ============================================================================
 # RESULTS ROUTES
 # ============================================================================
 
+def build_result_doc(
+    user_id: str,
+    exercise_id: str,
+    request: Dict[str, Any],
+    scoring: Optional[ExerciseScoring] = None
+) -> Dict[str, Any]:
+    """
+    Result document for a validated save request, with the fields the
+    exercise's scoring entry declares.
+    """
+    scoring = scoring or get_scoring(exercise_id)
+    return {
+        "result_id": f"result_{uuid.uuid4().hex[:12]}",
+        "user_id": user_id,
+        "exercise_id": exercise_id,
+        **scoring.result_fields(request),
+        "created_at": datetime.now(timezone.utc)
+    }
+
 @api_router.post("/results")
 async def save_result(
     result_data: ResultCreate,
-    user: Dict[str, Any] = Depends(get_current_user)
+    user: Dict[str, Any] = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
 ):
     """
     Save user's exercise result and update progress.
     """
-    user_id = user["user_id"]
-    
-    # Create result document
-    result_doc = {
-        "result_id": f"result_{uuid.uuid4().hex[:12]}",
-        "user_id": user_id,
-        "exercise_id": result_data.exercise_id,
-        "score": result_data.score,
-        "time": result_data.time,
-        "grid_size": result_data.grid_size,
-        "created_at": datetime.now(timezone.utc).isoformat()
-    }
-    
-    await db.user_results.insert_one(result_doc)
-    
-    # Update user progress
-    progress = await db.user_progress.find_one(
-        {"user_id": user_id, "exercise_id": result_data.exercise_id},
-        {"_id": 0}
+    result_doc = build_result_doc(
+        user["user_id"],
+        result_data.exercise_id,
+        result_data.model_dump(),
+        scoring=DEFAULT_SCORING
     )
+    result_id = await record_result(result_doc, idempotency_key=idempotency_key)
     
-    if progress:
-        # Update existing progress
-        total_games = progress["total_games"] + 1
-        best_score = min(result_data.time, progress.get("best_score", result_data.time))
-        
-        # Calculate average (simple moving average)
-        current_avg = progress.get("average_score", result_data.time)
-        new_avg = ((current_avg * progress["total_games"]) + result_data.time) / total_games
-        
-        # Calculate level (1 level per 10 games, with bonus for good scores)
-        level = 1 + (total_games // 10)
-        
-        await db.user_progress.update_one(
-            {"user_id": user_id, "exercise_id": result_data.exercise_id},
-            {"$set": {
-                "total_games": total_games,
-                "best_score": best_score,
-                "average_score": new_avg,
-                "level": level,
-                "last_played": datetime.now(timezone.utc).isoformat()
-            }}
-        )
-    else:
-        # Create new progress
-        progress_doc = {
-            "progress_id": f"progress_{uuid.uuid4().hex[:12]}",
-            "user_id": user_id,
-            "exercise_id": result_data.exercise_id,
-            "level": 1,
-            "total_games": 1,
-            "best_score": result_data.time,
-            "average_score": result_data.time,
-            "last_played": datetime.now(timezone.utc).isoformat()
-        }
-        await db.user_progress.insert_one(progress_doc)
-    
-    return {"message": "Result saved successfully", "result_id": result_doc["result_id"]}
+    return {"message": "Result saved successfully", "result_id": result_id}
 
 @api_router.get("/results/user")
 async def get_user_results(
@@ -711,98 +948,170 @@ async def get_user_results(
 @api_router.get("/leaderboard/{exercise_id}")
 async def get_leaderboard(
     exercise_id: str,
-    limit: int = 10
+    request: Request,
+    response: Response,
+    limit: int = 10,
+    cursor: Optional[str] = None
 ):
     """
     Get leaderboard for specific exercise.
-    Different exercises have different sorting criteria:
-    - Time-based (schulte, stroop, sequence): lowest time is better
-    - Score-based (whack-mole, catch-letter, math): highest score is better
-    - WPM-based (typing): highest WPM is better
+    Players are ranked by the best value of the exercise's scoring metric
+    (see scoring.py), optionally within a partition given as query
+    parameters, e.g. ?difficulty=hard or ?grid_size=5.
+    Served from leaderboard_entries, maintained on every save.
+    
+    Pages hold at most MAX_LEADERBOARD_PAGE players. When more may follow,
+    the X-Next-Cursor header holds the cursor of the next page.
     """
+    scoring = get_scoring(exercise_id)
+    try:
+        partition = scoring.partition_filter(request.query_params)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid partition value")
     
-    # Define which exercises use which metric
-    score_based_exercises = ['whack-mole', 'catch-letter', 'math']
-    wpm_based_exercises = ['typing']
-    time_based_exercises = ['schulte', 'stroop', 'sequence', 'spot-difference']
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be positive")
+    limit = min(limit, MAX_LEADERBOARD_PAGE)
+    after = None
+    if cursor is not None:
+        try:
+            after = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
     
-    if exercise_id in score_based_exercises:
-        # For score-based games: higher score is better
-        pipeline = [
-            {"$match": {"exercise_id": exercise_id}},
-            {"$group": {
-                "_id": "$user_id",
-                "best_score": {"$max": "$score"},
-                "total_games": {"$sum": 1}
-            }},
-            {"$sort": {"best_score": -1}},  # Descending - higher is better
-            {"$limit": limit}
-        ]
-        score_field = "best_score"
-    elif exercise_id in wpm_based_exercises:
-        # For typing: higher WPM is better
-        pipeline = [
-            {"$match": {"exercise_id": exercise_id}},
-            {"$group": {
-                "_id": "$user_id",
-                "best_wpm": {"$max": "$score"},
-                "total_games": {"$sum": 1}
-            }},
-            {"$sort": {"best_wpm": -1}},  # Descending - higher is better
-            {"$limit": limit}
-        ]
-        score_field = "best_wpm"
+    if leaderboard_index and leaderboard_index.ready:
+        entries = leaderboard_index.top(exercise_id, partition_key(partition), limit, after)
     else:
-        # For time-based games: lower time is better
-        pipeline = [
-            {"$match": {"exercise_id": exercise_id}},
-            {"$group": {
-                "_id": "$user_id",
-                "best_time": {"$min": "$time"},
-                "total_games": {"$sum": 1}
-            }},
-            {"$sort": {"best_time": 1}},  # Ascending - lower is better
-            {"$limit": limit}
-        ]
-        score_field = "best_time"
-    
-    leaderboard_data = await db.user_results.aggregate(pipeline).to_list(limit)
+        # Materialized per-user bests; a page is a range read on the
+        # (exercise_id, partition, best, user_id) index, starting after
+        # the cursor entry, so deep pages cost the same as the first
+        direction = scoring.sort_direction
+        query = {"exercise_id": exercise_id, "partition": partition_key(partition)}
+        if after:
+            query.update(keyset_filter(*after, direction))
+        entries = await db.leaderboard_entries.find(
+            query,
+            {"_id": 0, "user_id": 1, "best": 1, "total_games": 1, "level": 1}
+        ).sort([("best", direction), ("user_id", direction)]).limit(limit).to_list(limit)
     
-    # Enrich with user data and progress
-    leaderboard = []
-    for entry in leaderboard_data:
-        user_doc = await db.users.find_one(
-            {"user_id": entry["_id"]},
-            {"_id": 0, "user_id": 1, "name": 1, "picture": 1}
+    if len(entries) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(entries[-1]["best"], entries[-1]["user_id"])
+    return await leaderboard_rows(scoring, entries)
+
+@api_router.get("/leaderboard/{exercise_id}/me")
+async def get_my_leaderboard_position(
+    exercise_id: str,
+    request: Request,
+    around: int = 5,
+    user: Dict[str, Any] = Depends(get_current_user)
+):
+    """
+    The caller's rank and percentile on a leaderboard (same partition
+    parameters as above), with up to `around` players either side.
+    """
+    scoring = get_scoring(exercise_id)
+    try:
+        partition = scoring.partition_filter(request.query_params)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid partition value")
+    if not 0 <= around <= MAX_LEADERBOARD_AROUND:
+        raise HTTPException(
+            status_code=400,
+            detail=f"around must be 0 to {MAX_LEADERBOARD_AROUND}"
         )
-        
-        progress_doc = await db.user_progress.find_one(
-            {"user_id": entry["_id"], "exercise_id": exercise_id},
-            {"_id": 0, "level": 1}
+    
+    pkey = partition_key(partition)
+    if leaderboard_index and leaderboard_index.ready:
+        board = leaderboard_index.board(exercise_id, pkey)
+        rank = board.rank(user["user_id"]) if board else None
+        total = len(board) if board else 0
+        if rank is not None:
+            first = max(rank - around, 0)
+            neighbours = board.top(rank - first + around + 1, first)
+    else:
+        rank, total, first, neighbours = await leaderboard_position(
+            scoring, exercise_id, pkey, user["user_id"], around
         )
-        
+    
+    if rank is None:
+        return {"rank": None, "total_players": total, "percentile": None, "neighbours": []}
+    
+    return {
+        "rank": rank + 1,
+        "total_players": total,
+        # Share of the other players ranked below the caller
+        "percentile": round(100 * (total - 1 - rank) / (total - 1), 1) if total > 1 else 100.0,
+        "neighbours": await leaderboard_rows(scoring, neighbours, first_rank=first + 1)
+    }
+
+async def leaderboard_position(
+    scoring: ExerciseScoring,
+    exercise_id: str,
+    pkey: str,
+    user_id: str,
+    around: int
+):
+    """
+    Rank of a player from leaderboard_entries: the count of entries ahead
+    of theirs and the neighbours either side are all range reads on the
+    (exercise_id, partition, best, user_id) index.
+    Returns (rank, total, rank of the first neighbour, neighbours).
+    """
+    board = {"exercise_id": exercise_id, "partition": pkey}
+    projection = {"_id": 0, "user_id": 1, "best": 1, "total_games": 1, "level": 1}
+    entry = await db.leaderboard_entries.find_one({**board, "user_id": user_id}, projection)
+    if entry is None:
+        return None, await db.leaderboard_entries.count_documents(board), 0, []
+    
+    direction = scoring.sort_direction
+    ahead = keyset_filter(entry["best"], user_id, direction, after=False)
+    behind = keyset_filter(entry["best"], user_id, direction)
+    reads = [
+        db.leaderboard_entries.count_documents({**board, **ahead}),
+        db.leaderboard_entries.count_documents(board)
+    ]
+    # limit(0) means no limit to Mongo: without neighbours, skip their reads
+    if around:
+        reads += [
+            db.leaderboard_entries.find({**board, **ahead}, projection)
+                .sort([("best", -direction), ("user_id", -direction)]).limit(around).to_list(around),
+            db.leaderboard_entries.find({**board, **behind}, projection)
+                .sort([("best", direction), ("user_id", direction)]).limit(around).to_list(around)
+        ]
+    rank, total, *neighbours = await asyncio.gather(*reads)
+    above, below = neighbours or ([], [])
+    return rank, total, rank - len(above), above[::-1] + [entry] + below
+
+async def leaderboard_rows(
+    scoring: ExerciseScoring,
+    entries: List[Dict[str, Any]],
+    first_rank: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    """
+    Leaderboard response rows for leaderboard entries, in order, with the
+    players' names and pictures. Entries of deleted users are skipped.
+    With first_rank, rows are numbered from it.
+    """
+    users = await user_display_cache.get_many(db, [entry["user_id"] for entry in entries])
+    
+    rows = []
+    for i, entry in enumerate(entries):
+        user_doc = users.get(entry["user_id"])
         if user_doc:
-            leaderboard_entry = {
+            row = {
                 "user_id": user_doc["user_id"],
                 "name": user_doc["name"],
                 "picture": user_doc.get("picture"),
                 "total_games": entry["total_games"],
-                "level": progress_doc["level"] if progress_doc else 1
+                "level": entry["level"],
+                # best_time carries the metric for every exercise, for compatibility
+                "best_time": entry["best"],
+                scoring.leaderboard_field: entry["best"]
             }
-            
-            # Add the appropriate score field
-            if score_field == "best_time":
-                leaderboard_entry["best_time"] = entry.get("best_time", 0)
-            elif score_field == "best_score":
-                leaderboard_entry["best_time"] = entry.get("best_score", 0)  # Use best_time field for compatibility
-                leaderboard_entry["best_score"] = entry.get("best_score", 0)
-            elif score_field == "best_wpm":
-                leaderboard_entry["best_time"] = entry.get("best_wpm", 0)  # Use best_time field for compatibility
-                leaderboard_entry["best_wpm"] = entry.get("best_wpm", 0)
-            
-            leaderboard.append(leaderboard_entry)
-    
-    return leaderboard
+            if first_rank is not None:
+                row["rank"] = first_rank + i
+            rows.append(row)
+    return rows
 
 # ============================================================================
 # PROFILE ROUTES
@@ -826,7 +1135,7 @@ async def get_profile_stats(user: Dict[str, Any] = Depends(get_current_user)):
     
     return {
         "user": user,
-        "progress": progress_list,
+        "progress": [summarize_progress(p) for p in progress_list],
         "total_games": total_results
     }
 
@@ -911,7 +1220,7 @@ async def start_spot_difference_game(
                 "differences": game_data["differences"],
                 "total_differences": game_data["total_differences"],
                 "times_played": 1,
-                "created_at": datetime.now(timezone.utc).isoformat()
+                "created_at": datetime.now(timezone.utc)
             }
             
             await db.spot_difference_templates.insert_one(template_doc)
@@ -930,7 +1239,7 @@ async def start_spot_difference_game(
             "found_count": 0,
             "total_differences": template_data["total_differences"],
             "completed": False,
-            "start_time": datetime.now(timezone.utc).isoformat(),
+            "start_time": datetime.now(timezone.utc),
             "end_time": None
         }
         
@@ -989,24 +1298,23 @@ async def check_spot_difference_click(
         }
         
         if completed:
-            update_data["end_time"] = datetime.now(timezone.utc).isoformat()
+            update_data["end_time"] = datetime.now(timezone.utc)
             
             # Calculate time taken
-            start_time = datetime.fromisoformat(game_doc["start_time"])
+            start_time = game_doc["start_time"]
+            if isinstance(start_time, str):
+                # Games started before timestamps were stored as dates
+                start_time = datetime.fromisoformat(start_time)
             end_time = datetime.now(timezone.utc)
             time_taken = (end_time - start_time).total_seconds()
             
             # Save result
-            result_doc = {
-                "result_id": f"result_{uuid.uuid4().hex[:12]}",
-                "user_id": user["user_id"],
-                "exercise_id": "spot-difference",
-                "score": game_doc["total_differences"],
+            result_doc = build_result_doc(user["user_id"], "spot-difference", {
+                "total_differences": game_doc["total_differences"],
                 "time": time_taken,
-                "difficulty": game_doc["difficulty"],
-                "created_at": datetime.now(timezone.utc).isoformat()
-            }
-            await db.user_results.insert_one(result_doc)
+                "difficulty": game_doc["difficulty"]
+            })
+            await record_result(result_doc)
             
             # Mark template as solved by this user
             solved_record = {
@@ -1014,13 +1322,10 @@ async def check_spot_difference_click(
                 "user_id": user["user_id"],
                 "template_id": game_doc["template_id"],
                 "difficulty": game_doc["difficulty"],
-                "completed_at": datetime.now(timezone.utc).isoformat()
+                "completed_at": datetime.now(timezone.utc)
             }
             await db.user_solved_templates.insert_one(solved_record)
             logger.info(f"User {user['user_id']} solved template {game_doc['template_id']}")
-            
-            # Update user progress
-            await update_user_progress_for_spot_difference(user["user_id"], time_taken, game_doc["difficulty"])
         
         # Update game
         await db.spot_difference_games.update_one(
@@ -1044,104 +1349,10 @@ async def check_spot_difference_click(
             "completed": False
         }
 
-async def update_user_progress_for_spot_difference(user_id: str, time: float, difficulty: str):
-    """
-    Update user progress for spot the difference exercise.
-    """
-    exercise_id = "spot-difference"
-    
-    progress = await db.user_progress.find_one(
-        {"user_id": user_id, "exercise_id": exercise_id},
-        {"_id": 0}
-    )
-    
-    if progress:
-        # Update existing progress
-        total_games = progress["total_games"] + 1
-        best_score = min(time, progress.get("best_score", time))
-        
-        # Calculate average
-        current_avg = progress.get("average_score", time)
-        new_avg = ((current_avg * progress["total_games"]) + time) / total_games
-        
-        # Calculate level
-        level = 1 + (total_games // 10)
-        
-        await db.user_progress.update_one(
-            {"user_id": user_id, "exercise_id": exercise_id},
-            {"$set": {
-                "total_games": total_games,
-                "best_score": best_score,
-                "average_score": new_avg,
-                "level": level,
-                "last_played": datetime.now(timezone.utc).isoformat()
-            }}
-        )
-    else:
-        # Create new progress
-        progress_doc = {
-            "progress_id": f"progress_{uuid.uuid4().hex[:12]}",
-            "user_id": user_id,
-            "exercise_id": exercise_id,
-            "level": 1,
-            "total_games": 1,
-            "best_score": time,
-            "average_score": time,
-            "last_played": datetime.now(timezone.utc).isoformat()
-        }
-        await db.user_progress.insert_one(progress_doc)
-
 # ============================================================================
 # NEW MINI-GAMES ROUTES
 # ============================================================================
 
-# Common helper function for updating progress
-async def update_game_progress(user_id: str, exercise_id: str, score: float, is_lower_better: bool = False):
-    """
-    Generic function to update user progress for any game.
-    """
-    progress = await db.user_progress.find_one(
-        {"user_id": user_id, "exercise_id": exercise_id},
-        {"_id": 0}
-    )
-    
-    if progress:
-        total_games = progress["total_games"] + 1
-        
-        if is_lower_better:
-            # For games where lower is better (time-based)
-            best_score = min(score, progress.get("best_score", score))
-        else:
-            # For games where higher is better (accuracy/points)
-            best_score = max(score, progress.get("best_score", score))
-        
-        current_avg = progress.get("average_score", score)
-        new_avg = ((current_avg * progress["total_games"]) + score) / total_games
-        level = 1 + (total_games // 10)
-        
-        await db.user_progress.update_one(
-            {"user_id": user_id, "exercise_id": exercise_id},
-            {"$set": {
-                "total_games": total_games,
-                "best_score": best_score,
-                "average_score": new_avg,
-                "level": level,
-                "last_played": datetime.now(timezone.utc).isoformat()
-            }}
-        )
-    else:
-        progress_doc = {
-            "progress_id": f"progress_{uuid.uuid4().hex[:12]}",
-            "user_id": user_id,
-            "exercise_id": exercise_id,
-            "level": 1,
-            "total_games": 1,
-            "best_score": score,
-            "average_score": score,
-            "last_played": datetime.now(timezone.utc).isoformat()
-        }
-        await db.user_progress.insert_one(progress_doc)
-
 # 1. Stroop Test (Color Reaction)
 class StroopSaveRequest(BaseModel):
     difficulty: str
@@ -1152,27 +1363,17 @@ class StroopSaveRequest(BaseModel):
 @api_router.post("/stroop/save")
 async def save_stroop_result(
     request: StroopSaveRequest,
-    user: Dict[str, Any] = Depends(get_current_user)
+    user: Dict[str, Any] = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
 ):
     """Save Stroop test result."""
     try:
-        accuracy = (request.correct_answers / request.total_questions) * 100
-        
-        result_doc = {
-            "result_id": f"result_{uuid.uuid4().hex[:12]}",
-            "user_id": user["user_id"],
-            "exercise_id": "stroop",
-            "score": accuracy,
-            "time": request.average_time,
-            "difficulty": request.difficulty,
-            "correct_answers": request.correct_answers,
-            "total_questions": request.total_questions,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        }
-        await db.user_results.insert_one(result_doc)
-        await update_game_progress(user["user_id"], "stroop", accuracy)
+        result_doc = build_result_doc(user["user_id"], "stroop", request.model_dump())
+        result_id = await record_result(result_doc, idempotency_key=idempotency_key)
         
-        return {"message": "Result saved", "result_id": result_doc["result_id"]}
+        return {"message": "Result saved", "result_id": result_id}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error saving stroop result: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -1187,29 +1388,17 @@ class CatchLetterSaveRequest(BaseModel):
 @api_router.post("/catch-letter/save")
 async def save_catch_letter_result(
     request: CatchLetterSaveRequest,
-    user: Dict[str, Any] = Depends(get_current_user)
+    user: Dict[str, Any] = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
 ):
     """Save catch letter game result."""
     try:
-        total = request.caught_letters + request.missed_letters
-        accuracy = (request.caught_letters / total * 100) if total > 0 else 0
-        
-        result_doc = {
-            "result_id": f"result_{uuid.uuid4().hex[:12]}",
-            "user_id": user["user_id"],
-            "exercise_id": "catch-letter",
-            "score": request.caught_letters,
-            "time": request.total_time,
-            "difficulty": request.difficulty,
-            "caught": request.caught_letters,
-            "missed": request.missed_letters,
-            "accuracy": accuracy,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        }
-        await db.user_results.insert_one(result_doc)
-        await update_game_progress(user["user_id"], "catch-letter", request.caught_letters)
+        result_doc = build_result_doc(user["user_id"], "catch-letter", request.model_dump())
+        result_id = await record_result(result_doc, idempotency_key=idempotency_key)
         
-        return {"message": "Result saved", "result_id": result_doc["result_id"]}
+        return {"message": "Result saved", "result_id": result_id}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error saving catch-letter result: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -1224,25 +1413,17 @@ class WhackMoleSaveRequest(BaseModel):
 @api_router.post("/whack-mole/save")
 async def save_whack_mole_result(
     request: WhackMoleSaveRequest,
-    user: Dict[str, Any] = Depends(get_current_user)
+    user: Dict[str, Any] = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
 ):
     """Save whack-a-mole game result."""
     try:
-        result_doc = {
-            "result_id": f"result_{uuid.uuid4().hex[:12]}",
-            "user_id": user["user_id"],
-            "exercise_id": "whack-mole",
-            "score": request.hits,
-            "time": request.total_time,
-            "difficulty": request.difficulty,
-            "hits": request.hits,
-            "misses": request.misses,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        }
-        await db.user_results.insert_one(result_doc)
-        await update_game_progress(user["user_id"], "whack-mole", request.hits)
+        result_doc = build_result_doc(user["user_id"], "whack-mole", request.model_dump())
+        result_id = await record_result(result_doc, idempotency_key=idempotency_key)
         
-        return {"message": "Result saved", "result_id": result_doc["result_id"]}
+        return {"message": "Result saved", "result_id": result_id}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error saving whack-mole result: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -1257,28 +1438,17 @@ class TypingSaveRequest(BaseModel):
 @api_router.post("/typing/save")
 async def save_typing_result(
     request: TypingSaveRequest,
-    user: Dict[str, Any] = Depends(get_current_user)
+    user: Dict[str, Any] = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
 ):
     """Save typing speed result."""
     try:
-        # Score is WPM adjusted by accuracy
-        adjusted_wpm = request.wpm * (request.accuracy / 100)
+        result_doc = build_result_doc(user["user_id"], "typing", request.model_dump())
+        result_id = await record_result(result_doc, idempotency_key=idempotency_key)
         
-        result_doc = {
-            "result_id": f"result_{uuid.uuid4().hex[:12]}",
-            "user_id": user["user_id"],
-            "exercise_id": "typing",
-            "score": adjusted_wpm,
-            "time": request.total_time,
-            "difficulty": request.difficulty,
-            "wpm": request.wpm,
-            "accuracy": request.accuracy,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        }
-        await db.user_results.insert_one(result_doc)
-        await update_game_progress(user["user_id"], "typing", adjusted_wpm)
-        
-        return {"message": "Result saved", "result_id": result_doc["result_id"]}
+        return {"message": "Result saved", "result_id": result_id}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error saving typing result: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -1296,26 +1466,17 @@ class SequenceSaveRequest(BaseModel):
 @api_router.post("/sequence/save")
 async def save_sequence_result(
     request: SequenceSaveRequest,
-    user: Dict[str, Any] = Depends(get_current_user)
+    user: Dict[str, Any] = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
 ):
     """Save sequence memory game result."""
     try:
-        result_doc = {
-            "result_id": f"result_{uuid.uuid4().hex[:12]}",
-            "user_id": user["user_id"],
-            "exercise_id": "sequence",
-            "score": request.level_reached,
-            "time": 0,  # Not time-based
-            "difficulty": request.difficulty,
-            "level_reached": request.level_reached,
-            "max_sequence_length": request.max_sequence_length,
-            "grid_size": request.grid_size,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        }
-        await db.user_results.insert_one(result_doc)
-        await update_game_progress(user["user_id"], "sequence", request.level_reached)
+        result_doc = build_result_doc(user["user_id"], "sequence", request.model_dump())
+        result_id = await record_result(result_doc, idempotency_key=idempotency_key)
         
-        return {"message": "Result saved", "result_id": result_doc["result_id"]}
+        return {"message": "Result saved", "result_id": result_id}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error saving sequence result: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -1336,32 +1497,153 @@ class MathSaveRequest(BaseModel):
 @api_router.post("/math/save")
 async def save_math_result(
     request: MathSaveRequest,
-    user: Dict[str, Any] = Depends(get_current_user)
+    user: Dict[str, Any] = Depends(get_current_user),
+    idempotency_key: Optional[str] = Header(None)
 ):
     """Save math game result."""
     try:
-        result_doc = {
-            "result_id": f"result_{uuid.uuid4().hex[:12]}",
-            "user_id": user["user_id"],
-            "exercise_id": "math",
-            "score": request.correct_answers,
-            "time": request.total_time,
-            "difficulty": request.difficulty,
-            "correct_answers": request.correct_answers,
-            "total_problems": request.total_problems,
-            "errors": request.errors,
-            "accuracy": request.accuracy,
-            "max_streak": request.max_streak,
-            "created_at": datetime.now(timezone.utc).isoformat()
-        }
-        await db.user_results.insert_one(result_doc)
-        await update_game_progress(user["user_id"], "math", request.correct_answers)
+        result_doc = build_result_doc(user["user_id"], "math", request.model_dump())
+        result_id = await record_result(result_doc, idempotency_key=idempotency_key)
         
-        return {"message": "Result saved", "result_id": result_doc["result_id"]}
+        return {"message": "Result saved", "result_id": result_id}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error saving math result: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# ============================================================================
+# BATCH RESULT SUBMISSION
+# ============================================================================
+
+MAX_BATCH_RESULTS = int(os.environ.get('MAX_BATCH_RESULTS', '100'))
+
+# Request models of the exercises with a dedicated save endpoint
+SAVE_REQUEST_MODELS = {
+    "stroop": StroopSaveRequest,
+    "catch-letter": CatchLetterSaveRequest,
+    "whack-mole": WhackMoleSaveRequest,
+    "typing": TypingSaveRequest,
+    "sequence": SequenceSaveRequest,
+    "math": MathSaveRequest,
+}
+
+class BatchResultItem(BaseModel):
+    exercise_id: str
+    result: Dict[str, Any]
+    idempotency_key: Optional[str] = None
+
+class BatchResultRequest(BaseModel):
+    results: List[BatchResultItem]
+
+def batch_item_result_doc(user_id: str, item: BatchResultItem) -> Dict[str, Any]:
+    """
+    Validate one batch item with the request model of its exercise.
+    Exercises without a dedicated endpoint use the generic ResultCreate.
+    """
+    model = SAVE_REQUEST_MODELS.get(item.exercise_id)
+    if model:
+        return build_result_doc(user_id, item.exercise_id, model.model_validate(item.result).model_dump())
+
+    result_data = ResultCreate.model_validate({**item.result, "exercise_id": item.exercise_id})
+    return build_result_doc(user_id, item.exercise_id, result_data.model_dump(), scoring=DEFAULT_SCORING)
+
+def validation_message(error: Exception) -> str:
+    if isinstance(error, ValidationError):
+        return "; ".join(
+            f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}"
+            for err in error.errors()
+        )
+    return str(error)
+
+@api_router.post("/results/batch")
+async def save_results_batch(
+    request: BatchResultRequest,
+    user: Dict[str, Any] = Depends(get_current_user)
+):
+    """
+    Save results of several games at once, e.g. replayed after offline play.
+    Results are inserted with one unordered insert_many and progress is
+    updated once per exercise. Items whose idempotency key was already used
+    are skipped and report the original result_id. Returns a status for
+    each item.
+    """
+    if len(request.results) > MAX_BATCH_RESULTS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {MAX_BATCH_RESULTS} results per batch"
+        )
+
+    user_id = user["user_id"]
+    statuses: List[Dict[str, Any]] = []
+    valid = []  # (item index, result_doc)
+    for index, item in enumerate(request.results):
+        try:
+            check_idempotency_key(item.idempotency_key)
+            result_doc = batch_item_result_doc(user_id, item)
+        except HTTPException as e:
+            statuses.append({"index": index, "status": "invalid", "error": e.detail})
+            continue
+        except ValidationError as e:
+            statuses.append({"index": index, "status": "invalid", "error": validation_message(e)})
+            continue
+        valid.append((index, result_doc))
+        statuses.append({"index": index, "status": "saved", "result_id": result_doc["result_id"]})
+
+    # First item per idempotency key; later items with the same key repeat it
+    first_with_key: Dict[str, int] = {}
+    for index, _ in valid:
+        key = request.results[index].idempotency_key
+        if key is not None:
+            first_with_key.setdefault(key, index)
+    replayed = await idempotency_keys.claim_many(user_id, [
+        (key, statuses[index]["result_id"]) for key, index in first_with_key.items()
+    ])
+    for index, _ in valid:
+        key = request.results[index].idempotency_key
+        if key in replayed:
+            statuses[index] = {"index": index, "status": "duplicate", "result_id": replayed[key]}
+        elif key is not None and first_with_key[key] != index:
+            original_id = statuses[first_with_key[key]]["result_id"]
+            statuses[index] = {"index": index, "status": "duplicate", "result_id": original_id}
+    valid = [entry for entry in valid if statuses[entry[0]]["status"] == "saved"]
+
+    failed = set()
+    if valid:
+        try:
+            await db.user_results.insert_many([doc for _, doc in valid], ordered=False)
+        except BulkWriteError as e:
+            failed = {valid[err["index"]][0] for err in e.details.get("writeErrors", [])}
+            logger.error(f"Error saving {len(failed)} of {len(valid)} batch results")
+        except Exception:
+            # Nothing is known to be stored; free the keys so the replay saves them
+            for index, _ in valid:
+                if request.results[index].idempotency_key is not None:
+                    await idempotency_keys.release(user_id, request.results[index].idempotency_key)
+            raise
+
+        saved = [doc for index, doc in valid if index not in failed]
+        games = []
+        for doc in saved:
+            scoring = get_scoring(doc["exercise_id"])
+            games.append((user_id, doc["exercise_id"], doc[scoring.metric], scoring.lower_is_better))
+        await asyncio.gather(
+            bulk_update_progress(db, games),
+            bulk_update_leaderboard(db, saved)
+        )
+        if leaderboard_index:
+            leaderboard_index.record(saved)
+
+    for index in failed:
+        statuses[index] = {"index": index, "status": "failed"}
+        if request.results[index].idempotency_key is not None:
+            await idempotency_keys.release(user_id, request.results[index].idempotency_key)
+
+    return {
+        "saved": len(valid) - len(failed),
+        "results": statuses
+    }
+
 # ============================================================================
 # TYPING GAME TEXT GENERATION
 # ============================================================================
@@ -1449,6 +1731,27 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@api_router.get("/metrics")
+async def get_metrics():
+    return {
+        "session_cache": session_cache.stats(),
+        "negative_session_cache": negative_session_cache.stats(),
+        "revocations": revocations.stats(),
+        "telegram_replay_cache": telegram_replay_cache.stats(),
+        "emergent_auth": emergent_auth_client.stats(),
+        "session_touches": session_touches.stats(),
+        "auth_rate_limit": auth_rate_limiter.stats(),
+        "result_buffer": result_buffer.stats() if result_buffer else None,
+        "idempotency_keys": idempotency_keys.stats(),
+        "user_display_cache": user_display_cache.stats(),
+        "leaderboard_index": leaderboard_index.stats() if leaderboard_index else None,
+        "exercise_catalog": {
+            "version": exercise_catalog.snapshot.version,
+            "exercises": len(exercise_catalog.snapshot.exercises),
+            "reloads": exercise_catalog.reloads
+        }
+    }
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -1458,8 +1761,102 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+@app.on_event("startup")
+async def create_indexes():
+    await session_store.create_indexes()
+    try:
+        await db.users.create_index("user_id", unique=True)
+        await db.users.create_index("email", unique=True)
+        await db.users.create_index(
+            "telegram_id",
+            unique=True,
+            partialFilterExpression={"telegram_id": {"$type": "string"}}
+        )
+    except DuplicateKeyError:
+        logger.error("Duplicate users prevent the unique users indexes; run: python migrations.py users_dedupe")
+        raise
+    if isinstance(auth_rate_limiter, MongoRateLimiter):
+        await auth_rate_limiter.create_indexes()
+    await db.user_progress.create_index([("user_id", 1), ("exercise_id", 1)], unique=True)
+    # Date-range scans: a user's history and per-day/week activity per exercise
+    await db.user_results.create_index([("user_id", 1), ("created_at", -1)])
+    await db.user_results.create_index([("exercise_id", 1), ("created_at", -1)])
+    await db.users.create_index("created_at")
+    await idempotency_keys.create_indexes()
+    await create_leaderboard_indexes(db)
+    await db.revoked_tokens.create_index("key", unique=True)
+    await db.revoked_tokens.create_index("updated_at")
+    await db.revoked_tokens.create_index("expires_at", expireAfterSeconds=0)
+
+async def sync_revocations_forever():
+    while True:
+        try:
+            await revocations.sync(db)
+        except Exception as e:
+            logger.error(f"Error syncing token revocations: {e}")
+        await asyncio.sleep(REVOCATION_SYNC_INTERVAL)
+
+async def flush_session_touches_forever():
+    while True:
+        await asyncio.sleep(SESSION_TOUCH_FLUSH_INTERVAL)
+        try:
+            await session_touches.flush(db, session_store)
+        except Exception as e:
+            logger.error(f"Error flushing session touches: {e}")
+
+async def poll_exercise_catalog_forever():
+    while True:
+        await asyncio.sleep(CATALOG_POLL_INTERVAL)
+        try:
+            await exercise_catalog.poll(db)
+        except Exception as e:
+            logger.error(f"Error polling exercise catalog: {e}")
+
+async def sync_leaderboard_index_forever():
+    while True:
+        await asyncio.sleep(LEADERBOARD_SYNC_INTERVAL)
+        try:
+            await leaderboard_index.sync(db)
+        except Exception as e:
+            logger.error(f"Error syncing leaderboard index: {e}")
+
+background_tasks: List[asyncio.Task] = []
+result_flush_task: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def load_exercise_catalog():
+    await exercise_catalog.sync_definition(db)
+    await exercise_catalog.load(db)
+
+@app.on_event("startup")
+async def start_http_clients():
+    await emergent_auth_client.start()
+
+@app.on_event("startup")
+async def start_background_tasks():
+    background_tasks.append(asyncio.create_task(flush_session_touches_forever()))
+    background_tasks.append(asyncio.create_task(poll_exercise_catalog_forever()))
+    if token_signer:
+        background_tasks.append(asyncio.create_task(sync_revocations_forever()))
+    if leaderboard_index:
+        await leaderboard_index.warm(db)
+        background_tasks.append(asyncio.create_task(sync_leaderboard_index_forever()))
+    if result_buffer:
+        global result_flush_task
+        result_flush_task = asyncio.create_task(result_buffer.run(db))
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in background_tasks:
+        task.cancel()
+    if result_flush_task:
+        # Let the flush loop write everything still queued
+        result_buffer.close()
+        await result_flush_task
+    await session_touches.flush(db, session_store)
+    await emergent_auth_client.close()
+    await session_store.close()
     client.close()
@@ -0,0 +1,187 @@
+import time
+import random
+import hashlib
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set, Tuple
+
+
+def hash_token(session_token: str) -> str:
+    """Hash a session token so raw tokens are never kept as cache keys."""
+    return hashlib.sha256(session_token.encode()).hexdigest()
+
+
+# User fields denormalized into each session document
+USER_SNAPSHOT_FIELDS = (
+    "user_id", "name", "picture", "auth_type",
+    "email", "telegram_username", "created_at"
+)
+
+
+def build_user_snapshot(user_doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the compact user snapshot stored on session documents."""
+    return {field: user_doc[field] for field in USER_SNAPSHOT_FIELDS if field in user_doc}
+
+
+class SessionCache:
+    """
+    Bounded LRU cache of session token hash -> resolved user document.
+    Entries expire after `ttl` seconds or at session expiry, whichever is first.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 60.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._keys_by_user: Dict[str, Set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, session_token: str) -> Optional[Dict[str, Any]]:
+        key = hash_token(session_token)
+        entry = self._entries.get(key)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires, user_doc = entry
+        if expires <= time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return user_doc
+
+    def put(self, session_token: str, user_doc: Dict[str, Any], max_age: Optional[float] = None):
+        if self.max_size <= 0:
+            return
+
+        ttl = self.ttl if max_age is None else min(self.ttl, max_age)
+        if ttl <= 0:
+            return
+
+        key = hash_token(session_token)
+        if key in self._entries:
+            self._remove(key)
+
+        self._entries[key] = (time.monotonic() + ttl, user_doc)
+        self._keys_by_user.setdefault(user_doc["user_id"], set()).add(key)
+
+        while len(self._entries) > self.max_size:
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def invalidate_token(self, session_token: str):
+        key = hash_token(session_token)
+        if key in self._entries:
+            self._remove(key)
+            self.invalidations += 1
+
+    def invalidate_user(self, user_id: str):
+        for key in list(self._keys_by_user.get(user_id, ())):
+            self._remove(key)
+            self.invalidations += 1
+
+    def _remove(self, key: str):
+        _, user_doc = self._entries.pop(key)
+        user_keys = self._keys_by_user.get(user_doc["user_id"])
+        if user_keys is not None:
+            user_keys.discard(key)
+            if not user_keys:
+                del self._keys_by_user[user_doc["user_id"]]
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+        }
+
+
+class NegativeSessionCache:
+    """
+    Bounded TTL set of token hashes known to be invalid or expired, so
+    repeated requests with stale tokens skip the database.
+
+    Expired tokens stay cached for `ttl`. Tokens not found at all may be
+    issued moments later by a login on another worker, which cannot
+    invalidate this cache, so they are only kept for `unknown_ttl`.
+
+    A `verify_rate` fraction of hits is still checked against the database;
+    hits that turn out to be valid sessions are counted as false positives.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 50000,
+        ttl: float = 120.0,
+        verify_rate: float = 0.01,
+        unknown_ttl: float = 5.0
+    ):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.unknown_ttl = unknown_ttl
+        self.verify_rate = verify_rate
+        self._entries: "OrderedDict[str, float]" = OrderedDict()
+        self.hits = 0
+        self.verified = 0
+        self.false_positives = 0
+
+    def check(self, session_token: str) -> str:
+        """
+        Returns "miss" if the token is not cached, "hit" if it is known bad,
+        or "verify" for a sampled hit that should be confirmed upstream.
+        """
+        key = hash_token(session_token)
+        expires = self._entries.get(key)
+        if expires is None:
+            return "miss"
+        if expires <= time.monotonic():
+            del self._entries[key]
+            return "miss"
+
+        self.hits += 1
+        if random.random() < self.verify_rate:
+            self.verified += 1
+            return "verify"
+        return "hit"
+
+    def add(self, session_token: str, expired: bool = True):
+        """Cache a bad token: expired, or (`expired=False`) not found."""
+        if self.max_size <= 0:
+            return
+        key = hash_token(session_token)
+        self._entries[key] = time.monotonic() + (self.ttl if expired else self.unknown_ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, session_token: str):
+        self._entries.pop(hash_token(session_token), None)
+
+    def record_false_positive(self, session_token: str):
+        self.false_positives += 1
+        self.invalidate(session_token)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "unknown_ttl": self.unknown_ttl,
+            "hits": self.hits,
+            "verified": self.verified,
+            "false_positives": self.false_positives,
+            "false_positive_rate": (self.false_positives / self.verified) if self.verified else 0.0,
+        }
@@ -0,0 +1,520 @@
+import json
+import asyncio
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from pymongo import UpdateOne
+
+
+class SessionStore(ABC):
+    """
+    Storage for login sessions. A session document holds session_id,
+    user_id, session_token, the user snapshot (`user`, `user_version`),
+    expires_at and created_at (datetimes), and optionally auth_type and
+    last_seen.
+    """
+
+    @abstractmethod
+    async def get(self, session_token: str) -> Optional[Dict[str, Any]]:
+        """Return user_id, expires_at and user of a session, or None."""
+
+    @abstractmethod
+    async def create(self, session_doc: Dict[str, Any]):
+        ...
+
+    @abstractmethod
+    async def replace_user_sessions(self, user_id: str, session_doc: Dict[str, Any]):
+        """Replace every session of the user with `session_doc`."""
+
+    @abstractmethod
+    async def delete(self, session_token: str):
+        ...
+
+    @abstractmethod
+    async def trim(self, user_id: str, keep: int) -> List[str]:
+        """Delete all but the `keep` newest sessions; returns removed tokens."""
+
+    @abstractmethod
+    async def refresh_snapshots(self, user_id: str, snapshot: Dict[str, Any], version: int):
+        """Set the user snapshot on sessions holding an older version."""
+
+    @abstractmethod
+    async def touch_many(self, touches: Dict[str, Tuple[datetime, float]]):
+        """Apply token -> (seen_at, lifetime seconds) sliding-expiry touches."""
+
+    async def create_indexes(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class MongoSessionStore(SessionStore):
+    """Sessions in the `user_sessions` collection."""
+
+    def __init__(self, db):
+        self.db = db
+
+    async def get(self, session_token):
+        return await self.db.user_sessions.find_one(
+            {"session_token": session_token},
+            {"_id": 0, "user_id": 1, "expires_at": 1, "user": 1}
+        )
+
+    async def create(self, session_doc):
+        await self.db.user_sessions.insert_one(dict(session_doc))
+
+    async def replace_user_sessions(self, user_id, session_doc):
+        # Insert first, then delete the rest: of two racing logins at most
+        # one session survives, whichever order the writes land in
+        await self.db.user_sessions.insert_one(dict(session_doc))
+        await self.db.user_sessions.delete_many({
+            "user_id": user_id,
+            "session_token": {"$ne": session_doc["session_token"]}
+        })
+
+    async def delete(self, session_token):
+        await self.db.user_sessions.delete_one({"session_token": session_token})
+
+    async def trim(self, user_id, keep):
+        stale_sessions = await self.db.user_sessions.find(
+            {"user_id": user_id},
+            {"_id": 1, "session_token": 1}
+        ).sort("created_at", -1).skip(keep).to_list(None)
+
+        if stale_sessions:
+            await self.db.user_sessions.delete_many(
+                {"_id": {"$in": [s["_id"] for s in stale_sessions]}}
+            )
+        return [s["session_token"] for s in stale_sessions]
+
+    async def refresh_snapshots(self, user_id, snapshot, version):
+        await self.db.user_sessions.update_many(
+            {
+                "user_id": user_id,
+                "$or": [
+                    {"user_version": {"$lt": version}},
+                    {"user_version": {"$exists": False}}
+                ]
+            },
+            {"$set": {"user": snapshot, "user_version": version}}
+        )
+
+    async def touch_many(self, touches):
+        if not touches:
+            return
+        await self.db.user_sessions.bulk_write([
+            UpdateOne(
+                {"session_token": token},
+                {"$max": {
+                    "last_seen": seen_at,
+                    "expires_at": seen_at + timedelta(seconds=lifetime)
+                }}
+            )
+            for token, (seen_at, lifetime) in touches.items()
+        ], ordered=False)
+
+    async def create_indexes(self):
+        await self.db.user_sessions.create_index("session_token")
+        await self.db.user_sessions.create_index([("user_id", 1), ("created_at", -1)])
+        await self.db.user_sessions.create_index("expires_at", expireAfterSeconds=0)
+
+
+class MemorySessionStore(SessionStore):
+    """Sessions in process memory; for single-worker deployments and tests."""
+
+    def __init__(self):
+        self._sessions: Dict[str, Dict[str, Any]] = {}
+        self._tokens_by_user: Dict[str, Dict[str, datetime]] = {}
+
+    async def get(self, session_token):
+        session_doc = self._sessions.get(session_token)
+        if session_doc is None:
+            return None
+        if session_doc["expires_at"] <= datetime.now(timezone.utc):
+            await self.delete(session_token)
+            return None
+        return {
+            "user_id": session_doc["user_id"],
+            "expires_at": session_doc["expires_at"],
+            "user": session_doc.get("user"),
+        }
+
+    async def create(self, session_doc):
+        token = session_doc["session_token"]
+        self._sessions[token] = dict(session_doc)
+        self._tokens_by_user.setdefault(session_doc["user_id"], {})[token] = session_doc["created_at"]
+
+    async def replace_user_sessions(self, user_id, session_doc):
+        await self.create(session_doc)
+        for token in list(self._tokens_by_user.get(user_id, ())):
+            if token != session_doc["session_token"]:
+                await self.delete(token)
+
+    async def delete(self, session_token):
+        session_doc = self._sessions.pop(session_token, None)
+        if session_doc is None:
+            return
+        user_tokens = self._tokens_by_user.get(session_doc["user_id"], {})
+        user_tokens.pop(session_token, None)
+        if not user_tokens:
+            self._tokens_by_user.pop(session_doc["user_id"], None)
+
+    async def trim(self, user_id, keep):
+        user_tokens = self._tokens_by_user.get(user_id, {})
+        newest_first = sorted(user_tokens, key=user_tokens.get, reverse=True)
+        stale = newest_first[keep:]
+        for token in stale:
+            await self.delete(token)
+        return stale
+
+    async def refresh_snapshots(self, user_id, snapshot, version):
+        for token in self._tokens_by_user.get(user_id, ()):
+            session_doc = self._sessions[token]
+            if session_doc.get("user_version", -1) < version:
+                session_doc["user"] = dict(snapshot)
+                session_doc["user_version"] = version
+
+    async def touch_many(self, touches):
+        for token, (seen_at, lifetime) in touches.items():
+            session_doc = self._sessions.get(token)
+            if session_doc is None:
+                continue
+            session_doc["last_seen"] = max(seen_at, session_doc.get("last_seen", seen_at))
+            session_doc["expires_at"] = max(
+                seen_at + timedelta(seconds=lifetime), session_doc["expires_at"]
+            )
+
+
+class RespError(Exception):
+    pass
+
+
+class RespClient:
+    """Small pooled asyncio client for the Redis protocol (RESP2)."""
+
+    def __init__(self, url: str, pool_size: int = 8):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.pool_size = pool_size
+        self._pool: "asyncio.Queue[Tuple[asyncio.StreamReader, asyncio.StreamWriter]]" = asyncio.Queue()
+        self._opened = 0
+
+    async def execute(self, *args) -> Any:
+        connection = await self._acquire()
+        reader, writer = connection
+        try:
+            writer.write(_encode_command(args))
+            await writer.drain()
+            reply = await _read_reply(reader)
+        except BaseException:
+            writer.close()
+            self._opened -= 1
+            raise
+        self._pool.put_nowait(connection)
+        if isinstance(reply, RespError):
+            raise reply
+        return reply
+
+    async def update(self, key: str, build: Callable[[Optional[bytes]], Optional[List[tuple]]]) -> bool:
+        """
+        Atomic read-modify-write of `key`: WATCH it, GET it, and run the
+        commands `build(value)` returns in MULTI/EXEC, retrying while
+        another client changes the key in between. Returns False when
+        `build` returns None and nothing is written.
+        """
+        connection = await self._acquire()
+        reader, writer = connection
+
+        async def call(*args):
+            writer.write(_encode_command(args))
+            await writer.drain()
+            reply = await _read_reply(reader)
+            if isinstance(reply, RespError):
+                raise reply
+            return reply
+
+        try:
+            while True:
+                await call("WATCH", key)
+                commands = build(await call("GET", key))
+                if commands is None:
+                    await call("UNWATCH")
+                    written = False
+                    break
+                await call("MULTI")
+                for command in commands:
+                    await call(*command)
+                if await call("EXEC") is not None:
+                    written = True
+                    break
+        except BaseException:
+            writer.close()
+            self._opened -= 1
+            raise
+        self._pool.put_nowait(connection)
+        return written
+
+    async def _acquire(self):
+        if self._pool.empty() and self._opened < self.pool_size:
+            self._opened += 1
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+                if self.password:
+                    writer.write(_encode_command(("AUTH", self.password)))
+                    await _read_reply(reader)
+                if self.db:
+                    writer.write(_encode_command(("SELECT", self.db)))
+                    await _read_reply(reader)
+            except BaseException:
+                self._opened -= 1
+                raise
+            return reader, writer
+        return await self._pool.get()
+
+    async def close(self):
+        while not self._pool.empty():
+            _, writer = self._pool.get_nowait()
+            writer.close()
+            await writer.wait_closed()
+        self._opened = 0
+
+
+def _encode_command(args) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+async def _read_reply(reader: asyncio.StreamReader) -> Any:
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("connection closed")
+    kind, payload = line[:1], line[1:-2]
+    if kind == b"+":
+        return payload.decode()
+    if kind == b"-":
+        return RespError(payload.decode())
+    if kind == b":":
+        return int(payload)
+    if kind == b"$":
+        length = int(payload)
+        if length < 0:
+            return None
+        return (await reader.readexactly(length + 2))[:-2]
+    if kind == b"*":
+        count = int(payload)
+        if count < 0:
+            return None
+        return [await _read_reply(reader) for _ in range(count)]
+    raise RespError(f"unexpected reply {line!r}")
+
+
+_DATE_FIELDS = ("expires_at", "created_at", "last_seen")
+
+
+def _json_default(value: Any) -> str:
+    # Nested dates (the user snapshot's created_at) stay ISO strings
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+def _dump_session(session_doc: Dict[str, Any]) -> bytes:
+    doc = dict(session_doc)
+    for field in _DATE_FIELDS:
+        if isinstance(doc.get(field), datetime):
+            doc[field] = doc[field].isoformat()
+    return json.dumps(doc, default=_json_default).encode()
+
+
+def _load_session(raw: bytes) -> Dict[str, Any]:
+    doc = json.loads(raw)
+    for field in _DATE_FIELDS:
+        if isinstance(doc.get(field), str):
+            doc[field] = datetime.fromisoformat(doc[field])
+    return doc
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Sessions in a Redis-protocol server. Each session is a JSON string under
+    `session:<token>` expiring with the session; `user_sessions:<user_id>`
+    is a sorted set of the user's tokens scored by creation time.
+    """
+
+    def __init__(self, url: str, pool_size: int = 8):
+        self.client = RespClient(url, pool_size=pool_size)
+
+    async def get(self, session_token):
+        raw = await self.client.execute("GET", f"session:{session_token}")
+        if raw is None:
+            return None
+        session_doc = _load_session(raw)
+        return {
+            "user_id": session_doc["user_id"],
+            "expires_at": session_doc["expires_at"],
+            "user": session_doc.get("user"),
+        }
+
+    async def create(self, session_doc):
+        ttl_ms = int((session_doc["expires_at"] - datetime.now(timezone.utc)).total_seconds() * 1000)
+        if ttl_ms <= 0:
+            return
+        token = session_doc["session_token"]
+        user_key = f"user_sessions:{session_doc['user_id']}"
+        await self.client.execute("SET", f"session:{token}", _dump_session(session_doc), "PX", ttl_ms)
+        await self.client.execute("ZADD", user_key, session_doc["created_at"].timestamp(), token)
+        await self._extend_index(user_key, ttl_ms)
+
+    async def _extend_index(self, user_key: str, ttl_ms: int):
+        # The user's index lives as long as its longest session; a new
+        # session never shortens it
+        if await self.client.execute("PTTL", user_key) < ttl_ms:
+            await self.client.execute("PEXPIRE", user_key, ttl_ms)
+
+    async def replace_user_sessions(self, user_id, session_doc):
+        await self.create(session_doc)
+        user_key = f"user_sessions:{user_id}"
+        new_token = session_doc["session_token"].encode()
+        stale = [t for t in await self.client.execute("ZRANGE", user_key, 0, -1) if t != new_token]
+        if stale:
+            await self.client.execute("DEL", *[b"session:" + t for t in stale])
+            await self.client.execute("ZREM", user_key, *stale)
+
+    async def delete(self, session_token):
+        raw = await self.client.execute("GET", f"session:{session_token}")
+        if raw is None:
+            return
+        user_id = json.loads(raw)["user_id"]
+        await self.client.execute("DEL", f"session:{session_token}")
+        await self.client.execute("ZREM", f"user_sessions:{user_id}", session_token)
+
+    async def trim(self, user_id, keep):
+        user_key = f"user_sessions:{user_id}"
+        stale = await self.client.execute("ZRANGE", user_key, 0, -(keep + 1))
+        if not stale:
+            return []
+        await self.client.execute("DEL", *[b"session:" + t for t in stale])
+        await self.client.execute("ZREM", user_key, *stale)
+        return [t.decode() for t in stale]
+
+    # Snapshot refreshes and touches rewrite the whole session document,
+    # so each goes through RespClient.update to not undo the other's change
+
+    async def refresh_snapshots(self, user_id, snapshot, version):
+        def refresh(raw):
+            if raw is None:
+                return None
+            session_doc = _load_session(raw)
+            if session_doc.get("user_version", -1) >= version:
+                return None
+            session_doc["user"] = snapshot
+            session_doc["user_version"] = version
+            return [("SET", key, _dump_session(session_doc), "KEEPTTL")]
+
+        for token in await self.client.execute("ZRANGE", f"user_sessions:{user_id}", 0, -1):
+            key = f"session:{token.decode()}"
+            await self.client.update(key, refresh)
+
+    async def touch_many(self, touches):
+        for token, (seen_at, lifetime) in touches.items():
+            key = f"session:{token}"
+            touched = {}
+
+            def touch(raw):
+                if raw is None:
+                    return None
+                session_doc = _load_session(raw)
+                session_doc["last_seen"] = max(seen_at, session_doc.get("last_seen", seen_at))
+                session_doc["expires_at"] = max(
+                    seen_at + timedelta(seconds=lifetime), session_doc["expires_at"]
+                )
+                ttl_ms = max(int((session_doc["expires_at"] - datetime.now(timezone.utc)).total_seconds() * 1000), 1)
+                touched.update(user_id=session_doc["user_id"], ttl_ms=ttl_ms)
+                return [("SET", key, _dump_session(session_doc), "PX", ttl_ms)]
+
+            if await self.client.update(key, touch):
+                await self._extend_index(f"user_sessions:{touched['user_id']}", touched["ttl_ms"])
+
+    async def close(self):
+        await self.client.close()
+
+
+def create_session_store(kind: str, db=None, redis_url: Optional[str] = None) -> SessionStore:
+    """Build the store selected by SESSION_STORE: mongo, memory or redis."""
+    if kind == "mongo":
+        return MongoSessionStore(db)
+    if kind == "memory":
+        return MemorySessionStore()
+    if kind == "redis":
+        return RedisSessionStore(redis_url or "redis://localhost:6379/0")
+    raise ValueError(f"Unknown session store: {kind}")
+
+
+if __name__ == "__main__":
+    # Auth-lookup latency per backend: python session_store.py
+    # Mongo is included when MONGO_URL and DB_NAME are set.
+    import os
+    import time
+    import uuid
+    import statistics
+
+    from resp_server import RespServer
+
+    async def bench(name: str, store: SessionStore, sessions: int = 2000, lookups: int = 20000):
+        now = datetime.now(timezone.utc)
+        tokens = []
+        for i in range(sessions):
+            token = f"bench_{uuid.uuid4().hex}"
+            tokens.append(token)
+            await store.create({
+                "session_id": f"session_{uuid.uuid4().hex}",
+                "user_id": f"bench_user_{i}",
+                "session_token": token,
+                "user": {"user_id": f"bench_user_{i}", "name": "Bench"},
+                "user_version": 1,
+                "expires_at": now + timedelta(days=7),
+                "created_at": now,
+            })
+
+        timings = []
+        for i in range(lookups):
+            started = time.perf_counter()
+            await store.get(tokens[i % sessions])
+            timings.append(time.perf_counter() - started)
+
+        for token in tokens:
+            await store.delete(token)
+
+        timings.sort()
+        print(
+            f"{name:8s} p50 {statistics.median(timings) * 1e6:9.1f} us"
+            f"   p99 {timings[int(len(timings) * 0.99)] * 1e6:9.1f} us"
+        )
+
+    async def main():
+        await bench("memory", MemorySessionStore())
+
+        server = RespServer()
+        await server.start()
+        redis_store = RedisSessionStore(server.url)
+        await bench("redis", redis_store)
+        await redis_store.close()
+        await server.close()
+
+        if os.environ.get("MONGO_URL") and os.environ.get("DB_NAME"):
+            from motor.motor_asyncio import AsyncIOMotorClient
+            client = AsyncIOMotorClient(os.environ["MONGO_URL"])
+            mongo_store = MongoSessionStore(client[os.environ["DB_NAME"]])
+            await mongo_store.create_indexes()
+            await bench("mongo", mongo_store)
+            client.close()
+
+    asyncio.run(main())
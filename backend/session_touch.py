@@ -0,0 +1,87 @@
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from session_cache import hash_token
+
+
+class SessionTouchBuffer:
+    """
+    Coalesces sliding-expiry / last-seen writes.
+    A session is touched at most once per `interval` seconds; touches are
+    kept in memory and written by flush() in one batch to the session store
+    and one bulk_write to users.
+    """
+
+    def __init__(self, interval: float = 300.0, max_tracked: int = 100000):
+        self.interval = interval
+        self.max_tracked = max_tracked
+        self._last_touch: "OrderedDict[str, float]" = OrderedDict()
+        self._pending_sessions: Dict[str, Tuple[datetime, Optional[float]]] = {}
+        self._pending_users: Dict[str, datetime] = {}
+        self.touches = 0
+        self.skipped = 0
+        self.flushes = 0
+        self.written = 0
+
+    def touch(self, session_token: str, user_id: str, lifetime: Optional[float]) -> bool:
+        """
+        Record activity for a session. Returns True when the touch was
+        accepted, i.e. the session has not been touched within `interval`.
+        `lifetime` is the sliding window in seconds, None for sessions that
+        are not stored in the database.
+        """
+        key = hash_token(session_token)
+        now = time.monotonic()
+        last = self._last_touch.get(key)
+        if last is not None and now - last < self.interval:
+            self.skipped += 1
+            return False
+
+        self._last_touch[key] = now
+        self._last_touch.move_to_end(key)
+        while len(self._last_touch) > self.max_tracked:
+            self._last_touch.popitem(last=False)
+
+        seen_at = datetime.now(timezone.utc)
+        if lifetime is not None:
+            self._pending_sessions[session_token] = (seen_at, lifetime)
+        self._pending_users[user_id] = seen_at
+        self.touches += 1
+        return True
+
+    def forget(self, session_token: str):
+        """Drop pending state for a session that was logged out."""
+        self._pending_sessions.pop(session_token, None)
+        self._last_touch.pop(hash_token(session_token), None)
+
+    async def flush(self, db, session_store):
+        sessions, self._pending_sessions = self._pending_sessions, {}
+        users, self._pending_users = self._pending_users, {}
+
+        if sessions:
+            await session_store.touch_many(sessions)
+
+        if users:
+            await db.users.bulk_write([
+                UpdateOne({"user_id": user_id}, {"$max": {"last_seen": seen_at}})
+                for user_id, seen_at in users.items()
+            ], ordered=False)
+
+        if sessions or users:
+            self.flushes += 1
+            self.written += len(sessions) + len(users)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "interval": self.interval,
+            "pending_sessions": len(self._pending_sessions),
+            "pending_users": len(self._pending_users),
+            "touches": self.touches,
+            "skipped": self.skipped,
+            "flushes": self.flushes,
+            "written": self.written,
+        }
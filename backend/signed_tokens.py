@@ -0,0 +1,199 @@
+import time
+import math
+import json
+import hmac
+import base64
+import hashlib
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Any, Dict, Optional
+
+TOKEN_PREFIX = "st1."
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def _json_default(value: Any) -> str:
+    # Dates in the user snapshot travel as ISO strings, as the API returns them
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+def is_signed_token(token: str) -> bool:
+    return token.startswith(TOKEN_PREFIX)
+
+
+class TokenSigner:
+    """
+    Issues and verifies HMAC-SHA256 signed session tokens.
+    Format: st1.<base64url(json claims)>.<base64url(signature)>
+    """
+
+    def __init__(self, secret: str):
+        self._key = hashlib.sha256(secret.encode()).digest()
+
+    def issue(self, user: Dict[str, Any], ttl_seconds: int) -> str:
+        now = int(time.time())
+        claims = {
+            "jti": uuid.uuid4().hex,
+            "uid": user["user_id"],
+            "iat": now,
+            "exp": now + ttl_seconds,
+            "user": user,
+        }
+        payload = _b64encode(json.dumps(claims, separators=(",", ":"), default=_json_default).encode())
+        return f"{TOKEN_PREFIX}{payload}.{self._sign(payload)}"
+
+    def verify(self, token: str) -> Optional[Dict[str, Any]]:
+        """Return the claims of a valid, unexpired token, otherwise None."""
+        if not is_signed_token(token):
+            return None
+
+        try:
+            payload, signature = token[len(TOKEN_PREFIX):].split(".", 1)
+        except ValueError:
+            return None
+
+        if not hmac.compare_digest(self._sign(payload), signature):
+            return None
+
+        try:
+            claims = json.loads(_b64decode(payload))
+        except ValueError:
+            return None
+
+        if claims.get("exp", 0) <= time.time():
+            return None
+
+        return claims
+
+    def _sign(self, payload: str) -> str:
+        return _b64encode(hmac.new(self._key, payload.encode(), hashlib.sha256).digest())
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter using double hashing over SHA-256."""
+
+    def __init__(self, capacity: int = 100000, error_rate: float = 0.001):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.sha256(item.encode()).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:16], "little") | 1
+        for i in range(self.hash_count):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, item: str):
+        for pos in self._positions(item):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class RevocationList:
+    """
+    Revoked signed tokens, kept in memory behind a Bloom filter and persisted
+    to the `revoked_tokens` collection so every worker converges on the same set.
+
+    Entries are either a token id (`jti:<id>`) or a user-wide cutoff
+    (`user:<user_id>`) that revokes every token issued before it.
+
+    Writers stamp updated_at with their own clock before the write commits,
+    so each sync re-reads the last `sync_overlap` seconds.
+    """
+
+    def __init__(self, capacity: int = 100000, error_rate: float = 0.001, sync_overlap: float = 30.0):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.sync_overlap = sync_overlap
+        self._revoked: Dict[str, float] = {}  # key -> cutoff iat (inf for jti entries)
+        self._expires: Dict[str, float] = {}
+        self._bloom = BloomFilter(capacity, error_rate)
+        self._last_sync: Optional[datetime] = None
+        self.checks = 0
+        self.filter_hits = 0
+
+    def is_revoked(self, claims: Dict[str, Any]) -> bool:
+        self.checks += 1
+        jti_key = f"jti:{claims['jti']}"
+        user_key = f"user:{claims['uid']}"
+
+        for key in (jti_key, user_key):
+            if key not in self._bloom:
+                continue
+            self.filter_hits += 1
+            cutoff = self._revoked.get(key)
+            if cutoff is not None and claims["iat"] < cutoff:
+                return True
+
+        return False
+
+    async def revoke_token(self, db, claims: Dict[str, Any]):
+        await self._persist(db, f"jti:{claims['jti']}", float("inf"), claims["exp"])
+
+    async def revoke_user(self, db, user_id: str, issued_before: float, expires: float):
+        await self._persist(db, f"user:{user_id}", issued_before, expires)
+
+    async def _persist(self, db, key: str, cutoff: float, expires: float):
+        self._add(key, cutoff, expires)
+        await db.revoked_tokens.update_one(
+            {"key": key},
+            {"$set": {
+                "key": key,
+                "cutoff": None if cutoff == float("inf") else cutoff,
+                "expires_at": datetime.fromtimestamp(expires, timezone.utc),
+                "updated_at": datetime.now(timezone.utc)
+            }},
+            upsert=True
+        )
+
+    def _add(self, key: str, cutoff: float, expires: float):
+        self._revoked[key] = max(cutoff, self._revoked.get(key, 0))
+        self._expires[key] = max(expires, self._expires.get(key, 0))
+        self._bloom.add(key)
+
+    async def sync(self, db):
+        """Pull revocations written by other workers since the last sync."""
+        started = datetime.now(timezone.utc)
+        query = {"expires_at": {"$gt": started}}
+        if self._last_sync is not None:
+            query["updated_at"] = {"$gte": self._last_sync}
+        self._last_sync = started - timedelta(seconds=self.sync_overlap)
+
+        async for doc in db.revoked_tokens.find(query, {"_id": 0}):
+            cutoff = doc["cutoff"] if doc.get("cutoff") is not None else float("inf")
+            expires_at = doc["expires_at"]
+            if expires_at.tzinfo is None:
+                expires_at = expires_at.replace(tzinfo=timezone.utc)
+            self._add(doc["key"], cutoff, expires_at.timestamp())
+
+        self._prune()
+
+    def _prune(self):
+        """Drop expired entries and rebuild the filter without them."""
+        now = time.time()
+        expired = [key for key, exp in self._expires.items() if exp <= now]
+        for key in expired:
+            del self._expires[key]
+            del self._revoked[key]
+
+        if expired:
+            self._bloom = BloomFilter(self.capacity, self.error_rate)
+            for key in self._revoked:
+                self._bloom.add(key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "revoked": len(self._revoked),
+            "checks": self.checks,
+            "filter_hits": self.filter_hits,
+        }
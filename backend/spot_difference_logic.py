@@ -204,7 +204,7 @@ IMPORTANT:
         "image2": image2_data,
         "differences": differences,
         "total_differences": len(differences),
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     
     return game_data
@@ -37,7 +37,7 @@ const getRankColor = (rank) => {
 
 // Define metric types for exercises
 const getExerciseMetric = (exerciseId) => {
-  const scoreBasedExercises = ['whack-mole', 'catch-letter', 'math'];
+  const scoreBasedExercises = ['whack-mole', 'catch-letter', 'math', 'sequence'];
   const wpmBasedExercises = ['typing'];
   
   if (scoreBasedExercises.includes(exerciseId)) {
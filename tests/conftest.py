@@ -0,0 +1,10 @@
+import os
+import sys
+from pathlib import Path
+
+# Backend modules import each other by bare name (`from progress import ...`)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+# The database given to the test run, read before test modules importing
+# server set a placeholder MONGO_URL
+MONGO_URL = os.environ.get("MONGO_URL")
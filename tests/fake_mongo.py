@@ -0,0 +1,169 @@
+"""
+In-memory stand-in for the Motor collections the tests touch. It records
+every awaited operation and the number of sequential round trips: an
+operation started while others are in flight shares their round trip,
+one started after an operation finished comes after it.
+"""
+import asyncio
+from typing import Any, Dict, List, Optional
+
+
+def matches(doc: Dict[str, Any], query: Dict[str, Any]) -> bool:
+    for field, condition in query.items():
+        if field == "$or":
+            if not any(matches(doc, branch) for branch in condition):
+                return False
+            continue
+        value = doc.get(field)
+        if isinstance(condition, dict) and any(key.startswith("$") for key in condition):
+            for op, arg in condition.items():
+                if op == "$in" and value not in arg:
+                    return False
+                if op == "$ne" and value == arg:
+                    return False
+                if op == "$lt" and not (value is not None and value < arg):
+                    return False
+                if op == "$gt" and not (value is not None and value > arg):
+                    return False
+                if op == "$gte" and not (value is not None and value >= arg):
+                    return False
+                if op == "$exists" and (field in doc) != arg:
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+def project(doc: Dict[str, Any], projection: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    if not projection:
+        return dict(doc)
+    included = [field for field, on in projection.items() if on and field != "_id"]
+    if included:
+        return {field: doc[field] for field in included if field in doc}
+    return {field: value for field, value in doc.items() if projection.get(field, 1)}
+
+
+class FakeCursor:
+    def __init__(self, collection: "FakeCollection", docs: List[Dict[str, Any]]):
+        self.collection = collection
+        self.docs = docs
+
+    def sort(self, keys, direction=None):
+        if isinstance(keys, str):
+            keys = [(keys, direction or 1)]
+        for field, order in reversed(keys):
+            self.docs.sort(key=lambda doc: doc.get(field), reverse=order == -1)
+        return self
+
+    def skip(self, count: int):
+        self.docs = self.docs[count:]
+        return self
+
+    def limit(self, count: int):
+        if count:
+            self.docs = self.docs[:count]
+        return self
+
+    def batch_size(self, size: int):
+        return self
+
+    async def to_list(self, length: Optional[int] = None):
+        await self.collection.db.round_trip(self.collection.name, "find")
+        return self.docs if length is None else self.docs[:length]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        await self.collection.db.round_trip(self.collection.name, "find")
+        for doc in self.docs:
+            yield doc
+
+
+class FakeCollection:
+    def __init__(self, db: "FakeDB", name: str):
+        self.db = db
+        self.name = name
+        self.docs: List[Dict[str, Any]] = []
+
+    def find(self, query=None, projection=None):
+        return FakeCursor(self, [project(d, projection) for d in self.docs if matches(d, query or {})])
+
+    async def find_one(self, query, projection=None):
+        await self.db.round_trip(self.name, "find_one")
+        for doc in self.docs:
+            if matches(doc, query):
+                return project(doc, projection)
+        return None
+
+    async def find_one_and_update(self, query, update, projection=None, upsert=False, return_document=None):
+        """Finds or inserts the user; bumps `version` as the login updates do."""
+        await self.db.round_trip(self.name, "find_one_and_update")
+        doc = next((d for d in self.docs if matches(d, query)), None)
+        if doc is None:
+            if not upsert:
+                return None
+            doc = dict(query)
+            if isinstance(update, dict):
+                doc.update(update.get("$setOnInsert", {}))
+            self.docs.append(doc)
+        if isinstance(update, dict):
+            doc.update(update.get("$set", {}))
+        doc["version"] = doc.get("version", 0) + 1
+        return project(doc, projection)
+
+    async def insert_one(self, doc):
+        await self.db.round_trip(self.name, "insert_one")
+        self.docs.append(dict(doc))
+
+    async def insert_many(self, docs, ordered=True):
+        await self.db.round_trip(self.name, "insert_many")
+        self.docs.extend(dict(doc) for doc in docs)
+
+    async def update_one(self, query, update, upsert=False):
+        await self.db.round_trip(self.name, "update_one")
+
+    async def update_many(self, query, update):
+        await self.db.round_trip(self.name, "update_many")
+        for doc in self.docs:
+            if matches(doc, query) and isinstance(update, dict):
+                doc.update(update.get("$set", {}))
+
+    async def delete_many(self, query):
+        await self.db.round_trip(self.name, "delete_many")
+        self.docs = [doc for doc in self.docs if not matches(doc, query)]
+
+    async def count_documents(self, query):
+        await self.db.round_trip(self.name, "count_documents")
+        return sum(1 for doc in self.docs if matches(doc, query))
+
+
+class FakeDB:
+    def __init__(self, latency: float = 0.001):
+        self.latency = latency
+        self.operations: List[str] = []
+        self.sequential_round_trips = 0
+        self._finished = 0
+        self._collections: Dict[str, FakeCollection] = {}
+
+    def __getattr__(self, name: str) -> FakeCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(self, name)
+        return self._collections[name]
+
+    def reset_counts(self):
+        self.operations = []
+        self.sequential_round_trips = 0
+        self._finished = 0
+
+    async def round_trip(self, collection: str, operation: str):
+        self.operations.append(f"{collection}.{operation}")
+        depth = self._finished + 1
+        await asyncio.sleep(self.latency)
+        self._finished = max(self._finished, depth)
+        self.sequential_round_trips = max(self.sequential_round_trips, depth)
@@ -0,0 +1,175 @@
+"""
+EmergentAuthClient against a local stand-in for the Emergent session-data
+endpoint: a plain asyncio HTTP server whose status and delay each test sets.
+"""
+import json
+import asyncio
+
+import pytest
+
+from emergent_auth import EmergentAuthClient, CircuitBreaker, AuthServiceUnavailable, InvalidSessionId
+
+SESSION_DATA = {"id": "user-1", "email": "user@example.com", "name": "User", "session_token": "token-1"}
+
+
+class StandInAuthServer:
+    def __init__(self):
+        self.status = 200
+        self.delay = 0.0
+        self.requests = []
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/auth/v1/env/oauth/session-data"
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        head = await reader.readuntil(b"\r\n\r\n")
+        headers = {}
+        for line in head.decode().split("\r\n")[1:]:
+            if ": " in line:
+                name, value = line.split(": ", 1)
+                headers[name.lower()] = value
+        self.requests.append(headers.get("x-session-id"))
+        await asyncio.sleep(self.delay)
+        body = json.dumps(SESSION_DATA if self.status == 200 else {"detail": "error"}).encode()
+        writer.write(
+            f"HTTP/1.1 {self.status} X\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+        writer.close()
+
+
+def run(test, **client_options):
+    """Run `test(server, client)` against a fresh stand-in server and client."""
+    async def main():
+        server = StandInAuthServer()
+        await server.start()
+        client = EmergentAuthClient(url=server.url, http2=False, **client_options)
+        await client.start()
+        try:
+            await test(server, client)
+        finally:
+            await client.close()
+            await server.close()
+    asyncio.run(main())
+
+
+def test_returns_session_data():
+    async def test(server, client):
+        assert await client.get_session_data("sid-1") == SESSION_DATA
+        assert server.requests == ["sid-1"]
+        assert client.stats()["breaker_state"] == "closed"
+    run(test)
+
+
+def test_client_error_is_invalid_session_without_tripping_breaker():
+    async def test(server, client):
+        server.status = 401
+        for _ in range(3):
+            with pytest.raises(InvalidSessionId):
+                await client.get_session_data("bad")
+        assert client.breaker.state == "closed"
+        assert client.failures == 0
+    run(test, breaker=CircuitBreaker(failure_threshold=2))
+
+
+def test_server_errors_open_breaker():
+    async def test(server, client):
+        server.status = 503
+        for _ in range(2):
+            with pytest.raises(AuthServiceUnavailable):
+                await client.get_session_data("sid")
+        assert client.breaker.state == "open"
+
+        # Open breaker rejects without reaching the server
+        with pytest.raises(AuthServiceUnavailable):
+            await client.get_session_data("sid")
+        assert len(server.requests) == 2
+        assert client.rejected == 1
+    run(test, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+
+
+def test_timeouts_open_breaker():
+    async def test(server, client):
+        server.delay = 1.0
+        for _ in range(2):
+            with pytest.raises(AuthServiceUnavailable):
+                await client.get_session_data("sid")
+        assert client.breaker.state == "open"
+    run(test, timeout=0.1, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=60))
+
+
+def test_half_open_probe_closes_breaker():
+    async def test(server, client):
+        server.status = 500
+        for _ in range(2):
+            with pytest.raises(AuthServiceUnavailable):
+                await client.get_session_data("sid")
+        await asyncio.sleep(0.15)
+        assert client.breaker.state == "half-open"
+
+        server.status = 200
+        assert await client.get_session_data("sid") == SESSION_DATA
+        assert client.breaker.state == "closed"
+    run(test, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=0.1))
+
+
+def test_failed_probe_reopens_breaker():
+    async def test(server, client):
+        server.status = 500
+        for _ in range(3):
+            if client.breaker.state == "open":
+                await asyncio.sleep(0.15)
+            with pytest.raises(AuthServiceUnavailable):
+                await client.get_session_data("sid")
+        assert client.breaker.state == "open"
+    run(test, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=0.1))
+
+
+def test_cancelled_probe_frees_probe_slot():
+    async def test(server, client):
+        server.status = 500
+        for _ in range(2):
+            with pytest.raises(AuthServiceUnavailable):
+                await client.get_session_data("sid")
+        await asyncio.sleep(0.15)
+
+        server.status = 200
+        server.delay = 5.0
+        probe = asyncio.create_task(client.get_session_data("sid"))
+        await asyncio.sleep(0.05)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+
+        server.delay = 0.0
+        assert await client.get_session_data("sid") == SESSION_DATA
+        assert client.breaker.state == "closed"
+    run(test, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=0.1))
+
+
+def test_saturated_client_rejects():
+    async def test(server, client):
+        server.delay = 0.3
+        results = await asyncio.gather(
+            client.get_session_data("first"),
+            client.get_session_data("second"),
+            return_exceptions=True
+        )
+        assert results[0] == SESSION_DATA
+        assert isinstance(results[1], AuthServiceUnavailable)
+        assert client.rejected == 1
+        assert server.requests == ["first"]
+        # Rejections are not upstream failures
+        assert client.breaker.failures == 0
+    run(test, max_concurrency=1, acquire_timeout=0.05)
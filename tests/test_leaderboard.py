@@ -0,0 +1,142 @@
+"""
+Queries per leaderboard page, counted on a fake database standing in for
+Mongo: user display info comes from UserDisplayCache, which loads misses
+with one users query and serves a warm page without any. Also the
+in-memory LeaderboardIndex syncing from the same fake collection.
+"""
+import os
+import asyncio
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+from leaderboard import UserDisplayCache
+from leaderboard_index import LeaderboardIndex
+from tests.fake_mongo import FakeDB
+
+PLAYERS = [f"user_{i}" for i in range(5)]
+
+
+def seeded_db() -> FakeDB:
+    db = FakeDB()
+    db.users.docs = [{"user_id": user_id, "name": user_id.title(), "picture": None} for user_id in PLAYERS]
+    db.leaderboard_entries.docs = [
+        {"exercise_id": "schulte", "partition": "", "user_id": user_id, "best": 10.0 + i, "total_games": 3, "level": 1}
+        for i, user_id in enumerate(PLAYERS)
+    ]
+    return db
+
+
+def test_display_cache_cold_then_warm():
+    db = seeded_db()
+    cache = UserDisplayCache()
+
+    users = asyncio.run(cache.get_many(db, PLAYERS))
+    assert sorted(users) == PLAYERS
+    assert db.operations == ["users.find"]
+
+    db.reset_counts()
+    assert asyncio.run(cache.get_many(db, PLAYERS)) == users
+    assert db.operations == []
+    assert cache.stats()["queries"] == 1
+
+
+def test_display_cache_loads_only_misses():
+    db = seeded_db()
+    cache = UserDisplayCache()
+    asyncio.run(cache.get_many(db, PLAYERS[:2]))
+
+    db.reset_counts()
+    assert sorted(asyncio.run(cache.get_many(db, PLAYERS))) == PLAYERS
+    assert db.operations == ["users.find"]
+
+
+@pytest.fixture
+def server_on_fake_db(monkeypatch):
+    pytest.importorskip("emergentintegrations")
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    os.environ.setdefault("DB_NAME", "test_database")
+    import server
+
+    db = seeded_db()
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(server, "user_display_cache", UserDisplayCache())
+    monkeypatch.setattr(server, "leaderboard_index", None)
+    return server, db
+
+
+def test_leaderboard_rows_cold_then_warm(server_on_fake_db):
+    server, db = server_on_fake_db
+    scoring = server.get_scoring("schulte")
+    entries = db.leaderboard_entries.docs
+
+    rows = asyncio.run(server.leaderboard_rows(scoring, entries))
+    assert [row["user_id"] for row in rows] == PLAYERS
+    # One users query, no per-row lookups and no user_progress reads
+    assert db.operations == ["users.find"]
+
+    db.reset_counts()
+    assert asyncio.run(server.leaderboard_rows(scoring, entries)) == rows
+    assert db.operations == []
+
+
+def test_get_leaderboard_cold_then_warm(server_on_fake_db):
+    server, db = server_on_fake_db
+    from fastapi import Request, Response
+
+    def page():
+        request = Request({"type": "http", "query_string": b"", "headers": []})
+        return asyncio.run(server.get_leaderboard("schulte", request, Response(), limit=10))
+
+    rows = page()
+    assert [row["user_id"] for row in rows] == PLAYERS
+    assert db.operations == ["leaderboard_entries.find", "users.find"]
+
+    db.reset_counts()
+    assert page() == rows
+    assert db.operations == ["leaderboard_entries.find"]
+
+
+def test_index_syncs_entries_by_updated_at():
+    db = seeded_db()
+    index = LeaderboardIndex(sync_overlap=0)
+    asyncio.run(index.warm(db))
+
+    # Rebuilt values keep a historical last_played but a fresh updated_at
+    entry = db.leaderboard_entries.docs[4]
+    entry.update(best=1.0, last_played=datetime(2020, 1, 1, tzinfo=timezone.utc),
+                 updated_at=datetime.now(timezone.utc) + timedelta(seconds=1))
+    asyncio.run(index.sync(db))
+    assert [e["user_id"] for e in index.top("schulte", "", 2)] == ["user_4", "user_0"]
+
+
+def test_index_reload_drops_deleted_entries():
+    db = seeded_db()
+    index = LeaderboardIndex(sync_overlap=0, reload_interval=3600)
+    asyncio.run(index.warm(db))
+
+    del db.leaderboard_entries.docs[0]
+    asyncio.run(index.sync(db))
+    assert index.board("schulte", "").entry("user_0") is not None
+
+    index.reload_interval = 0
+    asyncio.run(index.sync(db))
+    assert index.board("schulte", "").entry("user_0") is None
+    assert len(index.board("schulte", "")) == len(PLAYERS) - 1
+    assert index.stats()["reloads"] == 1
+
+
+def test_position_without_neighbours_skips_their_reads(server_on_fake_db):
+    server, db = server_on_fake_db
+    scoring = server.get_scoring("schulte")
+
+    rank, total, first_rank, entries = asyncio.run(
+        server.leaderboard_position(scoring, "schulte", "", "user_2", 0)
+    )
+    assert (rank, total, first_rank) == (2, len(PLAYERS), 2)
+    assert [e["user_id"] for e in entries] == ["user_2"]
+    assert sorted(db.operations) == [
+        "leaderboard_entries.count_documents",
+        "leaderboard_entries.count_documents",
+        "leaderboard_entries.find_one",
+    ]
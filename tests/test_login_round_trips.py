@@ -0,0 +1,106 @@
+"""
+Sequential database round trips per login, counted on a fake database
+standing in for Mongo. Drives the create_session and telegram_auth
+handlers directly.
+"""
+import os
+import hmac
+import json
+import time
+import hashlib
+import asyncio
+from urllib.parse import urlencode
+
+import pytest
+
+pytest.importorskip("emergentintegrations")
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "test_database")
+
+from fastapi import Response
+
+import server
+from session_store import MongoSessionStore
+from telegram_init_data import get_secret_key
+from tests.fake_mongo import FakeDB
+
+BOT_TOKEN = "123456:test-bot-token"
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    db = FakeDB()
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(server, "session_store", MongoSessionStore(db))
+    monkeypatch.setattr(server, "token_signer", None)
+    monkeypatch.setenv("TELEGRAM_BOT_TOKEN", BOT_TOKEN)
+
+    async def get_session_data(session_id):
+        return {"email": "player@example.com", "name": "Player", "picture": None, "session_token": f"token_{session_id}"}
+    monkeypatch.setattr(server.emergent_auth_client, "get_session_data", get_session_data)
+    return db
+
+
+def telegram_init_data(telegram_id: int) -> str:
+    fields = {
+        "auth_date": str(int(time.time())),
+        "query_id": f"query_{time.time_ns()}",
+        "user": json.dumps({"id": telegram_id, "first_name": "Tele", "username": "tele"}),
+    }
+    check_string = "\n".join(f"{key}={fields[key]}" for key in sorted(fields))
+    fields["hash"] = hmac.new(get_secret_key(BOT_TOKEN), check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(fields)
+
+
+def test_create_session_new_user(fake_db):
+    asyncio.run(server.create_session(server.SessionRequest(session_id="first"), Response()))
+    # User upsert, then the session insert
+    assert fake_db.operations == ["users.find_one_and_update", "user_sessions.insert_one"]
+    assert fake_db.sequential_round_trips == 2
+
+
+def test_create_session_returning_user(fake_db):
+    asyncio.run(server.create_session(server.SessionRequest(session_id="first"), Response()))
+    fake_db.reset_counts()
+
+    asyncio.run(server.create_session(server.SessionRequest(session_id="second"), Response()))
+    # Session insert, snapshot refresh and session cap run concurrently
+    assert fake_db.operations[0] == "users.find_one_and_update"
+    assert sorted(fake_db.operations[1:]) == [
+        "user_sessions.find", "user_sessions.insert_one", "user_sessions.update_many"
+    ]
+    assert fake_db.sequential_round_trips == 2
+
+
+def test_create_session_user_without_version(fake_db):
+    # Users from before version was tracked are existing users on their
+    # first login: their sessions are refreshed and capped
+    fake_db.users.docs.append({
+        "user_id": "user_legacy", "email": "player@example.com", "name": "Player",
+        "created_at": "2024-01-01T00:00:00+00:00"
+    })
+
+    asyncio.run(server.create_session(server.SessionRequest(session_id="first"), Response()))
+    assert sorted(fake_db.operations[1:]) == [
+        "user_sessions.find", "user_sessions.insert_one", "user_sessions.update_many"
+    ]
+
+
+def test_telegram_auth(fake_db):
+    fake_db.users.docs.append({
+        "user_id": "tg_42", "telegram_id": "42", "email": "42@telegram.user",
+        "name": "Tele", "auth_type": "telegram", "version": 3
+    })
+    fake_db.user_sessions.docs.append({"user_id": "tg_42", "session_token": "tg_old"})
+
+    result = asyncio.run(server.telegram_auth(
+        server.TelegramAuthRequest(init_data=telegram_init_data(42)), Response()
+    ))
+    # User upsert, then the new session, then removal of the replaced
+    # ones; the delete waits for the insert so racing logins keep at most
+    # one session
+    assert fake_db.operations == [
+        "users.find_one_and_update", "user_sessions.insert_one", "user_sessions.delete_many"
+    ]
+    assert fake_db.sequential_round_trips == 3
+    assert [s["session_token"] for s in fake_db.user_sessions.docs] == [result["session_token"]]
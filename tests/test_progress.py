@@ -0,0 +1,179 @@
+"""
+Progress statistics: the update pipeline (applied here by a small evaluator
+of the operators it uses), merge_progress and, against a real database,
+concurrent saves.
+"""
+import os
+import math
+import uuid
+import random
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+from progress import progress_update_pipeline, merge_progress, summarize_progress
+from quantile_sketch import bucket_counts
+from tests.conftest import MONGO_URL
+
+PLAYED_AT = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def evaluate(expr, doc, variables):
+    if isinstance(expr, str):
+        if expr.startswith("$$"):
+            return variables[expr[2:]]
+        if expr.startswith("$"):
+            value = doc
+            for part in expr[1:].split("."):
+                value = value.get(part) if isinstance(value, dict) else None
+            return value
+        return expr
+    if isinstance(expr, dict) and len(expr) == 1 and next(iter(expr)).startswith("$"):
+        op, args = next(iter(expr.items()))
+        if op == "$let":
+            scope = dict(variables)
+            scope.update({name: evaluate(v, doc, variables) for name, v in args["vars"].items()})
+            return evaluate(args["in"], doc, scope)
+        values = [evaluate(arg, doc, variables) for arg in (args if isinstance(args, list) else [args])]
+        if op == "$ifNull":
+            return values[0] if values[0] is not None else values[1]
+        if op == "$add":
+            return sum(values)
+        if op == "$subtract":
+            return values[0] - values[1]
+        if op == "$multiply":
+            return math.prod(values)
+        if op == "$divide":
+            return values[0] / values[1]
+        if op == "$min":
+            return min(values)
+        if op == "$max":
+            return max(values)
+        if op == "$floor":
+            return math.floor(values[0])
+        if op == "$toInt":
+            return int(values[0])
+        raise NotImplementedError(op)
+    return expr
+
+
+def apply_pipeline(doc, pipeline):
+    """Apply $set stages the way an update pipeline does, to a copy of doc."""
+    for stage in pipeline:
+        before = doc
+        doc = {k: dict(v) if isinstance(v, dict) else v for k, v in doc.items()}
+        for field, expr in stage["$set"].items():
+            value = evaluate(expr, before, {})
+            *parents, name = field.split(".")
+            target = doc
+            for parent in parents:
+                target = target.setdefault(parent, {})
+            target[name] = value
+    return doc
+
+
+def fold(scores, lower_is_better=False, batch_size=1):
+    doc = {}
+    for start in range(0, len(scores), batch_size):
+        doc = apply_pipeline(doc, progress_update_pipeline(scores[start:start + batch_size], lower_is_better, PLAYED_AT))
+    return doc
+
+
+def population_m2(scores):
+    mean = sum(scores) / len(scores)
+    return sum((s - mean) ** 2 for s in scores)
+
+
+SCORES = [random.Random(3).uniform(1, 100) for _ in range(57)]
+
+
+def test_pipeline_tracks_count_best_mean_and_m2():
+    doc = fold(SCORES)
+    assert doc["total_games"] == len(SCORES)
+    assert doc["best_score"] == max(SCORES)
+    assert doc["average_score"] == pytest.approx(sum(SCORES) / len(SCORES))
+    assert doc["score_m2"] == pytest.approx(population_m2(SCORES))
+    assert doc["level"] == 1 + len(SCORES) // 10
+    assert doc["score_sketch"] == bucket_counts(SCORES)
+    assert doc["progress_id"].startswith("progress_")
+
+
+def test_pipeline_lower_is_better():
+    assert fold(SCORES, lower_is_better=True)["best_score"] == min(SCORES)
+
+
+def test_pipeline_batches_combine_like_single_games():
+    # Chan's formula: folding batches equals folding games one by one
+    single = fold(SCORES)
+    for batch_size in (2, 5, 57):
+        batched = fold(SCORES, batch_size=batch_size)
+        assert batched["total_games"] == single["total_games"]
+        assert batched["average_score"] == pytest.approx(single["average_score"])
+        assert batched["score_m2"] == pytest.approx(single["score_m2"])
+        assert batched["score_sketch"] == single["score_sketch"]
+
+
+def test_pipeline_keeps_progress_id():
+    doc = fold(SCORES[:3])
+    assert apply_pipeline(doc, progress_update_pipeline([5.0], False, PLAYED_AT))["progress_id"] == doc["progress_id"]
+
+
+def test_merge_progress_equals_progress_of_all_games():
+    parts = [SCORES[:10], SCORES[10:11], SCORES[11:]]
+    docs = [fold(part) for part in parts] + [{"total_games": 0}]
+    docs[0]["last_played"] = datetime(2026, 2, 1, tzinfo=timezone.utc)
+
+    merged = merge_progress(docs, lower_is_better=False)
+    assert merged["total_games"] == len(SCORES)
+    assert merged["best_score"] == max(SCORES)
+    assert merged["average_score"] == pytest.approx(sum(SCORES) / len(SCORES))
+    assert merged["score_m2"] == pytest.approx(population_m2(SCORES))
+    assert merged["score_sketch"] == bucket_counts(SCORES)
+    assert merged["level"] == 1 + len(SCORES) // 10
+    assert merged["last_played"] == datetime(2026, 2, 1, tzinfo=timezone.utc)
+
+
+def test_merge_progress_lower_is_better():
+    docs = [fold(SCORES[:20], lower_is_better=True), fold(SCORES[20:], lower_is_better=True)]
+    assert merge_progress(docs, lower_is_better=True)["best_score"] == min(SCORES)
+
+
+def test_summarize_progress():
+    summary = summarize_progress(fold(SCORES))
+    assert "score_m2" not in summary and "score_sketch" not in summary
+    assert summary["score_stddev"] == pytest.approx(math.sqrt(population_m2(SCORES) / len(SCORES)))
+    median = sorted(SCORES)[len(SCORES) // 2]
+    assert summary["median_score"] == pytest.approx(median, rel=0.03)
+
+
+@pytest.mark.skipif(not MONGO_URL, reason="needs MONGO_URL")
+def test_parallel_saves_lose_no_updates(monkeypatch):
+    pytest.importorskip("emergentintegrations")
+    os.environ.setdefault("DB_NAME", "test_database")
+    import server
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    scores = [float(i % 37 + 1) for i in range(100)]
+
+    async def main():
+        client = AsyncIOMotorClient(MONGO_URL, tz_aware=True)
+        db = client[f"progress_test_{uuid.uuid4().hex[:8]}"]
+        monkeypatch.setattr(server, "db", db)
+        try:
+            await db.user_progress.create_index([("user_id", 1), ("exercise_id", 1)], unique=True)
+            await asyncio.gather(*(
+                server.update_progress("user_parallel", "schulte", score, True) for score in scores
+            ))
+            docs = await db.user_progress.find({"user_id": "user_parallel"}).to_list(None)
+        finally:
+            await client.drop_database(db.name)
+            client.close()
+        return docs
+
+    docs = asyncio.run(main())
+    assert len(docs) == 1
+    assert docs[0]["total_games"] == 100
+    assert docs[0]["best_score"] == min(scores)
+    assert docs[0]["average_score"] == pytest.approx(sum(scores) / len(scores))
+    assert docs[0]["score_m2"] == pytest.approx(population_m2(scores))
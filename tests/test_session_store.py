@@ -0,0 +1,204 @@
+"""
+SessionStore backends: the in-memory store and the Redis store against the
+local Redis-protocol stand-in (resp_server.RespServer).
+"""
+import time
+import asyncio
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+from resp_server import RespServer
+from session_store import MemorySessionStore, RedisSessionStore
+
+
+def run_with_store(kind, test):
+    async def main():
+        if kind == "memory":
+            await test(MemorySessionStore())
+            return
+        server = RespServer()
+        await server.start()
+        store = RedisSessionStore(server.url)
+        try:
+            await test(store)
+        finally:
+            await store.close()
+            await server.close()
+
+    asyncio.run(main())
+
+
+def session_doc(token, user_id="user_1", lifetime=3600.0, created_at=None, version=1):
+    now = datetime.now(timezone.utc)
+    return {
+        "session_id": f"session_{token}",
+        "user_id": user_id,
+        "session_token": token,
+        "user": {"user_id": user_id, "name": "Player"},
+        "user_version": version,
+        "expires_at": now + timedelta(seconds=lifetime),
+        "created_at": created_at or now,
+    }
+
+
+STORES = pytest.mark.parametrize("kind", ["memory", "redis"])
+
+
+@STORES
+def test_create_get_delete(kind):
+    async def test(store):
+        doc = session_doc("token_a")
+        await store.create(doc)
+        session = await store.get("token_a")
+        assert session["user_id"] == "user_1"
+        assert session["user"] == doc["user"]
+        assert abs((session["expires_at"] - doc["expires_at"]).total_seconds()) < 1e-3
+
+        await store.delete("token_a")
+        assert await store.get("token_a") is None
+        assert await store.get("missing") is None
+
+    run_with_store(kind, test)
+
+
+@STORES
+def test_expired_session_is_gone(kind):
+    async def test(store):
+        await store.create(session_doc("token_a", lifetime=0.05))
+        await asyncio.sleep(0.1)
+        assert await store.get("token_a") is None
+
+    run_with_store(kind, test)
+
+
+@STORES
+def test_replace_user_sessions(kind):
+    async def test(store):
+        await store.create(session_doc("token_a"))
+        await store.create(session_doc("token_b"))
+        await store.create(session_doc("other_user", user_id="user_2"))
+
+        await store.replace_user_sessions("user_1", session_doc("token_c"))
+        assert await store.get("token_a") is None
+        assert await store.get("token_b") is None
+        assert (await store.get("token_c"))["user_id"] == "user_1"
+        assert (await store.get("other_user"))["user_id"] == "user_2"
+
+    run_with_store(kind, test)
+
+
+@STORES
+def test_trim_keeps_newest(kind):
+    async def test(store):
+        start = datetime.now(timezone.utc)
+        for i in range(4):
+            await store.create(session_doc(f"token_{i}", created_at=start + timedelta(seconds=i)))
+
+        removed = await store.trim("user_1", 2)
+        assert sorted(removed) == ["token_0", "token_1"]
+        assert [await store.get(f"token_{i}") is not None for i in range(4)] == [False, False, True, True]
+        assert await store.trim("user_1", 2) == []
+
+    run_with_store(kind, test)
+
+
+@STORES
+def test_refresh_snapshots(kind):
+    async def test(store):
+        await store.create(session_doc("old", version=1))
+        await store.create(session_doc("new", version=3))
+
+        await store.refresh_snapshots("user_1", {"user_id": "user_1", "name": "Renamed"}, 2)
+        assert (await store.get("old"))["user"]["name"] == "Renamed"
+        assert (await store.get("new"))["user"]["name"] == "Player"
+
+    run_with_store(kind, test)
+
+
+@STORES
+def test_touch_extends_expiry(kind):
+    async def test(store):
+        await store.create(session_doc("token_a", lifetime=0.2))
+        seen_at = datetime.now(timezone.utc)
+        await store.touch_many({"token_a": (seen_at, 60), "missing": (seen_at, 60)})
+
+        session = await store.get("token_a")
+        assert session["expires_at"] >= seen_at + timedelta(seconds=60)
+
+        # An older touch never shortens the session
+        await store.touch_many({"token_a": (seen_at - timedelta(seconds=30), 60)})
+        assert (await store.get("token_a"))["expires_at"] == session["expires_at"]
+
+    run_with_store(kind, test)
+
+
+@STORES
+def test_touched_session_stays_in_user_index(kind):
+    async def test(store):
+        await store.create(session_doc("token_a", lifetime=0.2))
+        await store.touch_many({"token_a": (datetime.now(timezone.utc), 60)})
+        await asyncio.sleep(0.3)
+
+        # Past its original expiry the session is still found per user
+        await store.replace_user_sessions("user_1", session_doc("token_b"))
+        assert await store.get("token_a") is None
+        await store.trim("user_1", 0)
+        assert await store.get("token_b") is None
+
+    run_with_store(kind, test)
+
+
+@STORES
+def test_short_session_does_not_shorten_user_index(kind):
+    async def test(store):
+        await store.create(session_doc("long", lifetime=60))
+        await store.create(session_doc("short", lifetime=0.1))
+        await asyncio.sleep(0.2)
+
+        assert "long" in await store.trim("user_1", 0)
+        assert await store.get("long") is None
+
+    run_with_store(kind, test)
+
+
+def test_redis_user_index_ttl_follows_longest_session():
+    async def test(store):
+        await store.create(session_doc("long", lifetime=60))
+        await store.create(session_doc("short", lifetime=1))
+        assert await store.client.execute("PTTL", "user_sessions:user_1") > 50_000
+
+        started = time.monotonic()
+        await store.touch_many({"long": (datetime.now(timezone.utc), 600)})
+        ttl_ms = await store.client.execute("PTTL", "user_sessions:user_1")
+        assert ttl_ms > 600_000 - (time.monotonic() - started) * 1000 - 1000
+
+    run_with_store("redis", test)
+
+
+def test_redis_update_retries_when_key_changes():
+    async def main():
+        server = RespServer()
+        await server.start()
+        store = RedisSessionStore(server.url)
+        await store.create(session_doc("token_a"))
+        reads = []
+
+        def touch(raw):
+            reads.append(raw)
+            if len(reads) == 1:
+                # Another worker refreshes the snapshot between our GET and EXEC
+                server._cmd_set(b"session:token_a", raw.replace(b"Player", b"Renamed"), b"KEEPTTL")
+            return [("SET", "session:token_a", raw.replace(b'"session_id"', b'"touched": 1, "session_id"'), "KEEPTTL")]
+
+        try:
+            assert await store.client.update("session:token_a", touch)
+            assert len(reads) == 2
+            raw = await store.client.execute("GET", "session:token_a")
+            assert b"Renamed" in raw and b'"touched": 1' in raw
+        finally:
+            await store.close()
+            await server.close()
+
+    asyncio.run(main())
+